@@ -9,8 +9,19 @@ https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
+from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'assistance_platform_project.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+if settings.DEBUG:
+    # как runserver: статика админки в режиме отладки
+    django_application = ASGIStaticFilesHandler(django_application)
+
+# импорт после get_asgi_application: модулю нужны загруженные приложения
+from notifications.stream import NotificationStreamRouter  # noqa: E402
+
+# поток уведомлений (/api/v1/notifications/stream) обслуживается мимо django view
+application = NotificationStreamRouter(django_application)
@@ -0,0 +1,262 @@
+import base64
+import datetime
+import json
+import operator
+from collections import OrderedDict
+from decimal import Decimal
+from functools import reduce
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.db import connection
+from django.db.models import F, Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+
+class KeysetPagination(BasePagination):
+    # курсорная (keyset) пагинация.
+    # сортировка берется из order_by у queryset (или Meta.ordering модели), к ней в конец добавляется id,
+    # чтобы порядок был строго определен. В курсоре лежат значения всех полей сортировки у крайней
+    # строки страницы, следующая страница выбирается условием "строго после этих значений".
+    # В отличие от OFFSET стоимость одинаковая на любой глубине, COUNT(*) не нужен,
+    # а вставка новых строк не сдвигает уже выданные страницы.
+    # null стоит там же, где его держит btree индекс бд (в postgres - больше любого значения, в sqlite - меньше)
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.model = queryset.model
+        self.ordering = self.get_ordering(queryset)
+        # view может отдать ключ своих фильтров (get_pagination_key), тогда курсор привязывается к нему
+        self.key = view.get_pagination_key() if hasattr(view, 'get_pagination_key') else None
+
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor['reverse']
+
+        queryset = queryset.order_by(*self.get_order_by(reverse))
+        if cursor is not None:
+            queryset = queryset.filter(self.get_cursor_filter(cursor['values'], reverse))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if reverse:
+            results.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = cursor is not None
+
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([('next', self.get_next_link()),
+                                     ('previous', self.get_previous_link()),
+                                     ('results', data)]))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.get_values(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            # пустая страница (например, последние строки удалили) - назад ведем на начало списка
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.encode_cursor(self.get_values(self.page[0]), reverse=True)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    # сортировка
+    def get_ordering(self, queryset):
+        # возвращает список троек (путь к полю, по убыванию ли, может ли значение быть null)
+        model = queryset.model
+        ordering = []
+        for field in queryset.query.order_by or model._meta.ordering:
+            if not isinstance(field, str):
+                raise TypeError('KeysetPagination поддерживает сортировку только по именам полей')
+            if field == '?':
+                continue
+            descending = field.startswith('-')
+            ordering += self.expand_relation(model, field.lstrip('-'), descending)
+
+        pk_name = model._meta.pk.name
+        ordering = [(pk_name if path == 'pk' else path, descending, nullable)
+                    for path, descending, nullable in ordering]
+        if not any(path == pk_name for path, _, _ in ordering):
+            # id в конце делает порядок однозначным; направление как у последнего поля,
+            # чтобы подходящий составной индекс можно было пройти в одну сторону
+            ordering.append((pk_name, ordering[-1][1] if ordering else False, False))
+        return ordering
+
+    def expand_relation(self, model, path, descending, nullable=False):
+        # order_by('subject') на самом деле сортирует по Meta.ordering связанной модели,
+        # значения для курсора нужно брать оттуда же
+        field = None
+        current_model = model
+        for part in path.split('__'):
+            try:
+                field = current_model._meta.get_field(part)
+            except (AttributeError, FieldDoesNotExist):
+                # аннотация (например relevance) или путь через нее, про null ничего не известно
+                return [(path, descending, True)]
+            nullable = nullable or field.null
+            current_model = field.related_model if field.is_relation else None
+        if not field.is_relation or field.many_to_many or field.one_to_many:
+            return [(path, descending, nullable)]
+
+        expanded = []
+        for related_field in current_model._meta.ordering or [current_model._meta.pk.name]:
+            related_descending = related_field.startswith('-')
+            expanded += [(f'{path}__{related_path}', related_path_descending, related_path_nullable)
+                         for related_path, related_path_descending, related_path_nullable in
+                         self.expand_relation(current_model, related_field.lstrip('-'),
+                                              descending != related_descending, nullable)]
+        return expanded
+
+    def get_order_by(self, reverse):
+        # порядок null не указывается: бд ставит их так же, как в своих индексах, и обычный индекс (field, id)
+        # проходится в любую сторону без отдельной сортировки. NULLS LAST в sqlite индексом не обслуживается
+        return [F(path).desc() if descending != reverse else F(path).asc() for path, descending, _ in self.ordering]
+
+    def get_cursor_filter(self, values, reverse):
+        # (a, b, id) > (x, y, z) раскрывается в
+        # a > x OR (a = x AND b > y) OR (a = x AND b = y AND id > z), с учетом направления и null
+        nulls_largest = connection.features.nulls_order_largest
+        conditions = []
+        equal_so_far = Q()
+        for (path, descending, nullable), value in zip(self.ordering, values):
+            ascending = descending == reverse
+            if ascending == nulls_largest:
+                # null в конце: после значения идут следующие значения и null, после null - ничего
+                if value is None:
+                    after = None
+                else:
+                    after = Q(**{f'{path}__{"gt" if ascending else "lt"}': value})
+                    if nullable:
+                        after |= Q(**{f'{path}__isnull': True})
+            else:
+                # null в начале: после него идет любое не null значение, null после значения уже не встретится
+                if value is None:
+                    after = Q(**{f'{path}__isnull': False})
+                else:
+                    after = Q(**{f'{path}__{"gt" if ascending else "lt"}': value})
+            equal = Q(**{f'{path}__isnull': True}) if value is None else Q(**{path: value})
+
+            if after is not None:
+                conditions.append(equal_so_far & after)
+            equal_so_far &= equal
+        cursor_filter = reduce(operator.or_, conditions)
+
+        path, descending, nullable = self.ordering[0]
+        if values[0] is not None and not nullable:
+            # избыточное условие a >= x дает планировщику границу для range scan по индексу,
+            # по одному OR-выражению он ее не выводит
+            cursor_filter &= Q(**{f'{path}__{"lte" if descending != reverse else "gte"}': values[0]})
+        return cursor_filter
+
+    # курсор
+    def get_values(self, obj):
+        values = []
+        for path, _, _ in self.ordering:
+            value = obj
+            for part in path.split('__'):
+                value = getattr(value, part, None) if value is not None else None
+            values.append(value)
+        return values
+
+    def encode_cursor(self, values, reverse):
+        payload = {'o': [path for path, _, _ in self.ordering],
+                   'v': [self.encode_value(value) for value in values],
+                   'r': reverse}
+        if self.key is not None:
+            payload['k'] = self.key
+        cursor = base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            values = payload['v']
+            reverse = bool(payload['r'])
+            ordering = payload['o']
+        except (TypeError, ValueError, KeyError, UnicodeDecodeError):
+            raise ValidationError({'detail': 'Некорректный курсор пагинации', 'error_code': 'invalid_cursor'})
+
+        if ordering != [path for path, _, _ in self.ordering] or len(values) != len(self.ordering):
+            # курсор получен при другой сортировке
+            raise ValidationError({'detail': 'Курсор пагинации не соответствует текущей сортировке',
+                                   'error_code': 'invalid_cursor'})
+        if payload.get('k') != self.key:
+            raise ValidationError({'detail': 'Курсор пагинации получен для других фильтров',
+                                   'error_code': 'invalid_cursor'})
+        try:
+            values = [self.parse_value(path, value) for (path, _, _), value in zip(self.ordering, values)]
+        except (DjangoValidationError, TypeError, ValueError):
+            # курсор подделан или поврежден: значение не подходит к полю сортировки
+            raise ValidationError({'detail': 'Некорректный курсор пагинации', 'error_code': 'invalid_cursor'})
+        return {'values': values, 'reverse': reverse}
+
+    def parse_value(self, path, value):
+        # значение из курсора приводится к типу поля до того, как попадет в запрос
+        if value is None:
+            return None
+        if not isinstance(value, (str, int, float, bool)):
+            raise TypeError(f'{path}: unexpected cursor value')
+        field = self.get_path_field(path)
+        if field is None:
+            # аннотация (relevance), в курсоре может быть только число
+            if isinstance(value, str):
+                raise TypeError(f'{path}: unexpected cursor value')
+            return value
+        value = field.to_python(value)
+        # целые за пределами колонки (в sqlite - OverflowError при выполнении запроса)
+        integer_range = connection.ops.integer_field_ranges.get(field.get_internal_type())
+        if integer_range is not None:
+            min_value, max_value = integer_range
+            if (min_value is not None and value < min_value) or (max_value is not None and value > max_value):
+                raise ValueError(f'{path}: cursor value out of range')
+        return value
+
+    def get_path_field(self, path):
+        # поле модели по пути сортировки (как в expand_relation), None - аннотация
+        field = None
+        model = self.model
+        for part in path.split('__'):
+            try:
+                field = model._meta.get_field(part)
+            except (AttributeError, FieldDoesNotExist):
+                return None
+            model = field.related_model if field.is_relation else None
+        return field.target_field if field.is_relation else field
+
+    @staticmethod
+    def encode_value(value):
+        if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+            return value.isoformat()
+        if isinstance(value, Decimal):
+            return str(value)
+        if hasattr(value, 'pk'):
+            return value.pk
+        return value
@@ -28,7 +28,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
-DEFAULT_FILE_STORAGE = 'django_hashedfilenamestorage.storage.HashedFilenameFileSystemStorage'
+DEFAULT_FILE_STORAGE = 'assistance_platform_project.storage.HashedFilenameFileSystemStorage'
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/4.1/howto/deployment/checklist/
@@ -50,6 +50,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     # Local
     'users.apps.UsersConfig',
@@ -82,6 +83,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'notifications.middleware.NotificationDispatchMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     # cors
@@ -141,6 +143,38 @@ DATABASES = {
 #         'NAME': BASE_DIR / 'db.sqlite3',
 #     }
 # }
+# Cache
+# по умолчанию кэш в памяти процесса. Если запускается несколько процессов (gunicorn/uvicorn workers),
+# нужен общий бэкенд, например CACHE_BACKEND=django.core.cache.backends.db.DatabaseCache
+# и CACHE_LOCATION=cache_table (python manage.py createcachetable)
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# Email
+# письма с уведомлениями не отправляются из запросов: они пишутся в таблицу EmailOutbox
+# и отправляются отдельным процессом (python manage.py send_notification_emails)
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+EMAIL_HOST = os.getenv('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.getenv('EMAIL_PORT', 25))
+EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS') == 'True'
+EMAIL_TIMEOUT = 30
+DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'webmaster@localhost')
+
+# pub/sub для потока уведомлений (/api/v1/notifications/stream). В памяти процесса - при одном воркере asgi сервера,
+# notifications.broker.PostgresNotificationBroker - при нескольких процессах (LISTEN/NOTIFY)
+NOTIFICATIONS_BROKER = os.getenv('NOTIFICATIONS_BROKER', 'notifications.broker.InProcessNotificationBroker')
+# через сколько дней прочитанные уведомления переносятся в архив (archive_notifications)
+NOTIFICATIONS_RETENTION_DAYS = int(os.getenv('NOTIFICATIONS_RETENTION_DAYS', 90))
+# миниатюры изображения профиля: название -> сторона квадрата в пикселях. Каждая сохраняется в webp и jpeg
+# (generate_profile_thumbnails), api отдает их вместо оригинала
+PROFILE_IMAGE_THUMBNAIL_SIZES = {'small': 64, 'medium': 256}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
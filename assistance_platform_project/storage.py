@@ -0,0 +1,32 @@
+import hashlib
+import os
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+
+def get_content_hash(content):
+    hasher = hashlib.sha1()
+    position = content.tell() if hasattr(content, 'tell') else None
+    content.seek(0)
+    for chunk in content.chunks():
+        hasher.update(chunk)
+    if position is not None:
+        content.seek(position)
+    return hasher.hexdigest()
+
+
+class HashedFilenameFileSystemStorage(FileSystemStorage):
+    # имя файла - sha1 содержимого с исходным расширением, в той же папке (upload_to).
+    # Одинаковые файлы хранятся один раз, а имя меняется вместе с содержимым, так что файлы можно кэшировать навсегда.
+    # Имена совпадают с django_hashedfilenamestorage, который не работает с django 4 (импортирует force_text)
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = os.path.join(os.path.dirname(name), get_content_hash(content) + os.path.splitext(name)[1].lower())
+        if self.exists(name):
+            # такой файл уже загружен
+            return name.replace('\\', '/')
+        return super().save(name, content, max_length)
@@ -23,9 +23,23 @@ echo "Loading some tasks"
 python manage.py loaddata fixtures/tasks.json
 echo "Loading some notifications"
 python manage.py loaddata fixtures/notifications.json
+python manage.py recount_unread_notifications
 echo "Loading some applications"
 python manage.py loaddata fixtures/applications.json
-
-
-echo "Runserver"
-python manage.py runserver 0.0.0.0:8000
+echo "Repairing tasks counters"
+python manage.py repair_task_counters
+echo "Rebuilding users statistics"
+python manage.py rebuild_user_stats
+
+
+echo "Starting notification emails worker"
+python manage.py send_notification_emails &
+echo "Starting notifications archive worker"
+python manage.py archive_notifications --interval 3600 &
+echo "Starting profile thumbnails worker"
+python manage.py generate_profile_thumbnails --enqueue-missing &
+
+echo "Run asgi server"
+# asgi, а не runserver: поток уведомлений /api/v1/notifications/stream держит долгие соединения.
+# Один воркер - подписчики в памяти процесса (NOTIFICATIONS_BROKER), для нескольких нужен PostgresNotificationBroker
+uvicorn assistance_platform_project.asgi:application --host 0.0.0.0 --port 8000
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from notifications.models import Notification
+from notifications.models import Notification, ArchivedNotification, EmailOutbox
 
 
 class NotificationAdmin(admin.ModelAdmin):
@@ -13,5 +13,29 @@ class NotificationAdmin(admin.ModelAdmin):
                     'created_at')
 
 
+class ArchivedNotificationAdmin(admin.ModelAdmin):
+    model = ArchivedNotification
+    list_display = ('user',
+                    'type',
+                    'affected_object_id',
+                    'message',
+                    'created_at',
+                    'archived_at')
+
+
+class EmailOutboxAdmin(admin.ModelAdmin):
+    model = EmailOutbox
+    list_display = ('recipient',
+                    'subject',
+                    'status',
+                    'attempts',
+                    'next_attempt_at',
+                    'created_at',
+                    'sent_at')
+    list_filter = ('status',)
+
+
 # Register your models here.
 admin.site.register(Notification, NotificationAdmin)
+admin.site.register(ArchivedNotification, ArchivedNotificationAdmin)
+admin.site.register(EmailOutbox, EmailOutboxAdmin)
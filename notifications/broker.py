@@ -0,0 +1,155 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# pub/sub для потока уведомлений (см. stream.py).
+# publish вызывается из синхронного кода в любом потоке (после коммита уведомлений),
+# подписчики живут в event loop asgi сервера. Реализация выбирается настройкой NOTIFICATIONS_BROKER
+
+
+class Subscription:
+    # очередь событий одного соединения. Если клиент не успевает читать и очередь переполнилась,
+    # подписка закрывается: клиент переподключится с Last-Event-ID и дочитает пропущенное из бд
+    max_size = 100
+
+    def __init__(self, user_id, loop):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(self.max_size)
+        self.is_closed = False
+
+    def put(self, event):
+        # только из event loop подписки
+        if self.is_closed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.close()
+
+    def close(self):
+        # None в очереди - сигнал потоку завершиться
+        self.is_closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class InProcessNotificationBroker:
+    # подписчики в памяти процесса. Годится, когда api и поток обслуживает один процесс
+    # (uvicorn с одним воркером): синхронные view выполняются в его же потоках
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def subscribe(self, user_id):
+        # вызывается из event loop
+        subscription = Subscription(user_id, asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def subscriptions_count(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def publish(self, user_id, event):
+        self.deliver(user_id, event)
+
+    def deliver(self, user_id, event):
+        # потокобезопасно. Один call_soon_threadsafe на event loop, а не на подписку:
+        # каждый вызов будит loop через сокет, при тысячах подписчиков это основная стоимость раздачи
+        subscriptions_by_loop = defaultdict(list)
+        with self._lock:
+            for subscription in self._subscriptions.get(user_id, ()):
+                subscriptions_by_loop[subscription.loop].append(subscription)
+        for loop, subscriptions in subscriptions_by_loop.items():
+            loop.call_soon_threadsafe(put_event, subscriptions, event)
+
+
+def put_event(subscriptions, event):
+    for subscription in subscriptions:
+        subscription.put(event)
+
+
+class PostgresNotificationBroker(InProcessNotificationBroker):
+    # между процессами через LISTEN/NOTIFY postgres: publish делает pg_notify через обычное соединение
+    # django, а в каждом процессе с подписчиками поток слушает канал отдельным соединением
+    # и раздает события своим подписчикам
+    channel = 'notifications_stream'
+    # лимит payload у NOTIFY - 8000 байт, длинный текст уведомления обрезается (полный есть в бд)
+    max_payload_size = 7500
+    reconnect_delay = 1
+
+    def __init__(self):
+        super().__init__()
+        self._listener = None
+
+    def subscribe(self, user_id):
+        self._start_listener()
+        return super().subscribe(user_id)
+
+    def publish(self, user_id, event):
+        payload = json.dumps({'user': user_id, 'event': event}, ensure_ascii=False)
+        if len(payload.encode()) > self.max_payload_size:
+            event = dict(event, message=event.get('message', '')[:self.max_payload_size // 8])
+            payload = json.dumps({'user': user_id, 'event': event}, ensure_ascii=False)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.channel, payload])
+
+    def _start_listener(self):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='notifications-listener', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        import psycopg2
+        from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+        while True:
+            listen_connection = None
+            try:
+                listen_connection = psycopg2.connect(**connection.get_connection_params())
+                listen_connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                with listen_connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN {self.channel}')
+                while True:
+                    if select.select([listen_connection], [], [], 5) == ([], [], []):
+                        continue
+                    listen_connection.poll()
+                    while listen_connection.notifies:
+                        payload = json.loads(listen_connection.notifies.pop(0).payload)
+                        self.deliver(payload['user'], payload['event'])
+            except Exception:
+                logger.exception('Соединение для LISTEN %s потеряно, переподключение', self.channel)
+                if listen_connection is not None:
+                    listen_connection.close()
+                time.sleep(self.reconnect_delay)
+
+
+@lru_cache(maxsize=None)
+def get_notification_broker():
+    return import_string(settings.NOTIFICATIONS_BROKER)()
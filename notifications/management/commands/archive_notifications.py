@@ -0,0 +1,62 @@
+import datetime
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from notifications.models import Notification, ArchivedNotification
+
+ARCHIVED_FIELDS = ('id', 'user_id', 'type', 'affected_object_id', 'message', 'checked', 'created_at')
+
+
+class Command(BaseCommand):
+    help = ('Переносит прочитанные уведомления старше --older-than-days дней (по умолчанию '
+            'NOTIFICATIONS_RETENTION_DAYS) в ArchivedNotification и удаляет их из Notification. '
+            'Пачками по --batch-size, каждая пачка - отдельная короткая транзакция. '
+            'С --interval работает постоянно, повторяя архивацию раз в --interval секунд')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=settings.NOTIFICATIONS_RETENTION_DAYS)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0,
+                            help='пауза между пачками в секундах, чтобы не нагружать бд')
+        parser.add_argument('--interval', type=float, help='повторять архивацию раз в столько секунд')
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                archived = self.archive(options)
+                self.stdout.write(self.style.SUCCESS(f'Перенесено в архив уведомлений: {archived}'))
+                if options['interval'] is None:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+    def archive(self, options):
+        cutoff = timezone.now() - datetime.timedelta(days=options['older_than_days'])
+        archived = 0
+        while True:
+            batch_size = self.archive_batch(cutoff, options['batch_size'])
+            archived += batch_size
+            if batch_size < options['batch_size']:
+                return archived
+            if options['pause']:
+                time.sleep(options['pause'])
+
+    @staticmethod
+    def archive_batch(cutoff, batch_size):
+        with transaction.atomic():
+            # skip_locked - не ждем строки, которые сейчас меняет кто-то другой, они уйдут в следующий запуск
+            rows = list(Notification.objects.select_for_update(skip_locked=True)
+                        .filter(checked=True, created_at__lt=cutoff)
+                        .order_by('created_at').values(*ARCHIVED_FIELDS)[:batch_size])
+            if not rows:
+                return 0
+            # ignore_conflicts - повторный перенос (например, после ручного восстановления) не падает
+            ArchivedNotification.objects.bulk_create([ArchivedNotification(**row) for row in rows],
+                                                     ignore_conflicts=True)
+            Notification.objects.filter(id__in=[row['id'] for row in rows]).delete()
+        return len(rows)
@@ -0,0 +1,185 @@
+import asyncio
+import resource
+import time
+import tracemalloc
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from notifications.broker import get_notification_broker
+from notifications.stream import STREAM_PATH, notification_stream
+from users.models import User
+
+
+class StreamClient:
+    # клиент для прогона потока в процессе, без http: receive ждет отключения, send считает события
+    def __init__(self, stats):
+        self.stats = stats
+        self.disconnected = asyncio.Event()
+        self.is_ready = False
+
+    async def receive(self):
+        await self.disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        if message['type'] != 'http.response.body':
+            return
+        if not self.is_ready:
+            self.is_ready = True
+            self.stats.on_ready()
+        elif b'event: notification' in message.get('body', b''):
+            self.stats.on_delivered()
+
+
+class StreamStats:
+    def __init__(self):
+        self.ready = 0
+        self.delivered = 0
+        self._waiter = None
+        self._target = None
+
+    def wait_for(self, name, target):
+        self._waiter = asyncio.get_running_loop().create_future()
+        self._target = (name, target)
+        self._check()
+        return self._waiter
+
+    def on_ready(self):
+        self.ready += 1
+        self._check()
+
+    def on_delivered(self):
+        self.delivered += 1
+        self._check()
+
+    def _check(self):
+        if self._waiter is not None and not self._waiter.done() and getattr(self, self._target[0]) >= self._target[1]:
+            self._waiter.set_result(None)
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест потока уведомлений: сколько простаивающих соединений держит один воркер. '
+            'По умолчанию поток запускается прямо в процессе команды (без http): открывает --connections '
+            'подписок для --users пользователей, меряет память на соединение (tracemalloc) и время раздачи '
+            '--events уведомлений всем подписчикам. С --url открывает настоящие TCP соединения к запущенному '
+            'asgi серверу и держит их --hold секунд, считая, сколько из них пережило простой')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=5000)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--events', type=int, default=10)
+        parser.add_argument('--url', help='например http://localhost:8000')
+        parser.add_argument('--hold', type=float, default=30)
+        parser.add_argument('--concurrency', type=int, default=200, help='одновременных подключений при открытии')
+
+    def handle(self, *args, **options):
+        users = list(User.objects.filter(is_active=True).order_by('id')[:options['users']])
+        if not users:
+            raise CommandError('Нет активных пользователей для подключения')
+        tokens = [str(AccessToken.for_user(user)) for user in users]
+        self.raise_files_limit()
+
+        if options['url']:
+            asyncio.run(self.run_over_network(options, tokens))
+        else:
+            asyncio.run(self.run_in_process(options, [user.id for user in users], tokens))
+
+    def raise_files_limit(self):
+        # каждое соединение - файловый дескриптор, по умолчанию лимит часто 1024
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    async def run_in_process(self, options, users_ids, tokens):
+        broker = get_notification_broker()
+        stats = StreamStats()
+        clients = []
+        streams = []
+
+        tracemalloc.start()
+        memory_before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        for i in range(options['connections']):
+            client = StreamClient(stats)
+            scope = {'type': 'http', 'method': 'GET', 'path': STREAM_PATH, 'query_string': b'',
+                     'headers': [(b'authorization', f'Bearer {tokens[i % len(tokens)]}'.encode())]}
+            clients.append(client)
+            streams.append(asyncio.ensure_future(notification_stream(scope, client.receive, client.send)))
+        await stats.wait_for('ready', len(clients))
+        opened_in = time.perf_counter() - started
+        memory_per_connection = (tracemalloc.get_traced_memory()[0] - memory_before) / len(clients)
+        tracemalloc.stop()
+
+        self.stdout.write(f'Открыто соединений: {stats.ready} за {opened_in:.2f} с, '
+                          f'подписок в брокере: {broker.subscriptions_count()}')
+        self.stdout.write(f'Память python на простаивающее соединение: {memory_per_connection / 1024:.1f} КБ')
+
+        loop = asyncio.get_running_loop()
+        timings = []
+        for i in range(options['events']):
+            event = {'id': -(i + 1), 'type': 'benchmark_notification', 'message': 'benchmark'}
+            started = time.perf_counter()
+            # publish вызывается из потока, как после коммита в синхронном view
+            waiter = stats.wait_for('delivered', (i + 1) * len(clients))
+            await loop.run_in_executor(None, lambda: [broker.publish(user_id, event) for user_id in users_ids])
+            await waiter
+            timings.append((time.perf_counter() - started) * 1000)
+        if timings:
+            timings.sort()
+            self.stdout.write(f'Раздача уведомления всем {len(clients)} подписчикам: '
+                              f'медиана {timings[len(timings) // 2]:.1f} мс, максимум {timings[-1]:.1f} мс')
+
+        for client in clients:
+            client.disconnected.set()
+        await asyncio.gather(*streams)
+        self.stdout.write(self.style.SUCCESS(f'Соединения закрыты, подписок осталось: {broker.subscriptions_count()}'))
+
+    async def run_over_network(self, options, tokens):
+        url = urlsplit(options['url'])
+        host, port = url.hostname, url.port or 80
+        semaphore = asyncio.Semaphore(options['concurrency'])
+        received = [0]
+
+        async def connect(token):
+            async with semaphore:
+                reader, writer = await asyncio.open_connection(host, port)
+                writer.write(f'GET {STREAM_PATH}?token={token} HTTP/1.1\r\nHost: {url.netloc}\r\n'
+                             f'Accept: text/event-stream\r\n\r\n'.encode())
+                await writer.drain()
+                buffer = b''
+                while b'unread_count' not in buffer:
+                    chunk = await reader.read(4096)
+                    if not chunk:
+                        raise ConnectionError(buffer[:100])
+                    buffer += chunk
+                if b' 200 ' not in buffer.split(b'\r\n', 1)[0]:
+                    raise ConnectionError(buffer[:100])
+                return reader, writer
+
+        async def hold(reader):
+            # читаем heartbeat, пока сервер держит соединение
+            while True:
+                chunk = await reader.read(4096)
+                if not chunk:
+                    return False
+                received[0] += len(chunk)
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*[connect(tokens[i % len(tokens)]) for i in range(options['connections'])],
+                                       return_exceptions=True)
+        connections = [result for result in results if not isinstance(result, BaseException)]
+        errors = [result for result in results if isinstance(result, BaseException)]
+        self.stdout.write(f'Открыто соединений: {len(connections)} за {time.perf_counter() - started:.2f} с, '
+                          f'ошибок: {len(errors)}' + (f' (первая: {errors[0]!r})' if errors else ''))
+
+        holders = [asyncio.ensure_future(hold(reader)) for reader, _ in connections]
+        await asyncio.wait(holders, timeout=options['hold'])
+        alive = sum(not holder.done() for holder in holders)
+        self.stdout.write(self.style.SUCCESS(f'Через {options["hold"]:.0f} с открыто: {alive} из {len(connections)}, '
+                                             f'получено {received[0]} байт heartbeat'))
+        for holder in holders:
+            holder.cancel()
+        for _, writer in connections:
+            writer.close()
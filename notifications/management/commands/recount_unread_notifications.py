@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery, Q
+from django.db.models.functions import Coalesce
+
+from notifications.models import Notification
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает User.unread_notifications_count по таблице уведомлений. '
+            'Нужен после загрузки фикстур или ручных правок в бд, которые обходят диспетчер уведомлений')
+
+    def handle(self, *args, **options):
+        unread = Coalesce(Subquery(Notification.objects.filter(user=OuterRef('pk'), checked=False).order_by()
+                                   .values('user').annotate(amount=Count('pk')).values('amount')), 0)
+        repaired = (User.objects.annotate(actual_unread=unread)
+                    .filter(~Q(unread_notifications_count=unread))
+                    .update(unread_notifications_count=unread))
+        self.stdout.write(self.style.SUCCESS(f'Исправлено счетчиков: {repaired}'))
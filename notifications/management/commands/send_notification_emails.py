@@ -0,0 +1,117 @@
+import datetime
+import time
+
+from django.core import mail
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from notifications.models import EmailOutbox
+
+
+class Command(BaseCommand):
+    help = ('Отправляет письма из EmailOutbox пачками через одно SMTP соединение. '
+            'Неудачные письма повторяются с экспоненциальной задержкой, после --max-attempts помечаются failed. '
+            'Без --once работает постоянно, опрашивая очередь раз в --poll-interval секунд')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--max-attempts', type=int, default=5)
+        parser.add_argument('--backoff', type=int, default=60,
+                            help='задержка перед первым повтором в секундах, дальше удваивается')
+        parser.add_argument('--max-backoff', type=int, default=6 * 60 * 60)
+        parser.add_argument('--poll-interval', type=float, default=5)
+        parser.add_argument('--claim-timeout', type=int, default=10 * 60,
+                            help='через сколько секунд забранные, но не отправленные письма снова доступны')
+        parser.add_argument('--once', action='store_true', help='отправить все, что готово, и выйти')
+
+    def handle(self, *args, **options):
+        self.options = options
+        # одно соединение на все пачки, открывается заново только после обрыва
+        self.connection = mail.get_connection(fail_silently=False)
+        sent = failed = 0
+        try:
+            while True:
+                batch_sent, batch_failed, batch_size = self.send_batch()
+                sent += batch_sent
+                failed += batch_failed
+                if batch_size < options['batch_size']:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.connection.close()
+        self.stdout.write(self.style.SUCCESS(f'Отправлено писем: {sent}, с ошибкой: {failed}'))
+
+    def send_batch(self):
+        emails = self.claim_batch()
+        if not emails:
+            return 0, 0, 0
+
+        # отправка идет вне транзакции: блокировки строк не держатся, пока ждем SMTP
+        sent = failed = 0
+        connection_error = self.open_connection()
+        for email in emails:
+            if connection_error is not None:
+                # сервер недоступен - все письма пачки уходят на повтор
+                failed += 1
+                self.schedule_retry(email, connection_error)
+                continue
+            message = mail.EmailMessage(subject=email.subject, body=email.body, to=[email.recipient],
+                                        connection=self.connection)
+            try:
+                message.send()
+            except Exception as error:
+                failed += 1
+                self.schedule_retry(email, error)
+                # после ошибки соединение могло оборваться, следующее письмо пойдет через новое
+                connection_error = self.reopen_connection()
+            else:
+                sent += 1
+                email.status = 'S'
+                email.sent_at = timezone.now()
+                email.last_error = ''
+
+        EmailOutbox.objects.bulk_update(emails, ['status', 'next_attempt_at', 'last_error', 'sent_at'])
+        return sent, failed, len(emails)
+
+    def claim_batch(self):
+        # письма забираются короткой транзакцией: попытка засчитывается сразу, а next_attempt_at сдвигается
+        # на --claim-timeout, чтобы их не взял другой воркер. Если воркер упадет до записи результата,
+        # письма снова станут доступны после этого срока
+        now = timezone.now()
+        with transaction.atomic():
+            # skip_locked - несколько воркеров разбирают очередь, не мешая друг другу
+            emails = list(EmailOutbox.objects.select_for_update(skip_locked=True)
+                          .filter(status='P', next_attempt_at__lte=now)
+                          .order_by('next_attempt_at', 'id')[:self.options['batch_size']])
+            for email in emails:
+                email.attempts += 1
+                email.next_attempt_at = now + datetime.timedelta(seconds=self.options['claim_timeout'])
+            EmailOutbox.objects.bulk_update(emails, ['attempts', 'next_attempt_at'])
+        return emails
+
+    def open_connection(self):
+        # None, если соединение открыто, иначе ошибка открытия
+        try:
+            self.connection.open()
+        except Exception as error:
+            return error
+        return None
+
+    def reopen_connection(self):
+        try:
+            self.connection.close()
+        except Exception:
+            pass
+        return self.open_connection()
+
+    def schedule_retry(self, email, error):
+        email.last_error = f'{type(error).__name__}: {error}'
+        if email.attempts >= self.options['max_attempts']:
+            email.status = 'F'
+            return
+        delay = min(self.options['backoff'] * 2 ** (email.attempts - 1), self.options['max_backoff'])
+        email.next_attempt_at = timezone.now() + datetime.timedelta(seconds=delay)
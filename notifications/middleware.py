@@ -0,0 +1,11 @@
+from .models import notification_dispatcher
+
+
+class NotificationDispatchMiddleware:
+    # уведомления, созданные за время запроса, вставляются в бд пачкой в конце запроса
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with notification_dispatcher.collect():
+            return self.get_response(request)
@@ -1,7 +1,17 @@
-from django.db import models
+import logging
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
 from django.utils import timezone
 
 from users.models import User
+from .broker import get_notification_broker
+
+logger = logging.getLogger(__name__)
 
 
 class Notification(models.Model):
@@ -16,12 +26,209 @@ class Notification(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # список уведомлений пользователя с keyset пагинацией: ORDER BY created_at DESC, id DESC
+            models.Index(fields=['user', '-created_at', '-id'], name='notification_user_created_idx'),
+            # то же с фильтром по прочитанности, а также отметка прочитанными и пересчет непрочитанных
+            models.Index(fields=['user', 'checked', '-created_at', '-id'], name='notification_user_checked_idx'),
+            # выборка кандидатов на архивацию (archive_notifications)
+            models.Index(fields=['created_at'], condition=models.Q(checked=True), name='notification_checked_old_idx'),
+        ]
 
     def __str__(self):
         return 'notification' + str(self.id)
 
 
-def new_notification(send_email=False, **kwargs):
-    Notification.objects.create(**kwargs)
-    if send_email:
-        pass
+class ArchivedNotification(models.Model):
+    # прочитанные уведомления старше NOTIFICATIONS_RETENTION_DAYS, перенесенные командой archive_notifications.
+    # id сохраняется от исходного уведомления
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_notifications')
+
+    type = models.CharField(max_length=60, default='general_notification')
+    affected_object_id = models.IntegerField(default=None, blank=True, null=True)
+
+    message = models.TextField()
+    checked = models.BooleanField(default=True)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='archived_notif_user_idx'),
+        ]
+
+    def __str__(self):
+        return 'archived notification' + str(self.id)
+
+
+EMAIL_OUTBOX_STATUS_CHOICES = [('P', 'pending'), ('S', 'sent'), ('F', 'failed')]
+
+
+class EmailOutbox(models.Model):
+    # письма к уведомлениям. Строка пишется в той же транзакции, что и само уведомление,
+    # так что письмо не потеряется и не уйдет без уведомления. Отправляет их
+    # management команда send_notification_emails пачками, с повторами при ошибках
+    notification = models.ForeignKey(Notification, on_delete=models.SET_NULL, null=True, related_name='emails')
+    recipient = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+
+    status = models.CharField(max_length=1, choices=EMAIL_OUTBOX_STATUS_CHOICES, default='P')
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # выборка очередной пачки воркером
+            models.Index(fields=['status', 'next_attempt_at'], name='email_outbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        return 'email ' + str(self.id) + ' to ' + self.recipient
+
+
+def change_unread_counters(deltas):
+    # deltas - {user_id: на сколько изменить счетчик непрочитанных}.
+    # Один UPDATE на каждое различное значение изменения: при рассылке многим пользователям это один запрос
+    users_by_delta = defaultdict(list)
+    for user_id, delta in deltas.items():
+        if delta:
+            users_by_delta[delta].append(user_id)
+    for delta, users_ids in users_by_delta.items():
+        User.objects.filter(pk__in=users_ids).update(
+            unread_notifications_count=Greatest(F('unread_notifications_count') + delta, 0))
+
+
+EMAIL_SUBJECT = 'Новое уведомление на платформе взаимопомощи'
+
+
+class NotificationDispatcher:
+    # уведомления не пишутся в бд по одному: они копятся и вставляются через bulk_create пачками по chunk_size.
+    # Уведомление, созданное внутри транзакции, попадает в очередь только после ее коммита
+    # (при откате оно просто пропадает). Пока открыт collect() (NotificationDispatchMiddleware держит его
+    # на время запроса), очередь копится и сбрасывается одним flush в конце; вне collect() - сразу после коммита.
+    # Внутри atomic() уведомления пишутся пачкой в конце блока, в его транзакции
+    chunk_size = 1000
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @property
+    def _ready(self):
+        if not hasattr(self._local, 'ready'):
+            self._local.ready = []
+        return self._local.ready
+
+    @property
+    def _collecting(self):
+        return getattr(self._local, 'collecting', 0)
+
+    def notify(self, user, **fields):
+        self.notify_many([user], **fields)
+
+    def notify_many(self, users, send_email=False, **fields):
+        # users - пользователи или их id, в том числе queryset на тысячи пользователей.
+        # send_email=True - еще и письмо тем из них, кто включил send_email_notifications
+        notifications = [Notification(user_id=user.pk if isinstance(user, models.Model) else user, **fields)
+                         for user in users]
+        if not notifications:
+            return
+        for notification in notifications:
+            notification.send_email = send_email
+        pending = getattr(self._local, 'pending', None)
+        if pending is not None:
+            pending.extend(notifications)
+        elif transaction.get_connection().in_atomic_block:
+            transaction.on_commit(lambda: self._add_ready(notifications))
+        else:
+            self._add_ready(notifications)
+
+    def _add_ready(self, notifications):
+        self._ready.extend(notifications)
+        if not self._collecting:
+            self._flush_committed()
+
+    @contextmanager
+    def collect(self):
+        self._local.collecting = self._collecting + 1
+        try:
+            yield
+        finally:
+            self._local.collecting -= 1
+            if not self._collecting:
+                self._flush_committed()
+
+    @contextmanager
+    def atomic(self):
+        # transaction.atomic(), в котором уведомления коммитятся и откатываются вместе с остальными записями:
+        # созданные в блоке уведомления вставляются одной пачкой в конце блока, до коммита
+        previous, self._local.pending = getattr(self._local, 'pending', None), []
+        try:
+            with transaction.atomic():
+                yield
+                self._write(self._local.pending)
+        finally:
+            self._local.pending = previous
+
+    def flush(self):
+        notifications, self._local.ready = self._ready, []
+        self._write(notifications)
+
+    def _flush_committed(self):
+        # в очереди только уведомления уже закоммиченных транзакций: ошибка их записи не должна
+        # выглядеть как ошибка самой записи (500 в ответ на закоммиченный запрос, повтор запроса клиентом)
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Не удалось записать уведомления')
+
+    def _write(self, notifications):
+        if not notifications:
+            return
+        with transaction.atomic():
+            for start in range(0, len(notifications), self.chunk_size):
+                chunk = Notification.objects.bulk_create(notifications[start:start + self.chunk_size])
+                self.create_emails(chunk)
+                change_unread_counters(Counter(notification.user_id for notification in chunk
+                                               if not notification.checked))
+        transaction.on_commit(lambda: publish_notifications(notifications))
+
+    @staticmethod
+    def create_emails(notifications):
+        # письма только тем, кто включил send_email_notifications; адреса одним запросом на пачку
+        users_ids = {notification.user_id for notification in notifications if notification.send_email}
+        if not users_ids:
+            return
+        emails = dict(User.objects.filter(pk__in=users_ids, send_email_notifications=True)
+                      .exclude(email='').values_list('id', 'email'))
+        EmailOutbox.objects.bulk_create([EmailOutbox(notification=notification,
+                                                     recipient=emails[notification.user_id],
+                                                     subject=EMAIL_SUBJECT,
+                                                     body=notification.message)
+                                         for notification in notifications
+                                         if notification.send_email and notification.user_id in emails])
+
+
+def publish_notifications(notifications):
+    # раздача уже записанных уведомлений открытым потокам (stream.py)
+    from .serializers import NotificationSerializer
+
+    broker = get_notification_broker()
+    for notification in notifications:
+        broker.publish(notification.user_id, {'id': notification.id, **NotificationSerializer(notification).data})
+
+
+notification_dispatcher = NotificationDispatcher()
+
+
+def notify_many(users, **kwargs):
+    notification_dispatcher.notify_many(users, **kwargs)
+
+
+def new_notification(send_email=False, user=None, **kwargs):
+    notification_dispatcher.notify(user, send_email=send_email, **kwargs)
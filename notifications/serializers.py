@@ -1,6 +1,6 @@
 from rest_framework import serializers
 
-from notifications.models import Notification
+from notifications.models import Notification, ArchivedNotification
 
 
 class NotificationSerializer(serializers.ModelSerializer):
@@ -11,4 +11,15 @@ class NotificationSerializer(serializers.ModelSerializer):
                   'message',
                   'checked',
                   'created_at',)
-        model = Notification
\ No newline at end of file
+        model = Notification
+
+
+class ArchivedNotificationSerializer(serializers.ModelSerializer):
+    class Meta:
+        fields = ('user',
+                  'type',
+                  'affected_object_id',
+                  'message',
+                  'checked',
+                  'created_at',)
+        model = ArchivedNotification
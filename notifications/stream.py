@@ -0,0 +1,210 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from users.models import User
+from .broker import get_notification_broker
+from .models import Notification
+from .serializers import NotificationSerializer
+
+# поток уведомлений (Server-Sent Events) вместо периодического опроса NotificationList.
+# Обрабатывается напрямую на уровне asgi, мимо django view: на соединение приходится одна корутина
+# и пара задач asyncio, поток из пула и соединение с бд заняты только при подключении.
+# События:
+#   unread_count - сразу после подключения, {"unread_count": n}
+#   notification - новое уведомление, id события = id уведомления. При переподключении EventSource
+#                  присылает Last-Event-ID, и пропущенные уведомления (до MISSED_LIMIT) дочитываются из бд
+# Токен - access jwt в заголовке Authorization или в параметре ?token= (EventSource не умеет заголовки)
+
+STREAM_PATH = '/api/v1/notifications/stream'
+HEARTBEAT_INTERVAL = 15
+RETRY_INTERVAL_MS = 3000
+MISSED_LIMIT = 100
+PING = object()
+
+
+class NotificationStreamRouter:
+    # оборачивает asgi приложение django: запросы к STREAM_PATH обслуживает поток, остальное - django
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'].rstrip('/') == STREAM_PATH:
+            await notification_stream(scope, receive, send)
+        else:
+            await self.application(scope, receive, send)
+
+
+def format_event(data, event=None, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    if event is not None:
+        lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data, ensure_ascii=False, separators=(",", ":"))}')
+    return ('\n'.join(lines) + '\n\n').encode()
+
+
+def get_headers(scope):
+    return {name.decode('latin1').lower(): value.decode('latin1') for name, value in scope['headers']}
+
+
+def get_cors_headers(headers):
+    origin = headers.get('origin')
+    if origin is None:
+        return []
+    allow_all = getattr(settings, 'CORS_ALLOW_ALL_ORIGINS', getattr(settings, 'CORS_ORIGIN_ALLOW_ALL', False))
+    if allow_all or origin in getattr(settings, 'CORS_ALLOWED_ORIGINS', []):
+        return [(b'access-control-allow-origin', origin.encode('latin1')), (b'vary', b'Origin')]
+    return []
+
+
+def get_stream_user_id(scope, headers):
+    # id пользователя из access токена, без обращения к бд
+    token = None
+    authorization = headers.get('authorization', '').split()
+    if len(authorization) == 2 and authorization[0] in api_settings.AUTH_HEADER_TYPES:
+        token = authorization[1]
+    if token is None:
+        token = parse_qs(scope.get('query_string', b'').decode('latin1')).get('token', [None])[0]
+    if token is None:
+        return None
+    try:
+        return AccessToken(token)[api_settings.USER_ID_CLAIM]
+    except (TokenError, KeyError):
+        return None
+
+
+def parse_last_event_id(headers, scope):
+    last_event_id = headers.get('last-event-id') or \
+        parse_qs(scope.get('query_string', b'').decode('latin1')).get('last_event_id', [None])[0]
+    try:
+        return int(last_event_id) if last_event_id is not None else None
+    except ValueError:
+        return None
+
+
+def get_stream_state(user_id, last_event_id):
+    # счетчик непрочитанных и пропущенные с последнего подключения уведомления, None - пользователя нет
+    close_old_connections()
+    try:
+        unread_count = User.objects.filter(pk=user_id, is_active=True).values_list(
+            'unread_notifications_count', flat=True).first()
+        if unread_count is None:
+            return None
+        missed = []
+        if last_event_id is not None:
+            missed = [{'id': notification.id, **NotificationSerializer(notification).data}
+                      for notification in Notification.objects.filter(user_id=user_id, id__gt=last_event_id)
+                      .order_by('id')[:MISSED_LIMIT]]
+        return unread_count, missed
+    finally:
+        close_old_connections()
+
+
+async def send_error(send, status, detail, error_code, headers=()):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), *headers]})
+    await send({'type': 'http.response.body',
+                'body': json.dumps({'detail': detail, 'error_code': error_code}, ensure_ascii=False).encode()})
+
+
+async def wait_for_disconnect(receive, subscription):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+    subscription.close()
+
+
+class Heartbeat:
+    # раз в HEARTBEAT_INTERVAL кладет PING в очереди всех открытых потоков. Один таймер на event loop,
+    # а не asyncio.wait с таймаутом в каждом потоке: простаивающее соединение не держит своих таймеров
+    by_loop = {}
+
+    def __init__(self, loop):
+        self.subscriptions = set()
+        self.task = loop.create_task(self.run(loop))
+
+    @classmethod
+    def add(cls, subscription):
+        loop = asyncio.get_running_loop()
+        if loop not in cls.by_loop:
+            cls.by_loop[loop] = cls(loop)
+        cls.by_loop[loop].subscriptions.add(subscription)
+
+    @classmethod
+    def discard(cls, subscription):
+        heartbeat = cls.by_loop.get(subscription.loop)
+        if heartbeat is not None:
+            heartbeat.subscriptions.discard(subscription)
+
+    async def run(self, loop):
+        while self.subscriptions:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            for subscription in list(self.subscriptions):
+                subscription.put(PING)
+        del self.by_loop[loop]
+
+
+async def notification_stream(scope, receive, send):
+    headers = get_headers(scope)
+    cors_headers = get_cors_headers(headers)
+    if scope['method'] != 'GET':
+        await send_error(send, 405, 'Метод не разрешен', 'method_not_allowed', cors_headers)
+        return
+
+    user_id = get_stream_user_id(scope, headers)
+    if user_id is None:
+        await send_error(send, 401, 'Нужен действительный access токен', 'invalid_token', cors_headers)
+        return
+
+    broker = get_notification_broker()
+    # подписка до чтения из бд: уведомление, созданное между чтением и подпиской, не потеряется
+    # (а пришедшее и из бд, и из очереди отправляется один раз)
+    subscription = broker.subscribe(user_id)
+    disconnect = asyncio.ensure_future(wait_for_disconnect(receive, subscription))
+    try:
+        last_event_id = parse_last_event_id(headers, scope)
+        state = await sync_to_async(get_stream_state)(user_id, last_event_id)
+        if state is None:
+            await send_error(send, 401, 'Пользователь не найден или неактивен', 'invalid_token', cors_headers)
+            return
+        unread_count, missed = state
+
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/event-stream; charset=utf-8'),
+                                (b'cache-control', b'no-cache'),
+                                (b'x-accel-buffering', b'no'),
+                                *cors_headers]})
+        body = f'retry: {RETRY_INTERVAL_MS}\n\n'.encode() + format_event({'unread_count': unread_count},
+                                                                          event='unread_count')
+        for notification in missed:
+            body += format_event(notification, event='notification', event_id=notification['id'])
+        sent_ids = {notification['id'] for notification in missed}
+        await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+
+        Heartbeat.add(subscription)
+        while True:
+            event = await subscription.get()
+            if event is None:
+                # клиент отключился или не успевал читать и очередь переполнилась
+                break
+            if event is PING:
+                # комментарий держит соединение живым через прокси и быстро обнаруживает отключение клиента
+                await send({'type': 'http.response.body', 'body': b': ping\n\n', 'more_body': True})
+            elif event['id'] not in sent_ids:
+                await send({'type': 'http.response.body', 'more_body': True,
+                            'body': format_event(event, event='notification', event_id=event['id'])})
+        if not disconnect.done():
+            # после переполнения клиент переподключится с Last-Event-ID
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        Heartbeat.discard(subscription)
+        broker.unsubscribe(subscription)
+        disconnect.cancel()
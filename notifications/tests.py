@@ -1,3 +1,371 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import smtplib
+from io import StringIO
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from users.models import User
+from .broker import get_notification_broker
+from .models import Notification, ArchivedNotification, EmailOutbox, notification_dispatcher, notify_many, new_notification
+from .stream import STREAM_PATH, NotificationStreamRouter
+
+
+class NotificationDispatcherTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = User.objects.bulk_create([User(username=f'user{i}', email=f'user{i}@test.com')
+                                              for i in range(2500)])
+        if cls.users[0].pk is None:
+            cls.users = list(User.objects.order_by('id'))
+
+    def test_notifications_are_inserted_in_chunks_when_collecting_ends(self):
+        # тест идет внутри транзакции, поэтому коммит имитируется через captureOnCommitCallbacks
+        with notification_dispatcher.collect():
+            with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(0):
+                new_notification(user=self.users[0], type='general_notification', message='one')
+                notify_many(self.users, type='general_notification', message='many')
+                # пользователей можно передавать и по id
+                notify_many([user.id for user in self.users[:10]], type='general_notification', message='by id')
+            self.assertEqual(Notification.objects.count(), 0)
+        self.assertEqual(Notification.objects.count(), 1 + 2500 + 10)
+        self.assertEqual(Notification.objects.filter(user=self.users[0]).count(), 3)
+
+    def test_notifications_wait_for_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                notify_many(self.users[:5], type='general_notification', message='committed')
+                self.assertEqual(Notification.objects.count(), 0)
+        self.assertEqual(Notification.objects.count(), 5)
+
+    def test_rolled_back_notifications_are_dropped(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    notify_many(self.users[:5], type='general_notification', message='rolled back')
+                    raise ValueError()
+            except ValueError:
+                pass
+        self.assertEqual(Notification.objects.count(), 0)
+
+
+    def test_atomic_writes_notifications_in_its_transaction(self):
+        with notification_dispatcher.collect():
+            with notification_dispatcher.atomic():
+                notify_many(self.users[:5], type='general_notification', message='with the transaction')
+                self.assertEqual(Notification.objects.count(), 0)
+            # записаны до коммита внешней транзакции и до конца collect()
+            self.assertEqual(Notification.objects.count(), 5)
+
+            try:
+                with notification_dispatcher.atomic():
+                    notify_many(self.users[:5], type='general_notification', message='rolled back')
+                    raise ValueError()
+            except ValueError:
+                pass
+        self.assertEqual(Notification.objects.count(), 5)
+
+
+    def test_failed_flush_does_not_fail_committed_request(self):
+        # так middleware заканчивает запрос: транзакция закоммичена, уведомления пишутся в конце collect().
+        # Уведомление без message не вставится (NOT NULL), ошибка только логируется
+        with self.assertLogs('notifications.models', 'ERROR'):
+            with notification_dispatcher.collect():
+                with self.captureOnCommitCallbacks(execute=True):
+                    with transaction.atomic():
+                        notify_many(self.users[:2], type='general_notification', message=None)
+        self.assertEqual(Notification.objects.count(), 0)
+        # очередь не застряла
+        with self.captureOnCommitCallbacks(execute=True):
+            notify_many(self.users[:2], type='general_notification', message='next')
+        self.assertEqual(Notification.objects.count(), 2)
+
+
+class FailingEmailBackend(locmem.EmailBackend):
+    # письма на адреса broken@... не отправляются
+    def send_messages(self, messages):
+        if any(recipient.startswith('broken@') for message in messages for recipient in message.to):
+            raise smtplib.SMTPRecipientsRefused({})
+        return super().send_messages(messages)
+
+
+class UnreachableEmailBackend(locmem.EmailBackend):
+    # SMTP сервер недоступен: не открывается соединение и не отправляется ни одно письмо
+    def open(self):
+        raise ConnectionRefusedError(111, 'Connection refused')
+
+    def send_messages(self, messages):
+        raise ConnectionRefusedError(111, 'Connection refused')
+
+
+@override_settings(EMAIL_BACKEND='notifications.tests.FailingEmailBackend')
+class EmailOutboxTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.subscriber = User.objects.create_user(username='subscriber', email='subscriber@test.com',
+                                                  password='abc123', send_email_notifications=True)
+        cls.broken = User.objects.create_user(username='broken', email='broken@test.com',
+                                              password='abc123', send_email_notifications=True)
+        cls.silent = User.objects.create_user(username='silent', email='silent@test.com', password='abc123')
+
+    def send_emails(self):
+        call_command('send_notification_emails', '--once', stdout=StringIO())
+
+    def test_outbox_rows_are_written_with_notifications(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                notify_many([self.subscriber, self.silent], send_email=True, type='general_notification',
+                            message='hello')
+                # по умолчанию без письма
+                new_notification(user=self.subscriber, type='general_notification', message='quiet')
+        # письмо только тому, кто включил send_email_notifications, и только к уведомлениям с send_email
+        email = EmailOutbox.objects.get()
+        self.assertEqual((email.recipient, email.body, email.status), ('subscriber@test.com', 'hello', 'P'))
+        self.assertEqual(email.notification.user, self.subscriber)
+        # запрос не отправляет писем
+        self.assertEqual(mail.outbox, [])
+
+        self.send_emails()
+        self.assertEqual([message.to for message in mail.outbox], [['subscriber@test.com']])
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('S', 1))
+
+    def test_failed_emails_are_retried_with_backoff(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            notify_many([self.broken, self.subscriber], send_email=True, type='general_notification', message='hello')
+        self.send_emails()
+
+        self.assertEqual([message.to for message in mail.outbox], [['subscriber@test.com']])
+        email = EmailOutbox.objects.get(recipient='broken@test.com')
+        self.assertEqual((email.status, email.attempts), ('P', 1))
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        self.assertIn('SMTPRecipientsRefused', email.last_error)
+
+        # повтор еще не наступил
+        self.send_emails()
+        self.assertEqual(EmailOutbox.objects.get(pk=email.pk).attempts, 1)
+
+        for _ in range(4):
+            EmailOutbox.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now())
+            self.send_emails()
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('F', 5))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_unreachable_server_is_retried(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            notify_many([self.subscriber, self.broken], send_email=True, type='general_notification', message='hello')
+        with override_settings(EMAIL_BACKEND='notifications.tests.UnreachableEmailBackend'):
+            # ошибка соединения не роняет воркер, а уходит в повтор, как ошибка отдельного письма
+            self.send_emails()
+
+        for email in EmailOutbox.objects.all():
+            self.assertEqual((email.status, email.attempts), ('P', 1))
+            self.assertGreater(email.next_attempt_at, timezone.now())
+            self.assertIn('ConnectionRefusedError', email.last_error)
+
+        # сервер снова доступен, подошел срок повтора
+        EmailOutbox.objects.update(next_attempt_at=timezone.now())
+        self.send_emails()
+        self.assertEqual([message.to for message in mail.outbox], [['subscriber@test.com']])
+        self.assertEqual(EmailOutbox.objects.get(recipient='subscriber@test.com').status, 'S')
+
+
+class MarkNotificationsReadTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='user', email='user@test.com', password='abc123')
+        cls.other = User.objects.create_user(username='other', email='other@test.com', password='abc123')
+        cls.notifications = [Notification.objects.create(user=cls.user, type=notification_type,
+                                                         affected_object_id=i % 3, message='message')
+                             for i, notification_type in enumerate(['review_notification'] * 4 +
+                                                                   ['application_notification'] * 6)]
+        Notification.objects.create(user=cls.other, type='review_notification', affected_object_id=0, message='x')
+        Notification.objects.filter(pk=cls.notifications[0].pk).update(
+            created_at=timezone.now() - datetime.timedelta(days=30))
+        call_command('recount_unread_notifications', stdout=StringIO())
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def mark_read(self, data=None):
+        response = self.client.put('/api/v1/notifications/', data or {}, format='json')
+        self.assertEqual(response.status_code, 202)
+        # счетчик непрочитанных уменьшается в той же транзакции
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.unread_notifications_count,
+                         Notification.objects.filter(user=self.user, checked=False).count())
+        return response.data['updated']
+
+    def test_mark_read_by_filters(self):
+        self.assertEqual(self.mark_read({'ids': [self.notifications[1].id, self.notifications[2].id]}), 2)
+        # уже прочитанные не считаются
+        self.assertEqual(self.mark_read({'ids': f'{self.notifications[1].id},{self.notifications[3].id}'}), 1)
+        self.assertEqual(self.mark_read({'type': 'review_notification'}), 1)
+        older_than = (timezone.now() - datetime.timedelta(days=1)).isoformat()
+        self.assertEqual(self.mark_read({'older_than': older_than}), 0)
+        self.assertEqual(self.mark_read({'type': 'application_notification', 'affected_object_id': 1}), 2)
+        self.assertEqual(self.mark_read(), 4)
+        self.assertFalse(Notification.objects.filter(user=self.user, checked=False).exists())
+        self.assertTrue(Notification.objects.get(user=self.other).checked is False)
+
+    def test_mark_read_older_than(self):
+        older_than = (timezone.now() - datetime.timedelta(days=1)).isoformat()
+        self.assertEqual(self.mark_read({'older_than': older_than}), 1)
+
+    def test_mark_read_keeps_notification_type(self):
+        response = self.client.put('/api/v1/notifications/?notification_type=old', {}, format='json')
+        self.assertEqual(response.data['updated'], 0)
+        self.assertFalse(Notification.objects.filter(user=self.user, checked=True).exists())
+        response = self.client.put('/api/v1/notifications/?notification_type=new', {'type': 'review_notification'},
+                                   format='json')
+        self.assertEqual(response.data['updated'], 4)
+
+    def test_invalid_filters(self):
+        for data in ({'ids': 'one,two'}, {'affected_object_id': 'x'}, {'older_than': 'yesterday'}):
+            response = self.client.put('/api/v1/notifications/', data, format='json')
+            self.assertEqual(response.status_code, 400)
+
+
+class UnreadCountTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='user', email='user@test.com', password='abc123')
+
+    def setUp(self):
+        # с jwt запрос стоит ровно одного обращения к бд - загрузки пользователя при аутентификации
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+
+    def get_unread_count(self, **headers):
+        with self.assertNumQueries(1):
+            return self.client.get('/api/v1/notifications/unread_count', **headers)
+
+    def test_counter_follows_dispatch_and_mark_read(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            notify_many([self.user] * 3, send_email=False, type='review_notification', affected_object_id=1,
+                        message='message')
+        response = self.get_unread_count()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'unread_count': 3})
+
+        self.client.put('/api/v1/notifications/', {'type': 'review_notification'}, format='json')
+        self.assertEqual(self.get_unread_count().data, {'unread_count': 0})
+
+    def test_not_modified(self):
+        etag = self.get_unread_count()['ETag']
+        response = self.get_unread_count(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            new_notification(user=self.user, send_email=False, type='review_notification', affected_object_id=1,
+                             message='message')
+        response = self.get_unread_count(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class NotificationStreamTests(TransactionTestCase):
+    # TransactionTestCase: уведомления раздаются подписчикам после настоящего коммита
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', email='user@test.com', password='abc123')
+        self.application = NotificationStreamRouter(None)
+
+    async def open_stream(self, query_string):
+        messages = asyncio.Queue()
+        disconnected = asyncio.Event()
+
+        async def receive():
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        scope = {'type': 'http', 'method': 'GET', 'path': STREAM_PATH, 'headers': [],
+                 'query_string': query_string.encode()}
+        stream = asyncio.ensure_future(self.application(scope, receive, messages.put))
+        return stream, messages, disconnected
+
+    async def test_notifications_are_pushed(self):
+        notifications = [await sync_to_async(Notification.objects.create)(user=self.user, message=f'старое {i}')
+                         for i in range(2)]
+        token = AccessToken.for_user(self.user)
+        stream, messages, disconnected = await self.open_stream(f'token={token}&last_event_id={notifications[0].id}')
+
+        self.assertEqual((await messages.get())['status'], 200)
+        body = (await messages.get())['body'].decode()
+        self.assertIn('event: unread_count', body)
+        # пропущенное с прошлого подключения дочитывается из бд
+        self.assertNotIn('старое 0', body)
+        self.assertIn(f'id: {notifications[1].id}', body)
+
+        await sync_to_async(new_notification)(user=self.user, send_email=False, type='review_notification',
+                                              affected_object_id=1, message='новое')
+        body = (await asyncio.wait_for(messages.get(), 5))['body'].decode()
+        self.assertIn('event: notification', body)
+        self.assertIn('новое', body)
+
+        disconnected.set()
+        await asyncio.wait_for(stream, 5)
+        self.assertEqual(get_notification_broker().subscriptions_count(), 0)
+
+    async def test_invalid_token(self):
+        stream, messages, _ = await self.open_stream('token=invalid')
+        await stream
+        self.assertEqual((await messages.get())['status'], 401)
+
+
+class NotificationRetentionTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='user', email='user@test.com', password='abc123')
+        old = timezone.now() - datetime.timedelta(days=100)
+        for i, checked in enumerate([True, True, True, False, True]):
+            notification = Notification.objects.create(user=cls.user, message=f'message {i}', checked=checked)
+            if i < 4:
+                Notification.objects.filter(pk=notification.pk).update(created_at=old + datetime.timedelta(hours=i))
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def get_plan(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SET enable_seqscan = off')
+                cursor.execute('EXPLAIN ' + sql)
+                plan = [row[0] for row in cursor.fetchall()]
+                cursor.execute('RESET enable_seqscan')
+                return [line for line in plan if 'Seq Scan' in line or 'Sort' in line]
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return [row[-1] for row in cursor.fetchall()
+                    if 'TEMP B-TREE' in row[-1] or (row[-1].startswith('SCAN ') and ' USING ' not in row[-1])]
+
+    def test_list_is_served_by_index(self):
+        # страница списка читается по индексу в нужном порядке, без полного прохода и сортировки
+        for notification_type in ('', 'new', 'old'):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/api/v1/notifications/', {'notification_type': notification_type,
+                                                                      'page_size': 2})
+            self.assertEqual(response.status_code, 200)
+            sql = next(query['sql'] for query in queries if 'FROM "notifications_notification"' in query['sql'])
+            self.assertEqual(self.get_plan(sql), [], sql)
+
+    def test_archive_and_page_into_it(self):
+        call_command('archive_notifications', older_than_days=30, batch_size=2, stdout=StringIO())
+        # непрочитанные и свежие остаются в основной таблице
+        self.assertEqual(sorted(Notification.objects.values_list('message', flat=True)), ['message 3', 'message 4'])
+        self.assertEqual(ArchivedNotification.objects.count(), 3)
+
+        response = self.client.get('/api/v1/notifications/archive', {'page_size': 2})
+        self.assertEqual([notification['message'] for notification in response.data['notifications']],
+                         ['message 2', 'message 1'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([notification['message'] for notification in response.data['notifications']],
+                         ['message 0'])
+        self.assertIsNone(response.data['next'])
@@ -1,6 +1,8 @@
 from django.urls import path
-from .views import NotificationList
+from .views import NotificationList, ArchivedNotificationList, unread_count_view
 
 urlpatterns = [
     path('', NotificationList.as_view()),
+    path('unread_count', unread_count_view),  # количество непрочитанных уведомлений
+    path('archive', ArchivedNotificationList.as_view()),  # старые прочитанные уведомления
 ]
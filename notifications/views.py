@@ -1,13 +1,21 @@
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.http import parse_etags
 from rest_framework import generics, permissions, status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
-from .models import Notification
-from .serializers import NotificationSerializer
+from assistance_platform_project.pagination import KeysetPagination
+from .models import Notification, ArchivedNotification, change_unread_counters
+from .serializers import NotificationSerializer, ArchivedNotificationSerializer
 
 
 class NotificationList(generics.ListAPIView, generics.UpdateAPIView):
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = NotificationSerializer
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         queryset = Notification.objects.filter(user=self.request.user)
@@ -29,15 +37,94 @@ class NotificationList(generics.ListAPIView, generics.UpdateAPIView):
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
+            return Response({"notifications": serializer.data, "new": request.user.unread_notifications_count,
+                             "next": self.paginator.get_next_link(), "previous": self.paginator.get_previous_link()})
 
         serializer = self.get_serializer(queryset, many=True)
-        return Response({"notifications": serializer.data, "new": queryset.filter(checked=False).count()})
+        return Response({"notifications": serializer.data, "new": request.user.unread_notifications_count})
 
     def put(self, request, *args, **kwargs):
-        queryset = self.filter_queryset(self.get_queryset())
-        for notification in queryset:
-            notification.checked = True
-            notification.save()
+        # отметить уведомления прочитанными одним UPDATE. Какие именно - по параметрам в теле запроса
+        # (или в url): ids (список id), type, affected_object_id, older_than (дата/время ISO 8601).
+        # Без параметров отмечаются все. Фильтр списка notification_type из url тоже учитывается, как и раньше:
+        # с notification_type=old отмечать нечего. В ответе - сколько уведомлений было отмечено
+        filters = get_mark_read_filters(request)
+        with transaction.atomic():
+            updated = self.filter_queryset(self.get_queryset()).filter(checked=False, **filters).update(checked=True)
+            change_unread_counters({request.user.id: -updated})
+        return Response({'updated': updated}, status=status.HTTP_202_ACCEPTED)
+
+
+class ArchivedNotificationList(generics.ListAPIView):
+    # уведомления, перенесенные командой archive_notifications. Все они прочитаны и старше
+    # самых старых прочитанных в NotificationList, так что клиент листает сюда после конца основного списка
+    permission_classes = (permissions.IsAuthenticated,)
+    serializer_class = ArchivedNotificationSerializer
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        return ArchivedNotification.objects.filter(user=self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        serializer = self.get_serializer(page, many=True)
+        return Response({"notifications": serializer.data,
+                         "next": self.paginator.get_next_link(), "previous": self.paginator.get_previous_link()})
+
+
+@api_view(['GET'])
+@permission_classes((permissions.IsAuthenticated,))
+def unread_count_view(request):
+    # счетчик для значка непрочитанных: берется из уже загруженного при аутентификации пользователя,
+    # таблица уведомлений не читается. ETag - само значение, клиент опрашивает с If-None-Match
+    unread_count = request.user.unread_notifications_count
+    etag = f'"unread-{request.user.id}-{unread_count}"'
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response({'unread_count': unread_count}, headers=headers)
+
+
+def get_mark_read_filters(request):
+    params = request.data if request.data else request.query_params
+    filters = {}
+
+    ids = params.get('ids')
+    if ids is not None:
+        if hasattr(params, 'getlist') and len(params.getlist('ids')) > 1:
+            ids = params.getlist('ids')
+        if isinstance(ids, str):
+            ids = [item for item in ids.split(',') if item.strip()]
+        if not isinstance(ids, list):
+            ids = [ids]
+        try:
+            filters['id__in'] = [int(notification_id) for notification_id in ids]
+        except (TypeError, ValueError):
+            raise ValidationError({'detail': 'ids must be a list of notification ids', 'error_code': 'invalid_ids'})
+
+    notification_type = params.get('type')
+    if notification_type is not None:
+        filters['type'] = notification_type
+
+    affected_object_id = params.get('affected_object_id')
+    if affected_object_id is not None:
+        try:
+            filters['affected_object_id'] = int(affected_object_id)
+        except (TypeError, ValueError):
+            raise ValidationError({'detail': 'affected_object_id must be an integer',
+                                   'error_code': 'invalid_affected_object_id'})
+
+    older_than = params.get('older_than')
+    if older_than is not None:
+        try:
+            moment = parse_datetime(str(older_than))
+        except ValueError:
+            moment = None
+        if moment is None:
+            raise ValidationError({'detail': 'older_than must be a date and time in ISO 8601',
+                                   'error_code': 'invalid_older_than'})
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+        filters['created_at__lt'] = moment
 
-        return Response(status=status.HTTP_202_ACCEPTED)
+    return filters
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from .models import DataVersion
+
+# версии (поколения) данных в общем кэше джанго. Все, что собрано из этих данных и закэшировано,
+# хранится вместе с номером версии; после bump_cache_version такой кэш перестает совпадать и пересобирается.
+# Для нескольких процессов нужен общий бэкенд кэша (см. CACHES в settings.py)
+
+
+def cache_version_key(name):
+    return f'cache_version:{name}'
+
+
+def initial_cache_version():
+    # версия стартует не с единицы, а со времени: если ключ вытеснят из кэша,
+    # новая версия не совпадет ни с одной из уже выданных
+    return int(time.time() * 1000)
+
+
+def get_cache_version(name):
+    version = cache.get(cache_version_key(name))
+    if version is None:
+        cache.add(cache_version_key(name), initial_cache_version(), timeout=None)
+        version = cache.get(cache_version_key(name))
+    return version
+
+
+def bump_cache_version(name):
+    try:
+        return cache.incr(cache_version_key(name))
+    except ValueError:
+        # ключа нет в кэше
+        version = initial_cache_version()
+        cache.set(cache_version_key(name), version, timeout=None)
+        return version
+
+
+# версии данных в бд (DataVersion) - для ответов, которые кэшируются только в памяти процесса:
+# каждый процесс на запрос сверяет свою версию с одной строкой в бд. Версия меняется в той же транзакции,
+# что и данные, поэтому при откате она откатывается вместе с ними
+INFORMATIONAL_VERSION = 'informational_endpoint'
+
+
+def get_data_version(name):
+    return DataVersion.objects.filter(name=name).values_list('version', flat=True).first() or 0
+
+
+def bump_data_version(name):
+    if not DataVersion.objects.filter(name=name).update(version=F('version') + 1):
+        _, created = DataVersion.objects.get_or_create(name=name, defaults={'version': 1})
+        if not created:
+            # строку только что создал параллельный запрос
+            DataVersion.objects.filter(name=name).update(version=F('version') + 1)
+
+
+def make_etag(data):
+    content = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    return '"' + hashlib.sha1(content.encode()).hexdigest() + '"'
+
+
+# общий кэш ответов списка заданий для анонимных пользователей.
+# Два уровня: LRU в памяти процесса (ограничен по числу записей) и общий кэш джанго.
+# Каждая запись хранится вместе с поколением TASKS_VERSION, которое увеличивается при любой записи
+# в задачи и заявки (см. signals.py), так что устаревшие записи просто перестают совпадать
+TASKS_VERSION = 'tasks'
+
+
+class ResponseCache:
+    def __init__(self, prefix, max_entries=256, timeout=300):
+        self.prefix = prefix
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def make_key(self, *parts):
+        content = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return f'{self.prefix}:{hashlib.sha1(content.encode()).hexdigest()}'
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.local_hits += 1
+                return entry[1]
+
+        entry = cache.get(key)
+        if entry is not None and entry[0] == version:
+            self._set_local(key, entry)
+            with self._lock:
+                self.shared_hits += 1
+            return entry[1]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, version, data):
+        entry = (version, data)
+        self._set_local(key, entry)
+        cache.set(key, entry, timeout=self.timeout)
+
+    def _set_local(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.local_hits = self.shared_hits = self.misses = 0
+
+    def stats(self):
+        # счетчики свои у каждого процесса
+        with self._lock:
+            hits = self.local_hits + self.shared_hits
+            requests = hits + self.misses
+            return {'local_hits': self.local_hits,
+                    'shared_hits': self.shared_hits,
+                    'misses': self.misses,
+                    'hit_ratio': hits / requests if requests else None,
+                    'local_entries': len(self._entries),
+                    'local_max_entries': self.max_entries}
+
+
+task_list_cache = ResponseCache('task_list')
+task_facets_cache = ResponseCache('task_facets')
+
+
+def bump_tasks_version():
+    # увеличиваем поколение сразу (чтобы сам пишущий запрос не получил старый ответ)
+    # и еще раз после коммита: ответ, собранный другим запросом до коммита, мог попасть в кэш
+    # с промежуточным поколением
+    bump_cache_version(TASKS_VERSION)
+    transaction.on_commit(lambda: bump_cache_version(TASKS_VERSION))
@@ -0,0 +1,328 @@
+import dataclasses
+import datetime
+import hashlib
+import math
+from typing import FrozenSet, Optional
+
+from django.db.models import Count, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from users.models import STAGE_OF_STUDY_CHOICES
+from .models import Task, TASK_STATUS_CHOICES
+from .search import search_tasks
+
+# параметры списка заданий (TaskList, фасеты).
+# Все параметры разбираются и проверяются один раз в TaskFilterSpec.from_request, некорректные значения
+# отклоняются с 400 до обращения к бд. Из спецификации строится одно Q выражение, а spec.key -
+# канонический ключ (не зависит от порядка параметров, порядка значений в списках и их повторов)
+# для кэша ответов и курсоров пагинации
+
+TASK_STATUSES = frozenset(value for value, _ in TASK_STATUS_CHOICES)
+STAGES_OF_STUDY = frozenset(value for value, _ in STAGE_OF_STUDY_CHOICES)
+
+
+def get_task_sort_fields_info():
+    sort_fields = [field.name for field in Task._meta.get_fields()] + ['author_rating', 'relevance']
+
+    not_for_sort_fields = ["id", "applications", "files", "stage_of_study", "author", "implementer",
+                           "status", "description", "tags", 'reviews', 'search_vector']
+    for field in not_for_sort_fields:
+        if field in sort_fields:
+            sort_fields.remove(field)
+
+    sort_fields_names = {'title': 'Название',
+                         'course_of_study': 'Класс/курс обучения',
+                         'subject': 'Предмет',
+                         'created_at': 'Дата создания',
+                         'updated_at': 'Дата последнего редактирования',
+                         'stop_accepting_applications_at': 'Дата планируемого окончания приема заявок',
+                         'expires_at': 'Дата планируемого закрытия задачи',
+                         'closed_at': 'Дата закрытия задачи',
+                         'price': 'Вознаграждение за решение',
+                         'applications_count': 'Количество заявок',
+                         'pending_applications_count': 'Количество нерассмотренных заявок',
+                         'reviews_count': 'Количество отзывов',
+                         'author_rating': 'Рейтинг автора задачи',
+                         'relevance': 'Релевантность поисковому запросу'}
+
+    sort_fields_info = {}
+    for sort_field in sort_fields:
+        if sort_field in sort_fields_names:
+            sort_fields_info[sort_field] = sort_fields_names[sort_field]
+        else:
+            sort_fields_info[sort_field] = sort_field
+    return sort_fields_info
+
+
+def invalid_parameter(name, value, expected):
+    return ValidationError({'detail': f"URL parameter {name} is '{value}' but {expected}",
+                            'error_code': 'invalid_filter_parameter'})
+
+
+def parse_list(params, name, parse_item):
+    value = params.get(name)
+    if value is None or value == '':
+        return None
+    items = set()
+    for item in value.split(','):
+        item = item.strip()
+        if item:
+            items.add(parse_item(name, value, item))
+    return frozenset(items) or None
+
+
+def parse_id(name, value, item):
+    if not item.isdigit():
+        raise invalid_parameter(name, value, 'expected comma separated ids')
+    return int(item)
+
+
+def parse_choice(choices):
+    def parse(name, value, item):
+        if item not in choices:
+            raise invalid_parameter(name, value, f"allowed values are {', '.join(sorted(choices))}")
+        return item
+
+    return parse
+
+
+# диапазон IntegerField в бд: значения за его пределами не сравниваются с колонкой (в sqlite - OverflowError)
+INTEGER_MIN, INTEGER_MAX = -2 ** 31, 2 ** 31 - 1
+
+
+def parse_int(params, name, default):
+    value = params.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise invalid_parameter(name, value, 'expected an integer')
+    if not INTEGER_MIN <= number <= INTEGER_MAX:
+        raise invalid_parameter(name, value, f'expected an integer from {INTEGER_MIN} to {INTEGER_MAX}')
+    return number
+
+
+def get_sort_field(sort):
+    # снимается только один '-': '--title' не поле сортировки
+    return sort[1:] if sort.startswith('-') else sort
+
+
+def parse_float(params, name, default):
+    value = params.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        number = float(value)
+    except ValueError:
+        raise invalid_parameter(name, value, 'expected a number')
+    if not math.isfinite(number):
+        raise invalid_parameter(name, value, 'expected a number')
+    return number
+
+
+def parse_moment(params, name):
+    # принимается дата (%Y-%m-%d, начало дня в текущем часовом поясе) или дата и время в ISO 8601
+    value = params.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            date = parse_date(value)
+            if date is not None:
+                moment = datetime.datetime.combine(date, datetime.time.min)
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise invalid_parameter(name, value, "expected a date in format '%Y-%m-%d'")
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+class FilterSpecKeyMixin:
+    # канонический ключ и его короткий хэш для frozen dataclass спецификаций фильтров
+    @property
+    def key(self):
+        # множества сортируются, чтобы ключ был одинаковым в разных процессах
+        return tuple((field.name, tuple(sorted(value)) if isinstance(value, frozenset) else value)
+                     for field in dataclasses.fields(self)
+                     for value in (getattr(self, field.name),))
+
+    @property
+    def digest(self):
+        return hashlib.sha1(repr(self.key).encode()).hexdigest()[:16]
+
+
+@dataclasses.dataclass(frozen=True)
+class TaskFilterSpec(FilterSpecKeyMixin):
+    tags: Optional[FrozenSet[int]] = None
+    tags_grouping_type: str = 'or'
+    statuses: Optional[FrozenSet[str]] = None
+    stages: Optional[FrozenSet[str]] = None
+    course_min: int = 0
+    course_max: int = 15
+    subjects: Optional[FrozenSet[int]] = None
+    author_rating_min: float = 0
+    author_rating_max: float = 10
+    applications_min: Optional[int] = None
+    applications_max: Optional[int] = None
+    date_type: str = 'created_at'
+    date_start: Optional[datetime.datetime] = None
+    date_end: Optional[datetime.datetime] = None
+    search_query: Optional[str] = None
+    sort: Optional[str] = None
+    # задачи конкретного пользователя (users/<...>/tasks, users/<...>/todo_tasks)
+    author_id: Optional[int] = None
+    author_username: Optional[str] = None
+    implementer_id: Optional[int] = None
+    implementer_username: Optional[str] = None
+    # в общем списке пользователь не видит свои задачи
+    excluded_author_id: Optional[int] = None
+
+    @classmethod
+    def from_request(cls, request, params):
+        url_kwargs = request.parser_context['kwargs']
+        person = {}
+        if url_kwargs:
+            kwarg_key = list(url_kwargs.keys())[0]
+            if kwarg_key in ('authorid', 'implementerid'):
+                person[kwarg_key.replace('id', '_id')] = int(url_kwargs[kwarg_key])
+            elif kwarg_key in ('authorusername', 'implementerusername'):
+                person[kwarg_key.replace('username', '_username')] = url_kwargs[kwarg_key]
+        elif not request.user.is_anonymous:
+            person['excluded_author_id'] = request.user.id
+
+        tags_grouping_type = params.get('tags_grouping_type') or 'or'
+        if tags_grouping_type not in ('and', 'or'):
+            raise ValidationError({'detail': f"URL parameter tags_grouping_type is '{tags_grouping_type}'"
+                                             f" but allowed values are 'and' and 'or'",
+                                   'error_code': 'unknown_sorting_parameter'})
+
+        # по умолчанию в общем списке только задачи, принимающие заявки
+        statuses = parse_list(params, 'task_status', parse_choice(TASK_STATUSES))
+        if statuses is None and 'task_status' not in params and not url_kwargs:
+            statuses = frozenset('A')
+
+        date_type = params.get('date_type') or 'created_at'
+        if date_type not in Task.datetime_fileds_names:
+            raise invalid_parameter('date_type', date_type,
+                                    f"allowed values are {', '.join(Task.datetime_fileds_names)}")
+
+        search_query = (params.get('search_query') or '').strip() or None
+
+        sort = params.get('sort') or None
+        if sort == '-':
+            sort = None
+        if sort is not None and get_sort_field(sort) not in get_task_sort_fields_info():
+            raise ValidationError({'detail': f"URL parameter sort is '{sort}' but allowed values are "
+                                             f"{', '.join(get_task_sort_fields_info())} (with optional '-')",
+                                   'error_code': 'unknown_sorting_parameter'})
+        if sort is not None and get_sort_field(sort) == 'relevance' and search_query is None:
+            # без поискового запроса сортировать по релевантности не по чему
+            sort = None
+
+        return cls(tags=parse_list(params, 'tags', parse_id),
+                   tags_grouping_type=tags_grouping_type,
+                   statuses=statuses,
+                   stages=parse_list(params, 'stage', parse_choice(STAGES_OF_STUDY)),
+                   course_min=parse_int(params, 'course_min', 0),
+                   course_max=parse_int(params, 'course_max', 15),
+                   subjects=parse_list(params, 'subjects', parse_id),
+                   author_rating_min=parse_float(params, 'author_rating_min', 0),
+                   author_rating_max=parse_float(params, 'author_rating_max', 10),
+                   applications_min=parse_int(params, 'applications_min', None),
+                   applications_max=parse_int(params, 'applications_max', None),
+                   date_type=date_type,
+                   date_start=parse_moment(params, 'date_start'),
+                   date_end=parse_moment(params, 'date_end'),
+                   search_query=search_query,
+                   sort=sort,
+                   **person)
+
+    def without(self, *names):
+        # та же спецификация без части фильтров (для фасетов)
+        return dataclasses.replace(self, **{name: None for name in names})
+
+    def to_q(self):
+        q = Q()
+        # границы по умолчанию совпадают с допустимыми значениями полей, условие не нужно: лишнее условие
+        # по рейтингу автора требует join с users и сбивает планировщик с частичных индексов по задачам
+        if self.course_min > 0:
+            q &= Q(course_of_study__gte=self.course_min)
+        if self.course_max < 15:
+            q &= Q(course_of_study__lte=self.course_max)
+        if self.author_rating_min > 0:
+            q &= Q(author__author_rating_normalized__gte=self.author_rating_min)
+        if self.author_rating_max < 10:
+            q &= Q(author__author_rating_normalized__lte=self.author_rating_max)
+
+        person_filters = {'author_id': self.author_id, 'author__username': self.author_username,
+                          'implementer_id': self.implementer_id, 'implementer__username': self.implementer_username}
+        q &= Q(**{lookup: value for lookup, value in person_filters.items() if value is not None})
+        if self.excluded_author_id is not None:
+            q &= ~Q(author_id=self.excluded_author_id)
+
+        if self.tags is not None:
+            # фильтрация по тегам всегда одним подзапросом к таблице связей task_tags,
+            # сколько бы тегов ни передали (по ней есть индекс (tasktag_id, task_id), см. миграцию 0010)
+            task_tags = Task.tags.through.objects.filter(tasktag_id__in=self.tags).values('task_id')
+            if self.tags_grouping_type == 'and':
+                # GROUP BY task_id HAVING COUNT(*) = количество тегов
+                task_tags = task_tags.annotate(matched_tags=Count('tasktag_id')).filter(
+                    matched_tags=len(self.tags)).values('task_id')
+            q &= Q(pk__in=task_tags)
+
+        if self.statuses is not None:
+            # один статус - через =: частичные индексы (status = 'A') sqlite подбирает только по такому условию
+            q &= Q(status__in=sorted(self.statuses)) if len(self.statuses) > 1 else Q(status=min(self.statuses))
+        if self.stages is not None:
+            q &= Q(stage_of_study__in=sorted(self.stages))
+        if self.subjects is not None:
+            q &= Q(subject__in=sorted(self.subjects))
+
+        # количество заявок хранится в самой задаче, GROUP BY не нужен
+        if self.applications_min is not None:
+            q &= Q(applications_count__gte=self.applications_min)
+        if self.applications_max is not None:
+            q &= Q(applications_count__lte=self.applications_max)
+
+        if self.date_start is not None:
+            q &= Q(**{self.date_type + '__gte': self.date_start})
+        if self.date_end is not None:
+            q &= Q(**{self.date_type + '__lte': self.date_end})
+        return q
+
+    def filter(self, queryset):
+        queryset = queryset.filter(self.to_q())
+        if self.search_query is not None:
+            # полнотекстовый поиск, добавляет аннотацию relevance для sort=relevance
+            queryset = search_tasks(queryset, self.search_query)
+        return queryset
+
+    def order(self, queryset):
+        if self.sort is None:
+            return queryset
+        if get_sort_field(self.sort) == 'relevance':
+            # sort=relevance - сначала самые подходящие задачи
+            return queryset.order_by('-relevance' if self.sort == 'relevance' else 'relevance')
+        return queryset.order_by(self.sort.replace('author_rating', 'author__author_rating_normalized'))
+
+    def as_query_params(self):
+        # каноническая запись фильтров в терминах параметров запроса (отдается в ответе как filters)
+        params = {'tags': self.tags, 'tags_grouping_type': self.tags_grouping_type,
+                  'task_status': self.statuses, 'stage': self.stages,
+                  'course_min': self.course_min, 'course_max': self.course_max, 'subjects': self.subjects,
+                  'author_rating_min': self.author_rating_min, 'author_rating_max': self.author_rating_max,
+                  'applications_min': self.applications_min, 'applications_max': self.applications_max,
+                  'date_type': self.date_type, 'date_start': self.date_start, 'date_end': self.date_end,
+                  'search_query': self.search_query, 'sort': self.sort}
+        for name, value in params.items():
+            if isinstance(value, frozenset):
+                params[name] = ','.join(str(item) for item in sorted(value))
+            elif isinstance(value, datetime.datetime):
+                params[name] = value.isoformat()
+        return {name: value for name, value in params.items() if value is not None}
@@ -1,9 +1,12 @@
 import datetime
+from django.utils import timezone
 from rest_framework import permissions, status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 
-from tasks.models import TaskTag, TaskSubject, Task
+from tasks.caching import bump_tasks_version
+from tasks.models import TaskTag, TaskSubject, Task, update_user_stats, task_user_stats, tasks_user_stats
+from tasks.search import index_created_tasks
 from users.models import User
 
 import random
@@ -313,12 +316,67 @@ def generate_tasks(request):
                             stop_accepting_applications_at=datetime.datetime.now() + datetime.timedelta(
                                 days=random.randint(3, 40)))
         current_task.save()
+        update_user_stats(added=[task_user_stats(current_task.author_id, None, current_task.status)])
         for tag in current_task_tags:
             current_task.tags.add(tag)
         current_task.save()
     return Response(status=status.HTTP_201_CREATED)
 
 
+def generate_tasks_bulk(amount, batch_size=5000, tags_per_task=(1, 5)):
+    # то же самое что generate_tasks, но пачками через bulk_create.
+    # используется в бенчмарках (manage.py benchmark_*), где нужны сотни тысяч задач.
+    # возвращает id созданных задач, чтобы потом удалить ровно их (в диапазон id между ними
+    # могут попасть настоящие задачи, созданные параллельно)
+    tags_ids = list(TaskTag.objects.values_list('id', flat=True))
+    subjects = list(TaskSubject.objects.all())
+    users_ids = list(User.objects.values_list('id', flat=True))
+
+    tasks_ids = []
+    created = 0
+    while created < amount:
+        current_batch_size = min(batch_size, amount - created)
+        tasks = []
+        for _ in range(current_batch_size):
+            current_task_subject = random.choice(subjects)
+            tasks.append(Task(author_id=random.choice(users_ids),
+                              title=current_task_subject.name + ' ' + random.choice(russian_words),
+                              price=random.randint(1, 10000),
+                              stage_of_study=random.choice(['N', 'S', 'C', 'B', 'M', 'PG']),
+                              course_of_study=random.randint(0, 15),
+                              subject=current_task_subject,
+                              description=' '.join(random.choices(russian_words, k=50)),
+                              status='A',
+                              stop_accepting_applications_at=timezone.now() + datetime.timedelta(
+                                  days=random.randint(3, 40))))
+        # и postgres, и sqlite (>= 3.35) возвращают id созданных строк из bulk_create
+        batch_ids = [task.id for task in Task.objects.bulk_create(tasks)]
+        update_user_stats(added=[task_user_stats(task.author_id, None, task.status) for task in tasks])
+        index_created_tasks(tasks)
+        tasks_ids += batch_ids
+
+        if tags_ids:
+            task_tags = []
+            for task_id in batch_ids:
+                current_task_tags_amount = random.randint(tags_per_task[0], min(tags_per_task[1], len(tags_ids)))
+                for tag_id in random.sample(tags_ids, k=current_task_tags_amount):
+                    task_tags.append(Task.tags.through(task_id=task_id, tasktag_id=tag_id))
+            Task.tags.through.objects.bulk_create(task_tags, batch_size=batch_size)
+
+        created += current_batch_size
+    # bulk_create не отправляет сигналы, кэш списка заданий сбрасываем сами (поисковый индекс - выше)
+    bump_tasks_version()
+    return tasks_ids
+
+
+def delete_generated_tasks(tasks_ids, batch_size=5000):
+    # удаление пачками, чтобы не собирать в памяти каскад из миллиона объектов
+    for batch_start in range(0, len(tasks_ids), batch_size):
+        tasks = Task.objects.filter(id__in=tasks_ids[batch_start:batch_start + batch_size])
+        update_user_stats(removed=[tasks_user_stats(tasks)])
+        tasks.delete()
+
+
 @api_view(['POST'])
 @permission_classes((permissions.IsAdminUser,))
 def default_generator(request):
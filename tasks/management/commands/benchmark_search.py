@@ -0,0 +1,65 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from tasks.generator_views import generate_tasks_bulk, delete_generated_tasks, russian_words
+from tasks.models import Task, TaskSubject
+from tasks.search import search_tasks, inverted_index, use_postgres_search
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает старый поиск через icontains с полнотекстовым поиском. '
+            'Генерирует --tasks задач (по умолчанию 1 000 000) и удаляет их после замера')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=1_000_000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--queries', type=int, default=20, help='сколько случайных запросов прогнать')
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--keep', action='store_true', help='не удалять сгенерированные задачи')
+
+    def handle(self, *args, **options):
+        if not User.objects.exists() or not TaskSubject.objects.exists():
+            self.stderr.write('Нужен хотя бы один пользователь и один предмет (см. fixtures/)')
+            return
+
+        self.stdout.write(f"Генерация {options['tasks']} задач...")
+        started = time.perf_counter()
+        tasks_ids = generate_tasks_bulk(options['tasks'], batch_size=options['batch_size'])
+        self.stdout.write(f'  готово за {time.perf_counter() - started:.1f} c')
+
+        if not use_postgres_search():
+            started = time.perf_counter()
+            inverted_index.build()
+            self.stdout.write(f'  построение индекса в памяти: {time.perf_counter() - started:.1f} c')
+
+        queries = [random.choice(russian_words) for _ in range(options['queries'])]
+        page_size = options['page_size']
+
+        def icontains_page(query):
+            queryset = Task.objects.filter(Q(title__icontains=query) | Q(description__icontains=query))
+            return queryset.count(), list(queryset.order_by('-created_at').values_list('id', flat=True)[:page_size])
+
+        def search_page(query):
+            queryset = search_tasks(Task.objects.all(), query)
+            return queryset.count(), list(queryset.order_by('-relevance').values_list('id', flat=True)[:page_size])
+
+        try:
+            for name, run in (('icontains', icontains_page), ('full text search', search_page)):
+                timings = []
+                matched = 0
+                for query in queries:
+                    started = time.perf_counter()
+                    count, _ = run(query)
+                    timings.append(time.perf_counter() - started)
+                    matched += count
+                timings.sort()
+                self.stdout.write(f'{name}: median {timings[len(timings) // 2] * 1000:.1f} ms, '
+                                  f'p95 {timings[int(len(timings) * 0.95)] * 1000:.1f} ms, '
+                                  f'найдено в среднем {matched // len(queries)} задач')
+        finally:
+            if not options['keep']:
+                delete_generated_tasks(tasks_ids, batch_size=options['batch_size'])
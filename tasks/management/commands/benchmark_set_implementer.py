@@ -0,0 +1,98 @@
+import datetime
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from notifications.models import Notification, new_notification
+from tasks.models import Task, Application
+from tasks.services import assign_implementer
+from users.models import User
+
+
+def legacy_assign_implementer(task, implementer_username):
+    # старая реализация из SetTaskImplementerSerializer.set_implementer: без блокировки,
+    # каждая заявка сохраняется отдельно, каждое уведомление - отдельный INSERT
+    if not (implementer_username in [application.applicant.username for application in task.applications.all()]):
+        raise ValueError(implementer_username)
+    task.status = 'P'
+    task.implementer = User.objects.get(username=implementer_username)
+    task.save()
+    Task.objects.filter(pk=task.pk).update(pending_applications_count=0)
+    new_notification(user=task.author, type='set_task_implementer_notification', affected_object_id=task.id,
+                     message="Вы успешно назначили исполнителя на задание", checked=0)
+    new_notification(user=task.implementer, type='application_accepted_notification', affected_object_id=task.id,
+                     message="Вас назначили исполнителем на задание", checked=0)
+    for application in task.applications.all():
+        if application.applicant.username == implementer_username:
+            application.status = 'A'
+        else:
+            application.status = 'R'
+            new_notification(user=application.applicant, type='application_rejected_notification',
+                             affected_object_id=task.id, message="Ваша заявка на задание отклонена", checked=0)
+        application.save()
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает старое и новое назначение исполнителя на задачу с --applicants заявками. '
+            'Сгенерированные пользователи, задача и уведомления удаляются после замера')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--applicants', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        task = self.create_task(options['applicants'])
+        try:
+            implementer_username = task.applications.order_by('id').last().applicant.username
+            for name, assign in (('legacy', legacy_assign_implementer), ('service', assign_implementer)):
+                timings = []
+                for _ in range(options['repeat']):
+                    self.reset_task(task)
+                    fresh_task = Task.objects.get(pk=task.pk)
+                    # лог запросов ограничен 9000 записей, на старой реализации он переполняется
+                    connection.queries_log.clear()
+                    # замер включает вставку уведомлений, которая у сервиса происходит после коммита
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        assign(fresh_task, implementer_username)
+                        timings.append(time.perf_counter() - started)
+                    notifications = Notification.objects.filter(affected_object_id=task.id).count()
+                self.stdout.write(f"{name}: {options['applicants']} applicants, "
+                                  f"best {min(timings) * 1000:.1f} ms, {len(queries)} queries, "
+                                  f"{notifications} notifications")
+        finally:
+            Notification.objects.filter(affected_object_id=task.id).delete()
+            User.objects.filter(username__startswith='benchmark_').filter(
+                pk__in=Application.objects.filter(task=task).values('applicant')).delete()
+            author = task.author
+            task.delete()
+            author.delete()
+
+    @staticmethod
+    def reset_task(task):
+        Notification.objects.filter(affected_object_id=task.id).delete()
+        Application.objects.filter(task=task).update(status='S')
+        Task.objects.filter(pk=task.pk).update(status='A', implementer=None)
+
+    def create_task(self, applicants_amount):
+        password = make_password(None)
+        suffix = int(time.time())
+        author = User.objects.create(username=f'benchmark_author_{suffix}', email=f'benchmark_author_{suffix}@test.com',
+                                     password=password)
+        task = Task.objects.create(author=author, title='Benchmark', description='Benchmark', status='A',
+                                   stop_accepting_applications_at=timezone.now() + datetime.timedelta(days=7))
+        applicants = User.objects.bulk_create([User(username=f'benchmark_applicant_{suffix}_{i}',
+                                                    email=f'benchmark_applicant_{suffix}_{i}@test.com',
+                                                    password=password)
+                                               for i in range(applicants_amount)])
+        if applicants[0].pk is None:
+            # бэкенд бд не вернул id из bulk_create
+            applicants = list(User.objects.filter(username__startswith=f'benchmark_applicant_{suffix}_'))
+        Application.objects.bulk_create([Application(applicant=applicant, task=task) for applicant in applicants])
+        Task.objects.filter(pk=task.pk).update(applications_count=applicants_amount,
+                                               pending_applications_count=applicants_amount)
+        return task
@@ -0,0 +1,78 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, DatabaseError
+from django.test.utils import CaptureQueriesContext
+
+from tasks.generator_views import generate_tasks_bulk, delete_generated_tasks
+from tasks.models import Task, TaskTag, TaskSubject
+from tasks.filters import TaskFilterSpec
+from users.models import User
+
+
+def legacy_filter_by_tags(queryset, tags, tags_grouping_type):
+    # старая реализация: "or" через join + distinct, "and" через один join на каждый тег
+    if tags_grouping_type == 'or':
+        return queryset.filter(tags__in=tags).distinct()
+    for tag in tags:
+        queryset = queryset.filter(tags=tag)
+    return queryset
+
+
+def filter_by_tags(queryset, tags, tags_grouping_type):
+    return TaskFilterSpec(tags=frozenset(tags), tags_grouping_type=tags_grouping_type).filter(queryset)
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает старую и новую фильтрацию задач по тегам при 10/100/1000 тегах в фильтре. '
+            'Генерирует --tasks задач и --tags тегов и удаляет их после замера')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=200_000)
+        parser.add_argument('--tags', type=int, default=1000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--legacy-max-tags', type=int, default=100,
+                            help='старый "and" делает join на каждый тег, на большем количестве тегов его не запускаем')
+        parser.add_argument('--keep', action='store_true', help='не удалять сгенерированные задачи и теги')
+
+    def handle(self, *args, **options):
+        if not User.objects.exists() or not TaskSubject.objects.exists():
+            self.stderr.write('Нужен хотя бы один пользователь и один предмет (см. fixtures/)')
+            return
+
+        missing_tags = max(options['tags'] - TaskTag.objects.count(), 0)
+        created_tags = TaskTag.objects.bulk_create(
+            [TaskTag(name=f'benchmark_tag_{i}_{random.randint(0, 10 ** 9)}') for i in range(missing_tags)])
+
+        self.stdout.write(f"Генерация {options['tasks']} задач...")
+        tasks_ids = generate_tasks_bulk(options['tasks'], batch_size=options['batch_size'], tags_per_task=(1, 10))
+        tags_ids = list(TaskTag.objects.values_list('id', flat=True))
+        page_size = options['page_size']
+
+        try:
+            for tags_amount in (10, 100, 1000):
+                tags = random.sample(tags_ids, k=min(tags_amount, len(tags_ids)))
+                for grouping in ('or', 'and'):
+                    implementations = [('new', filter_by_tags)]
+                    if grouping == 'or' or tags_amount <= options['legacy_max_tags']:
+                        implementations.insert(0, ('legacy', legacy_filter_by_tags))
+                    for name, tags_filter in implementations:
+                        queryset = tags_filter(Task.objects.all(), tags, grouping)
+                        with CaptureQueriesContext(connection) as queries:
+                            started = time.perf_counter()
+                            try:
+                                count = queryset.count()
+                                list(queryset.order_by('-created_at').values_list('id', flat=True)[:page_size])
+                            except DatabaseError as error:
+                                # например sqlite: "at most 64 tables in a join"
+                                self.stdout.write(f'{tags_amount} tags, {grouping}, {name}: ошибка бд: {error}')
+                                continue
+                            elapsed = time.perf_counter() - started
+                        self.stdout.write(f'{tags_amount} tags, {grouping}, {name}: {elapsed * 1000:.1f} ms, '
+                                          f'{len(queries)} queries, {count} tasks')
+        finally:
+            if not options['keep']:
+                delete_generated_tasks(tasks_ids, batch_size=options['batch_size'])
+                TaskTag.objects.filter(id__in=[tag.id for tag in created_tags]).delete()
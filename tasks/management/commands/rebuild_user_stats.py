@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q
+
+from tasks.models import Task, Application
+from users.models import User, UserStats, USER_STATS_FIELDS
+
+# поле UserStats с общим количеством -> (queryset, поле пользователя, поле с активными, условие активности)
+GROUPED_STATS = (
+    ('authored_total', Task.objects.all(), 'author_id', 'authored_active', Q(status__in=['A', 'P'])),
+    ('implementered_total', Task.objects.all(), 'implementer_id', 'implementered_active', Q(status='P')),
+    ('applications_total', Application.objects.all(), 'applicant_id', 'applications_active', Q(status='S')),
+)
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает UserStats у всех пользователей по задачам и заявкам. '
+            'Пачками по --batch-size пользователей: на пачку три сгруппированных запроса и одна вставка с обновлением. '
+            'Нужен после загрузки фикстур и правок в бд в обход api')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        rebuilt = repaired = 0
+        last_id = 0
+        while True:
+            ids = list(User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            last_id = ids[-1]
+
+            with transaction.atomic():
+                # блокируем строки пачки: параллельные F() обновления дождутся записи и применятся поверх нее
+                current = {stats['user_id']: stats for stats in UserStats.objects.select_for_update()
+                           .filter(user_id__in=ids).values('user_id', *USER_STATS_FIELDS)}
+
+                actual = {user_id: dict.fromkeys(USER_STATS_FIELDS, 0) for user_id in ids}
+                for total_field, queryset, user_field, active_field, active_condition in GROUPED_STATS:
+                    for user_id, total, active in (queryset.filter(**{f'{user_field}__in': ids}).order_by()
+                                                   .values(user_field)
+                                                   .annotate(total=Count('id'),
+                                                             active=Count('id', filter=active_condition))
+                                                   .values_list(user_field, 'total', 'active')):
+                        actual[user_id][total_field] = total
+                        actual[user_id][active_field] = active
+
+                drifted = [UserStats(user_id=user_id, **stats) for user_id, stats in actual.items()
+                           if current.get(user_id) != {'user_id': user_id, **stats}]
+                # unique_fields - имя колонки: django 4.1 подставляет его в ON CONFLICT как есть
+                UserStats.objects.bulk_create(drifted, update_conflicts=True, unique_fields=['user_id'],
+                                              update_fields=USER_STATS_FIELDS)
+
+            rebuilt += len(ids)
+            repaired += len(drifted)
+
+        self.stdout.write(self.style.SUCCESS(f'Проверено пользователей: {rebuilt}, исправлено: {repaired}'))
@@ -0,0 +1,83 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from tasks.caching import bump_tasks_version
+from tasks.models import Review
+from users.models import User
+
+# роль -> (тип отзыва, путь от отзыва к оцениваемому пользователю).
+# Отзыв автора (A) оценивает исполнителя, отзыв исполнителя (I) - автора, как в tasks.views.update_rating
+RATING_ROLES = {
+    'implementer': ('A', 'task__implementer_id'),
+    'author': ('I', 'task__author_id'),
+}
+RATING_FIELDS = [f'{role}_{field}' for role in RATING_ROLES
+                 for field in ('rating', 'review_counter', 'rating_normalized')]
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает рейтинги пользователей (сумма, количество отзывов и средняя для автора и исполнителя) '
+            'по таблице Review и исправляет расхождения. Пачками по --batch-size пользователей: '
+            'на пачку один сгруппированный запрос на роль и bulk_update изменившихся')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--dry-run', action='store_true', help='только показать расхождения')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+
+        checked = repaired = 0
+        last_id = 0
+        while True:
+            ids = list(User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            last_id = ids[-1]
+
+            with transaction.atomic():
+                # блокируем пачку пользователей: отзыв, оставленный во время пересчета, дождется записи
+                # и применит свое F() изменение уже поверх пересчитанного значения
+                users = list(User.objects.select_for_update().filter(id__in=ids).order_by('id')
+                             .only('id', 'username', *RATING_FIELDS))
+                actual = {role: self.get_ratings(review_type, user_path, ids)
+                          for role, (review_type, user_path) in RATING_ROLES.items()}
+
+                drifted = []
+                for user in users:
+                    changes = []
+                    for role in RATING_ROLES:
+                        rating, counter = actual[role].get(user.id, (0, 0))
+                        normalized = rating / counter if counter else \
+                            User._meta.get_field(f'{role}_rating_normalized').default
+                        for field, value in (('rating', rating), ('review_counter', counter),
+                                             ('rating_normalized', normalized)):
+                            field = f'{role}_{field}'
+                            current = getattr(user, field)
+                            if current != value and not (isinstance(value, float) and abs(current - value) < 1e-9):
+                                changes.append(f'{field} {current} -> {value}')
+                                setattr(user, field, value)
+                    if changes:
+                        drifted.append(user)
+                        self.stdout.write(f'user {user.id} ({user.username}): ' + ', '.join(changes))
+
+                if drifted and not dry_run:
+                    User.objects.bulk_update(drifted, RATING_FIELDS, batch_size=batch_size)
+                    # рейтинг автора виден в списке заданий, а bulk_update не отправляет сигналы
+                    bump_tasks_version()
+
+            checked += len(users)
+            repaired += len(drifted)
+
+        action = 'найдено' if dry_run else 'исправлено'
+        self.stdout.write(self.style.SUCCESS(f'Проверено пользователей: {checked}, {action} расхождений: {repaired}'))
+
+    @staticmethod
+    def get_ratings(review_type, user_path, users_ids):
+        # {user_id: (сумма оценок, количество отзывов)} одним GROUP BY
+        return {user_id: (rating, counter) for user_id, rating, counter in
+                Review.objects.filter(review_type=review_type, **{f'{user_path}__in': users_ids}).order_by()
+                .values(user_path).annotate(rating=Sum('rating'), counter=Count('id'))
+                .values_list(user_path, 'rating', 'counter')}
@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery, Q, F
+from django.db.models.functions import Coalesce
+
+from tasks.caching import bump_tasks_version
+from tasks.models import Task, Application, Review
+
+
+def count_of(queryset):
+    return Coalesce(Subquery(queryset.filter(task=OuterRef('pk')).order_by().values('task')
+                             .annotate(amount=Count('pk')).values('amount')), 0)
+
+
+class Command(BaseCommand):
+    help = ('Сверяет applications_count, pending_applications_count и reviews_count у задач '
+            'с реальными данными и исправляет расхождения')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--dry-run', action='store_true', help='только показать расхождения')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+
+        checked = repaired = 0
+        last_id = 0
+        while True:
+            ids = list(Task.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            last_id = ids[-1]
+
+            with transaction.atomic():
+                # блокируем пачку задач, чтобы параллельные F() обновления не потерялись между подсчетом и записью
+                drifted = list(Task.objects.select_for_update()
+                               .filter(id__gte=ids[0], id__lte=last_id)
+                               .only('id', *Task.counter_fields)
+                               .annotate(actual_applications_count=count_of(Application.objects.all()),
+                                         actual_pending_applications_count=count_of(
+                                             Application.objects.filter(status='S')),
+                                         actual_reviews_count=count_of(Review.objects.all()))
+                               .filter(~Q(applications_count=F('actual_applications_count')) |
+                                       ~Q(pending_applications_count=F('actual_pending_applications_count')) |
+                                       ~Q(reviews_count=F('actual_reviews_count'))))
+
+                for task in drifted:
+                    changes = []
+                    for field in Task.counter_fields:
+                        actual = getattr(task, 'actual_' + field)
+                        if getattr(task, field) != actual:
+                            changes.append(f'{field} {getattr(task, field)} -> {actual}')
+                            setattr(task, field, actual)
+                    self.stdout.write(f'task {task.id}: ' + ', '.join(changes))
+
+                if drifted and not dry_run:
+                    Task.objects.bulk_update(drifted, Task.counter_fields, batch_size=batch_size)
+                    # bulk_update не отправляет сигналы, кэш списка заданий сбрасываем сами
+                    bump_tasks_version()
+
+            checked += len(ids)
+            repaired += len(drifted)
+
+        action = 'найдено' if dry_run else 'исправлено'
+        self.stdout.write(self.style.SUCCESS(f'Проверено задач: {checked}, {action} расхождений: {repaired}'))
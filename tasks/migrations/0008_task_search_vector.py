@@ -0,0 +1,59 @@
+# Generated by Django 4.1.2 on 2026-10-18 12:00
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# триггер и GIN индекс есть только в postgres. На sqlite поле остается пустым,
+# а поиск идет через инвертированный индекс в памяти (tasks/search.py)
+CREATE_SEARCH_VECTOR_SQL = """
+CREATE FUNCTION tasks_task_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('russian', coalesce(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(NEW.description, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER tasks_task_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, description ON tasks_task
+    FOR EACH ROW EXECUTE PROCEDURE tasks_task_search_vector_update();
+
+UPDATE tasks_task SET search_vector =
+    setweight(to_tsvector('russian', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('russian', coalesce(description, '')), 'B');
+
+CREATE INDEX tasks_task_search_vector_gin ON tasks_task USING gin (search_vector);
+"""
+
+DROP_SEARCH_VECTOR_SQL = """
+DROP INDEX IF EXISTS tasks_task_search_vector_gin;
+DROP TRIGGER IF EXISTS tasks_task_search_vector_trigger ON tasks_task;
+DROP FUNCTION IF EXISTS tasks_task_search_vector_update();
+"""
+
+
+def create_search_vector_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_SEARCH_VECTOR_SQL)
+
+
+def drop_search_vector_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_SEARCH_VECTOR_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0007_rename_difficulty_course_of_study_task_course_of_study_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_vector_trigger, drop_search_vector_trigger),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.1.2 on 2026-10-18 12:00
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_task_counters(apps, schema_editor):
+    Task = apps.get_model('tasks', 'Task')
+    Application = apps.get_model('tasks', 'Application')
+    Review = apps.get_model('tasks', 'Review')
+
+    def count_of(queryset):
+        return Coalesce(Subquery(queryset.filter(task=OuterRef('pk')).order_by().values('task')
+                                 .annotate(amount=Count('pk')).values('amount')), 0)
+
+    Task.objects.update(applications_count=count_of(Application.objects.all()),
+                        pending_applications_count=count_of(Application.objects.filter(status='S')),
+                        reviews_count=count_of(Review.objects.all()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0008_task_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='applications_count',
+            field=models.IntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='pending_applications_count',
+            field=models.IntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='reviews_count',
+            field=models.IntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+        migrations.RunPython(fill_task_counters, migrations.RunPython.noop),
+    ]
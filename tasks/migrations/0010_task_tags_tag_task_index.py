@@ -0,0 +1,20 @@
+# Generated by Django 4.1.2 on 2026-10-18 12:00
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # таблица связей task <-> tag создается джанго автоматически, поэтому индекс добавляется через sql.
+    # (tasktag_id, task_id) позволяет и "or", и "and" (GROUP BY task_id HAVING COUNT) фильтрацию
+    # выполнять только по индексу, не читая саму таблицу
+
+    dependencies = [
+        ('tasks', '0009_task_counters'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX tasks_task_tags_tag_task_idx ON tasks_task_tags (tasktag_id, task_id);',
+            'DROP INDEX tasks_task_tags_tag_task_idx;',
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.1.2 on 2026-10-18 10:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0011_task_list_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='task',
+            name='task_accepting_id_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='task',
+            name='task_accepting_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='task',
+            name='task_status_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='task',
+            name='task_subject_status_idx',
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(condition=models.Q(('status', 'A')), fields=['closed_at', 'id'], name='task_accepting_closed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(condition=models.Q(('status', 'A')), fields=['pending_applications_count', 'id'], name='task_accepting_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(condition=models.Q(('status', 'A')), fields=['reviews_count', 'id'], name='task_accepting_reviews_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['status', 'id'], name='task_status_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['status', 'created_at', 'id'], name='task_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['subject', 'status', 'id'], name='task_subject_status_idx'),
+        ),
+    ]
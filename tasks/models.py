@@ -1,6 +1,10 @@
+from collections import Counter, defaultdict
+
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import F, Q, Count
 
-from users.models import User, STAGE_OF_STUDY_CHOICES
+from users.models import User, STAGE_OF_STUDY_CHOICES, change_user_stats
 from django.conf import settings
 import os
 from django.core.validators import MaxValueValidator, MinValueValidator
@@ -51,6 +55,17 @@ class Task(models.Model):
     stop_accepting_applications_at = models.DateTimeField()
     expires_at = models.DateTimeField(default=None, null=True)
     closed_at = models.DateTimeField(default=None, null=True)
+
+    # денормализованные счетчики. Меняются только F() выражениями во вьюхах (см. tasks/views.py),
+    # обычный save() их не перезаписывает. Расхождения чинит manage.py repair_task_counters
+    applications_count = models.IntegerField(default=0, validators=[MinValueValidator(0)])
+    pending_applications_count = models.IntegerField(default=0, validators=[MinValueValidator(0)])
+    reviews_count = models.IntegerField(default=0, validators=[MinValueValidator(0)])
+    counter_fields = ('applications_count', 'pending_applications_count', 'reviews_count')
+
+    # поисковый вектор по title + description (russian).
+    # заполняется триггером в postgres, GIN индекс создается там же (см. миграцию 0008_task_search_vector)
+    search_vector = SearchVectorField(null=True, editable=False)
     # этот список нужен, чтобы фронт знал по каким датам можно производить фильтрацию
     datetime_fileds_names = {'created_at': 'Дата создания',
                              'updated_at': 'Дата последнего редактирования',
@@ -58,9 +73,48 @@ class Task(models.Model):
                              'expires_at': 'Дедлайн по задаче',
                              'closed_at': 'Дата закрытия задачи'}  # последнее поле - задача уже выполнена
 
+    class Meta:
+        # индексы подобраны под запросы TaskList (filter_tasks_by_fields + сортировка + курсорная пагинация),
+        # проверяются тестом TaskListQueryPlanTests
+        indexes = [
+            # по умолчанию TaskList показывает только задачи, принимающие заявки (status='A').
+            # частичные индексы по полям сортировки, id в конце - для курсорной пагинации.
+            # Порядок по умолчанию (id) и по дате создания для любого статуса - task_status_id_idx и
+            # task_status_created_idx ниже
+            models.Index(fields=['updated_at', 'id'], condition=Q(status='A'), name='task_accepting_updated_idx'),
+            models.Index(fields=['stop_accepting_applications_at', 'id'], condition=Q(status='A'),
+                         name='task_accepting_stop_idx'),
+            models.Index(fields=['title', 'id'], condition=Q(status='A'), name='task_accepting_title_idx'),
+            models.Index(fields=['course_of_study', 'id'], condition=Q(status='A'), name='task_accepting_course_idx'),
+            models.Index(fields=['applications_count', 'id'], condition=Q(status='A'),
+                         name='task_accepting_apps_idx'),
+            models.Index(fields=['price', 'id'], condition=Q(status='A'), name='task_accepting_price_idx'),
+            models.Index(fields=['expires_at', 'id'], condition=Q(status='A'), name='task_accepting_expires_idx'),
+            models.Index(fields=['closed_at', 'id'], condition=Q(status='A'), name='task_accepting_closed_idx'),
+            models.Index(fields=['pending_applications_count', 'id'], condition=Q(status='A'),
+                         name='task_accepting_pending_idx'),
+            models.Index(fields=['reviews_count', 'id'], condition=Q(status='A'), name='task_accepting_reviews_idx'),
+            # остальные статусы и фильтры
+            models.Index(fields=['status', 'id'], name='task_status_id_idx'),
+            models.Index(fields=['status', 'created_at', 'id'], name='task_status_created_idx'),
+            models.Index(fields=['status', 'stage_of_study', 'course_of_study'], name='task_status_stage_course_idx'),
+            models.Index(fields=['subject', 'status', 'id'], name='task_subject_status_idx'),
+            # задачи пользователя (/users/<id>/tasks, /users/<id>/todo_tasks) и статистика пользователя
+            models.Index(fields=['author', 'status'], name='task_author_status_idx'),
+            models.Index(fields=['implementer', 'status'], name='task_implementer_status_idx'),
+        ]
+
     def __str__(self):
         return str(self.id)
 
+    def save(self, *args, **kwargs):
+        # при обновлении существующей задачи не трогаем счетчики, иначе устаревшие значения из памяти
+        # затрут параллельные инкременты
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.counter_fields]
+        super().save(*args, **kwargs)
+
     def admin_list_applicants(self):
         # только для использоавния в админке
         return ", ".join([application.applicant.username for application in self.applications.all()])
@@ -70,6 +124,56 @@ class Task(models.Model):
         return ", ".join([tag.name for tag in self.tags.all()])
 
 
+def update_task_counters(task_id, **deltas):
+    # атомарное изменение счетчиков задачи одним UPDATE: update_task_counters(task.id, applications_count=1)
+    Task.objects.filter(pk=task_id).update(**{field: F(field) + delta for field, delta in deltas.items()})
+
+
+# вклад задач и заявок в users.models.UserStats: {user_id: Counter(поле: значение)}.
+# Изменение записывается как разница вкладов до и после: update_user_stats(removed=[...], added=[...])
+def task_user_stats(author_id, implementer_id, status, amount=1):
+    stats = defaultdict(Counter)
+    if author_id is not None:
+        stats[author_id]['authored_total'] += amount
+        if status in ('A', 'P'):
+            stats[author_id]['authored_active'] += amount
+    if implementer_id is not None:
+        stats[implementer_id]['implementered_total'] += amount
+        if status == 'P':
+            stats[implementer_id]['implementered_active'] += amount
+    return stats
+
+
+def application_user_stats(applicant_id, status, amount=1):
+    stats = defaultdict(Counter)
+    stats[applicant_id]['applications_total'] += amount
+    if status == 'S':
+        stats[applicant_id]['applications_active'] += amount
+    return stats
+
+
+def tasks_user_stats(queryset):
+    # вклад всех задач queryset, одним сгруппированным запросом
+    stats = defaultdict(Counter)
+    groups = (queryset.order_by().values('author_id', 'implementer_id', 'status').annotate(amount=Count('id'))
+              .values_list('author_id', 'implementer_id', 'status', 'amount'))
+    for author_id, implementer_id, status, amount in groups:
+        for user_id, user_stats in task_user_stats(author_id, implementer_id, status, amount).items():
+            stats[user_id].update(user_stats)
+    return stats
+
+
+def update_user_stats(removed=(), added=()):
+    deltas = defaultdict(Counter)
+    for stats in added:
+        for user_id, user_stats in stats.items():
+            deltas[user_id].update(user_stats)
+    for stats in removed:
+        for user_id, user_stats in stats.items():
+            deltas[user_id].subtract(user_stats)
+    change_user_stats(deltas)
+
+
 class Application(models.Model):
     applicant = models.ForeignKey(User, on_delete=models.CASCADE, related_name='applications')
     message = models.CharField(max_length=500, blank=True, null=True)
@@ -108,3 +212,13 @@ class Review(models.Model):
     class Meta:
         unique_together = ('reviewer', 'task')
         ordering = ['-created_at']
+
+
+class DataVersion(models.Model):
+    # версии данных, от которых зависят закэшированные в памяти процессов ответы (см. tasks/caching.py).
+    # Строка в бд, а не ключ в кэше джанго: с LocMemCache у каждого процесса был бы свой номер версии
+    name = models.CharField(max_length=50, primary_key=True)
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.name}: {self.version}'
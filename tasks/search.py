@@ -0,0 +1,163 @@
+import heapq
+import re
+import threading
+from collections import defaultdict
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import Case, When, Value, FloatField, F
+from django.db.models.functions import Cast
+
+# полнотекстовый поиск по заданиям (заголовок + описание)
+# на postgres используется колонка Task.search_vector, которую поддерживает триггер в бд
+# (см. миграцию 0008_task_search_vector), и GIN индекс по ней.
+# на sqlite (тесты, локальная разработка) tsvector нет, поэтому используется
+# инвертированный индекс в памяти процесса с упрощенным русским стеммингом
+
+SEARCH_CONFIG = 'russian'
+
+# веса как у setweight(..., 'A') / setweight(..., 'B') в postgres
+TITLE_WEIGHT = 1.0
+DESCRIPTION_WEIGHT = 0.4
+
+# на sqlite в запрос попадают только столько лучших совпадений: и список id, и CASE для relevance
+# растут с их количеством. Остальные задачи в выдачу не попадают ни на одной странице,
+# TaskList сообщает об этом полем search_truncated (см. search_is_truncated)
+FALLBACK_MAX_MATCHES = 1000
+
+# окончания отсортированы по длине, отрезается самое длинное подходящее
+RUSSIAN_ENDINGS = sorted([
+    'ившись', 'ывшись', 'ующими', 'ующего', 'ующему', 'ующей', 'ующий', 'ующая', 'ующее', 'ующие', 'ующую',
+    'остью', 'остей', 'ость', 'ости', 'иями', 'ями', 'ами', 'иях', 'ях', 'ах', 'ием', 'ией',
+    'его', 'ого', 'ему', 'ому', 'ыми', 'ими', 'ий', 'ый', 'ой', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие',
+    'ую', 'юю', 'ых', 'их', 'ом', 'ем', 'ей', 'ью', 'ия', 'ии', 'ию', 'ев', 'ов',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+], key=len, reverse=True)
+MIN_STEM_LENGTH = 3
+
+word_regex = re.compile(r'\w+')
+
+
+def stem(word):
+    word = word.lower().replace('ё', 'е')
+    for ending in RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text):
+    return [stem(word) for word in word_regex.findall(text or '')]
+
+
+def use_postgres_search():
+    return connection.vendor == 'postgresql'
+
+
+class InvertedIndex:
+    # term -> {task_id: вес}. Строится лениво из бд при первом поиске,
+    # дальше поддерживается сигналами post_save/post_delete у Task, а после bulk_create - index_created_tasks
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = defaultdict(dict)
+        self._documents = {}
+        self._is_built = False
+
+    def reset(self):
+        with self._lock:
+            self._postings = defaultdict(dict)
+            self._documents = {}
+            self._is_built = False
+
+    def build(self):
+        from .models import Task
+
+        with self._lock:
+            self._postings = defaultdict(dict)
+            self._documents = {}
+            for task_id, title, description in Task.objects.values_list('id', 'title', 'description').iterator():
+                self._add(task_id, title, description)
+            self._is_built = True
+
+    def add(self, task_id, title, description):
+        self.add_many([(task_id, title, description)])
+
+    def add_many(self, documents):
+        # documents - (task_id, title, description)
+        with self._lock:
+            if self._is_built:
+                for task_id, title, description in documents:
+                    self._remove(task_id)
+                    self._add(task_id, title, description)
+
+    def remove(self, task_id):
+        with self._lock:
+            self._remove(task_id)
+
+    def search(self, search_query):
+        if not self._is_built:
+            self.build()
+
+        terms = set(tokenize(search_query))
+        if not terms:
+            return {}
+
+        with self._lock:
+            # как plainto_tsquery: задача должна содержать все слова запроса
+            postings = [self._postings.get(term, {}) for term in terms]
+            postings.sort(key=len)
+            scores = dict(postings[0])
+            for posting in postings[1:]:
+                scores = {task_id: score + posting[task_id] for task_id, score in scores.items() if task_id in posting}
+            return scores
+
+    def _add(self, task_id, title, description):
+        weights = defaultdict(float)
+        for term in tokenize(title):
+            weights[term] += TITLE_WEIGHT
+        for term in tokenize(description):
+            weights[term] += DESCRIPTION_WEIGHT
+        for term, weight in weights.items():
+            self._postings[term][task_id] = weight
+        self._documents[task_id] = list(weights)
+
+    def _remove(self, task_id):
+        for term in self._documents.pop(task_id, []):
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(task_id, None)
+                if not posting:
+                    del self._postings[term]
+
+
+inverted_index = InvertedIndex()
+
+
+def search_tasks(queryset, search_query):
+    # фильтрует задачи по поисковому запросу и добавляет аннотацию relevance (чем больше, тем лучше)
+    if use_postgres_search():
+        query = SearchQuery(search_query, config=SEARCH_CONFIG)
+        # ts_rank возвращает real, приводим к double precision, чтобы значение в курсоре пагинации
+        # совпадало со значением в бд при сравнении
+        return queryset.filter(search_vector=query).annotate(
+            relevance=Cast(SearchRank(F('search_vector'), query), output_field=FloatField()))
+
+    scores = inverted_index.search(search_query)
+    if len(scores) > FALLBACK_MAX_MATCHES:
+        # при равной релевантности - более новые задачи
+        scores = dict(heapq.nlargest(FALLBACK_MAX_MATCHES, scores.items(), key=lambda item: (item[1], item[0])))
+    return queryset.filter(pk__in=list(scores)).annotate(
+        relevance=Case(*[When(pk=task_id, then=Value(score)) for task_id, score in scores.items()],
+                       default=Value(0.0), output_field=FloatField()))
+
+
+def search_is_truncated(search_query):
+    # на sqlite совпадений больше FALLBACK_MAX_MATCHES: в выдаче только самые релевантные из них.
+    # Поиск в памяти повторяется, это дешевле запроса к бд
+    return not use_postgres_search() and len(inverted_index.search(search_query)) > FALLBACK_MAX_MATCHES
+
+
+def index_created_tasks(tasks):
+    # bulk_create не отправляет post_save, созданные им задачи добавляются в индекс в памяти явно
+    if not use_postgres_search():
+        inverted_index.add_many([(task.id, task.title, task.description) for task in tasks])
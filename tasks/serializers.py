@@ -1,7 +1,6 @@
+from django.db.models import Prefetch
 from rest_framework import serializers
 
-from notifications.models import new_notification
-from users.models import User
 from users.serializers import UserContactsSerializer
 from .models import Task, Application, TaskTag, TaskSubject, Review, TaskFile
 
@@ -25,9 +24,21 @@ class SubjectInfoSerializer(serializers.ModelSerializer):
         model = TaskSubject
 
 
+def applications_by_rating(queryset):
+    # заявки на задачу показываются от исполнителя с самым высоким рейтингом
+    return queryset.order_by('-applicant__implementer_rating_normalized', 'id')
+
+
+def get_applications_by_rating(task):
+    # заявки из TaskDetailSerializer.setup_eager_loading, если задача загружена через него
+    if hasattr(task, 'applications_by_rating'):
+        return task.applications_by_rating
+    return applications_by_rating(task.applications.select_related('applicant'))
+
+
 # display/edit serializers
 class TaskSerializer(serializers.ModelSerializer):
-    applications_amount = serializers.SerializerMethodField(read_only=True)
+    applications_amount = serializers.IntegerField(source='applications_count', read_only=True)
     author = serializers.CharField(source='author.username', read_only=True)
     author_rating_normalized = serializers.FloatField(source='author.author_rating_normalized', read_only=True)
 
@@ -51,8 +62,11 @@ class TaskSerializer(serializers.ModelSerializer):
                   'expires_at')
         model = Task
 
-    def get_applications_amount(self, task):
-        return task.applications.all().count()
+    @staticmethod
+    def setup_eager_loading(queryset):
+        # все что нужно сериализатору достается фиксированным числом запросов на страницу:
+        # автор через join, теги одним prefetch запросом. Количество заявок лежит в самой задаче
+        return queryset.select_related('author').prefetch_related('tags')
 
 
 class TaskDetailSerializer(serializers.ModelSerializer):
@@ -92,12 +106,22 @@ class TaskDetailSerializer(serializers.ModelSerializer):
                   'expires_at',)
         model = Task
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        # задача с автором и исполнителем одним join, остальное - по одному prefetch запросу на связь,
+        # сколько бы ни было заявок, файлов и отзывов
+        return queryset.select_related('author', 'implementer').prefetch_related(
+            'tags',
+            'files',
+            Prefetch('applications', queryset=applications_by_rating(Application.objects.select_related('applicant')),
+                     to_attr='applications_by_rating'),
+            Prefetch('reviews', queryset=Review.objects.select_related('reviewer')))
+
     def get_files(self, task):
         return [TaskFileSerializer(file).data for file in task.files.all()]
 
     def get_applicants(self, task):
-        applications = task.applications.all().order_by('-applicant__implementer_rating_normalized')
-        applicants = [application.applicant.username for application in applications]
+        applicants = [application.applicant.username for application in get_applications_by_rating(task)]
         return applicants
 
     def get_contacts(self, task):
@@ -112,8 +136,7 @@ class TaskDetailSerializer(serializers.ModelSerializer):
             return None
 
     def get_reviews(self, task):
-        reviews = Review.objects.filter(task=task)
-        return [ReviewSerializer(review).data for review in reviews]
+        return [ReviewSerializer(review).data for review in task.reviews.all()]
 
 
 class ApplicationSerializer(serializers.ModelSerializer):
@@ -135,6 +158,12 @@ class ApplicationSerializer(serializers.ModelSerializer):
                   'updated_at',)
         model = Application
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        # заявитель, задача и ее автор одним join, теги всех задач страницы одним prefetch запросом.
+        # Количество заявок TaskSerializer берет из самой задачи
+        return queryset.select_related('applicant', 'task__author').prefetch_related('task__tags')
+
     def get_task(self, application):
         return TaskSerializer(application.task).data
 
@@ -178,7 +207,7 @@ class TaskCreateSerializer(serializers.ModelSerializer):
 class SetTaskImplementerSerializer(serializers.ModelSerializer):
     task = serializers.SerializerMethodField(read_only=True)
     applications = serializers.SerializerMethodField(read_only=True)
-    implementer = serializers.SerializerMethodField(method_name='set_implementer')
+    implementer = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         fields = ('id',
@@ -187,63 +216,20 @@ class SetTaskImplementerSerializer(serializers.ModelSerializer):
                   'applications',)
         model = Task
 
-    def set_implementer(self, task):
-        implementer_username = self.context['request'].data.get('implementer')
-        if implementer_username is None or self.context['request'].method != 'PUT':
-            if task.implementer is not None:
-                return task.implementer.username
-            return task.implementer
-
-        # если еще нет implementer; если accepting applications
-        if not (task.implementer is None):
-            raise serializers.ValidationError(f'This task (id = {task.id}) already have implementer')
-        if not (task.status == 'A'):
-            raise serializers.ValidationError(f'This task (id = {task.id}) status is {task.status}. '
-                                              f'It is not Acception Applications')
-        if not (implementer_username in [application.applicant.username for application in task.applications.all()]):
-            raise serializers.ValidationError(
-                f'This user (id={implementer_username}) haven\'t send application for this task (id={task.id})')
-
-        # если юзер у задания еще не задан,
-        # если задание принимает заявки,
-        # если юзер подавал заявку на исполнение, то
-        # иными словами "если все норм"
-        task.status = 'P'  # задание переходит в режим IN PROGRESS
-        task.implementer = User.objects.get(username=implementer_username)  # задать юзера как исполнителя
-        task.save()
-
-        # если ошибок не вылезло, то отправить уведомление создателю задачи
-        new_notification(user=task.author,
-                         type='set_task_implementer_notification',
-                         affected_object_id=task.id,
-                         message=f"Вы успешно назначили исполнителя на задание",
-                         checked=0)
-        # и новому исполнителю тоже уведомление
-        new_notification(user=task.implementer,
-                         type='application_accepted_notification',
-                         affected_object_id=task.id,
-                         message=f"Вас назначили исполнителем на задание",
-                         checked=0)
-
-        applications = task.applications.all()
-        for application in applications:
-            if application.applicant.username == implementer_username:
-                application.status = 'A'  # статус ACCEPTED
-            else:
-                application.status = 'R'  # статус REJECTED
-                # и всем, чья заявка отклонена тоже уведомления
-                new_notification(user=application.applicant,
-                                 type='application_rejected_notification',
-                                 affected_object_id=task.id,
-                                 message=f"Ваша заявка на задание отклонена",
-                                 checked=0)
-            application.save()
-
-        return implementer_username
+    def get_implementer(self, task):
+        if task.implementer is not None:
+            return task.implementer.username
+        return task.implementer
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        # те же данные, что нужны TaskDetailSerializer; у заявок из prefetch уже проставлена задача,
+        # так что ApplicationSerializer.get_task обходится без запросов
+        return TaskDetailSerializer.setup_eager_loading(queryset)
 
     def get_applications(self, task):
-        applications = task.applications.all().order_by('-applicant__implementer_rating_normalized')
-        applications_info = [ApplicationSerializer(application).data for application in applications]
+        applications_info = [ApplicationSerializer(application).data
+                             for application in get_applications_by_rating(task)]
         return applications_info
 
     def get_task(self, task):
@@ -0,0 +1,70 @@
+from django.db.models import Case, When, Value
+from django.utils import timezone
+from rest_framework import serializers
+
+from notifications.models import notification_dispatcher, notify_many
+from .models import Task, Application, update_user_stats, task_user_stats, application_user_stats
+
+
+def assign_implementer(task, implementer_username):
+    # назначение исполнителя одной транзакцией с фиксированным числом запросов, сколько бы ни было заявок:
+    # строка задачи блокируется (два параллельных назначения не пройдут оба проверку implementer is None),
+    # статусы всех заявок меняются одним UPDATE ... CASE, уведомления вставляются пачкой в той же транзакции.
+    # Переданный объект task после назначения получает новые значения полей
+    with notification_dispatcher.atomic():
+        # of=('self',) - в postgres нельзя блокировать nullable сторону outer join
+        locked_task = Task.objects.select_for_update(of=('self',)).get(pk=task.pk)
+        if locked_task.implementer_id is not None:
+            raise serializers.ValidationError(f'This task (id = {task.id}) already have implementer')
+        if locked_task.status != 'A':
+            raise serializers.ValidationError(f'This task (id = {task.id}) status is {locked_task.status}. '
+                                              f'It is not Acception Applications')
+
+        application = (Application.objects.select_related('applicant')
+                       .filter(task=locked_task, applicant__username=implementer_username).first())
+        if application is None:
+            raise serializers.ValidationError(
+                f'This user (id={implementer_username}) haven\'t send application for this task (id={task.id})')
+        implementer = application.applicant
+
+        old_task_stats = task_user_stats(locked_task.author_id, None, locked_task.status)
+        # задание переходит в режим IN PROGRESS, ожидающих заявок больше не остается
+        locked_task.status = 'P'
+        locked_task.implementer = implementer
+        locked_task.pending_applications_count = 0
+        locked_task.save(update_fields=['status', 'implementer', 'pending_applications_count', 'updated_at'])
+
+        applications = list(Application.objects.filter(task=locked_task).values_list('applicant_id', 'status'))
+        rejected_applicants = [applicant_id for applicant_id, _ in applications if applicant_id != implementer.id]
+        Application.objects.filter(task=locked_task).update(
+            status=Case(When(applicant=implementer, then=Value('A')), default=Value('R')),
+            updated_at=timezone.now())
+
+        update_user_stats(
+            removed=[old_task_stats, *[application_user_stats(applicant_id, application_status)
+                                       for applicant_id, application_status in applications]],
+            added=[task_user_stats(locked_task.author_id, implementer.id, locked_task.status),
+                   *[application_user_stats(applicant_id, 'A' if applicant_id == implementer.id else 'R')
+                     for applicant_id, _ in applications]])
+
+        # уведомления создателю задачи, новому исполнителю и всем, чья заявка отклонена.
+        # Диспетчер вставит их пачкой в конце блока atomic()
+        notification_dispatcher.notify(locked_task.author_id,
+                                       send_email=True,
+                                       type='set_task_implementer_notification',
+                                       affected_object_id=task.id,
+                                       message='Вы успешно назначили исполнителя на задание')
+        notification_dispatcher.notify(implementer,
+                                       send_email=True,
+                                       type='application_accepted_notification',
+                                       affected_object_id=task.id,
+                                       message='Вас назначили исполнителем на задание')
+        notify_many(rejected_applicants,
+                    send_email=True,
+                    type='application_rejected_notification',
+                    affected_object_id=task.id,
+                    message='Ваша заявка на задание отклонена')
+
+    for field in ('status', 'implementer', 'pending_applications_count', 'updated_at'):
+        setattr(task, field, getattr(locked_task, field))
+    return implementer
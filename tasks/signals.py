@@ -0,0 +1,53 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from users.models import User
+from .caching import bump_data_version, bump_tasks_version, INFORMATIONAL_VERSION
+from .models import Task, TaskTag, TaskSubject, Application, Review
+from .search import inverted_index, use_postgres_search
+
+
+@receiver(post_save, sender=Task)
+def update_task_search_index(sender, instance, **kwargs):
+    # в postgres search_vector обновляет триггер, здесь поддерживаем только индекс в памяти для sqlite
+    if not use_postgres_search():
+        inverted_index.add(instance.id, instance.title, instance.description)
+
+
+@receiver(post_delete, sender=Task)
+def remove_task_from_search_index(sender, instance, **kwargs):
+    if not use_postgres_search():
+        inverted_index.remove(instance.id)
+
+
+@receiver(post_save, sender=TaskTag)
+@receiver(post_delete, sender=TaskTag)
+@receiver(post_save, sender=TaskSubject)
+@receiver(post_delete, sender=TaskSubject)
+def invalidate_informational_endpoint(sender, **kwargs):
+    # теги и предметы отдаются информационным эндпоинтом
+    bump_data_version(INFORMATIONAL_VERSION)
+
+
+@receiver(post_save, sender=Task)
+@receiver(post_delete, sender=Task)
+@receiver(post_save, sender=Application)
+@receiver(post_delete, sender=Application)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_task_list_cache(sender, **kwargs):
+    # заявки и отзывы меняют счетчики у задач и рейтинг автора, которые видны в списке заданий
+    bump_tasks_version()
+
+
+@receiver(m2m_changed, sender=Task.tags.through)
+def invalidate_task_list_cache_on_tags_change(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_tasks_version()
+
+
+@receiver(post_save, sender=User)
+def invalidate_task_list_cache_on_user_change(sender, update_fields=None, **kwargs):
+    # имя и рейтинг автора отдаются в списке заданий; вход в аккаунт (last_login) список не меняет
+    if update_fields is None or set(update_fields) != {'last_login'}:
+        bump_tasks_version()
@@ -1,3 +1,896 @@
-from django.test import TestCase
+import base64
+import datetime
+import json
+import threading
+from io import StringIO
+from unittest import skipIf
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient, APITestCase
+
+from notifications.models import Notification
+from users.models import User, UserStats
+from .models import Task, TaskTag, TaskSubject, Application, TaskFile, Review
+from .caching import task_list_cache, task_facets_cache
+from .filters import get_sort_field
+from .generator_views import generate_tasks_bulk
+from .search import FALLBACK_MAX_MATCHES, inverted_index, search_tasks, use_postgres_search
+from .views import informational_endpoint_cache, update_rating
+
+
+def create_task(author, **kwargs):
+    data = {'author': author,
+            'title': 'Задача',
+            'description': 'Описание задачи',
+            'status': 'A',
+            'stop_accepting_applications_at': timezone.now() + datetime.timedelta(days=7)}
+    data.update(kwargs)
+    return Task.objects.create(**data)
+
+
+class TaskListQueriesTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.tags = [TaskTag.objects.create(name=f'tag{i}') for i in range(3)]
+        cls.subject = TaskSubject.objects.create(name='Математика')
+        authors = [User.objects.create_user(username=f'author{i}', email=f'author{i}@test.com', password='abc123')
+                   for i in range(5)]
+        applicants = [User.objects.create_user(username=f'applicant{i}', email=f'applicant{i}@test.com',
+                                               password='abc123')
+                      for i in range(3)]
+        for i in range(30):
+            task = create_task(authors[i % len(authors)], subject=cls.subject)
+            task.tags.set(cls.tags[:i % 3 + 1])
+            for applicant in applicants[:i % 4]:
+                Application.objects.create(applicant=applicant, task=task)
+        # заявки созданы напрямую, минуя вьюхи, поэтому счетчики у задач надо пересчитать
+        call_command('repair_task_counters', stdout=StringIO())
+
+    def setUp(self):
+        cache.clear()
+        task_list_cache.clear()
+
+    def test_task_list_query_count_does_not_depend_on_page_size(self):
+        # задачи вместе с авторами одним запросом + один запрос на теги
+        for page_size in (1, 5, 30):
+            with self.assertNumQueries(2):
+                response = self.client.get('/api/v1/tasks/', {'page_size': page_size})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['tasks']), page_size)
+
+    def test_task_list_values(self):
+        response = self.client.get('/api/v1/tasks/', {'page_size': 30})
+        tasks = {task['id']: task for task in response.data['tasks']}
+        for task in Task.objects.all():
+            self.assertEqual(tasks[task.id]['applications_amount'], task.applications.count())
+            self.assertEqual(tasks[task.id]['author'], task.author.username)
+            self.assertEqual(sorted(tasks[task.id]['tags']), sorted(tag.id for tag in task.tags.all()))
+
+
+class TaskListQueryPlanTests(APITestCase):
+    # каждая комбинация фильтра и сортировки, которую рекламирует информационный эндпоинт, прогоняется
+    # через TaskList, и запросы страницы (первой и следующей по курсору) проверяются через EXPLAIN:
+    # задачи должны читаться ожидаемым индексом, а где порядок дает сам индекс - без отдельной сортировки
+    # (USE TEMP B-TREE FOR ORDER BY в sqlite, Sort в postgres). Полный проход по большой таблице не допускается.
+    # На пяти строках без статистики sqlite выбирает план как попало, поэтому в sqlite_stat1 записывается
+    # статистика таблиц на миллион задач. В postgres статистику не подменить: там отключаются seq scan и, где
+    # порядок должен давать индекс, сортировка - если они остались в плане, другого плана нет. Без этого выбор
+    # между равноценными индексами на пустой таблице случаен, поэтому там, где сортировка допустима,
+    # индекс проверяется только в sqlite
+    small_tables = ('tasks_tasktag', 'tasks_tasksubject')
+
+    # поле сортировки -> индекс, который отдает задачи, принимающие заявки (список по умолчанию), в этом порядке
+    sort_indexes = {'id': 'task_status_id_idx',
+                    'created_at': 'task_status_created_idx',
+                    'updated_at': 'task_accepting_updated_idx',
+                    'stop_accepting_applications_at': 'task_accepting_stop_idx',
+                    'title': 'task_accepting_title_idx',
+                    'course_of_study': 'task_accepting_course_idx',
+                    'applications_count': 'task_accepting_apps_idx',
+                    'pending_applications_count': 'task_accepting_pending_idx',
+                    'reviews_count': 'task_accepting_reviews_idx',
+                    'price': 'task_accepting_price_idx',
+                    'expires_at': 'task_accepting_expires_idx',
+                    'closed_at': 'task_accepting_closed_idx'}
+
+    # статистика для sqlite: строк в таблице и доля строк, приходящаяся на одно значение колонки
+    # (для остальных колонок - единицы строк)
+    table_rows = {'tasks_task': 1000000, 'tasks_task_tags': 3000000, 'users_user': 100000}
+    column_selectivity = {'id': 0, 'status': 1 / 4, 'stage_of_study': 1 / 6, 'course_of_study': 1 / 16,
+                          'subject_id': 1 / 100, 'tasktag_id': 1 / 1000,
+                          'author_rating_normalized': 1 / 1000, 'implementer_rating_normalized': 1 / 1000}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tags = [TaskTag.objects.create(name=f'tag{i}') for i in range(3)]
+        cls.subject = TaskSubject.objects.create(name='Математика')
+        author = User.objects.create_user(username='author', email='author@test.com', password='abc123')
+        for i in range(5):
+            task = create_task(author, title=f'Абажур {i}', subject=cls.subject, price=i * 100 or None)
+            task.tags.set(cls.tags[:i % 3 + 1])
+
+    def setUp(self):
+        cache.clear()
+        task_list_cache.clear()
+        if not use_postgres_search():
+            # инвертированный индекс строится полным проходом по таблице один раз на процесс,
+            # к плану запросов списка это не относится
+            inverted_index.build()
+        if connection.vendor == 'sqlite':
+            self.load_sqlite_statistics()
+
+    def load_sqlite_statistics(self):
+        # откатывается вместе с транзакцией теста
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+            for table, rows in self.table_rows.items():
+                cursor.execute('DELETE FROM sqlite_stat1 WHERE tbl = %s', [table])
+                cursor.execute('INSERT INTO sqlite_stat1 VALUES (%s, NULL, %s)', [table, str(rows)])
+                cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = %s", [table])
+                for index, sql in cursor.fetchall():
+                    cursor.execute(f'PRAGMA index_info("{index}")')
+                    # в частичные индексы попадают только задачи со статусом A
+                    stat = [rows // 4 if sql is not None and ' WHERE ' in sql else rows]
+                    for row in cursor.fetchall():
+                        stat.append(max(1, round(stat[-1] * self.column_selectivity.get(row[2], 1e-5))))
+                    cursor.execute('INSERT INTO sqlite_stat1 VALUES (%s, %s, %s)',
+                                   [table, index, ' '.join(str(value) for value in stat)])
+            # планировщик перечитывает sqlite_stat1
+            cursor.execute('ANALYZE sqlite_schema')
+
+    def get_plan(self, sql, sorted_by_index):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                settings = ['enable_seqscan'] + (['enable_sort'] if sorted_by_index else [])
+                for setting in settings:
+                    cursor.execute(f'SET {setting} = off')
+                cursor.execute('EXPLAIN ' + sql)
+                plan = [row[0] for row in cursor.fetchall()]
+                for setting in settings:
+                    cursor.execute(f'RESET {setting}')
+                return plan
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def get_sequential_scans(self, plan):
+        if connection.vendor == 'postgresql':
+            return [line for line in plan if 'Seq Scan on' in line
+                    and not any(table in line for table in self.small_tables)]
+        # SCAN без USING ... INDEX - полный проход по таблице
+        return [line for line in plan if line.startswith('SCAN ') and ' USING ' not in line
+                and not line.startswith('SCAN CONSTANT ROW')
+                and not any(table in line for table in self.small_tables)]
+
+    def get_tasks_access(self, plan):
+        # строки плана, которыми читается tasks_task
+        if connection.vendor == 'postgresql':
+            return [line for line in plan if 'Scan' in line and ' on tasks_task' in line]
+        return [line for line in plan if line.startswith(('SEARCH tasks_task ', 'SCAN tasks_task'))]
+
+    def get_sort_steps(self, plan):
+        if connection.vendor == 'postgresql':
+            return [line for line in plan if 'Sort' in line and 'Sort Key' not in line]
+        return [line for line in plan if line.startswith('USE TEMP B-TREE FOR') and 'ORDER BY' in line]
+
+    def assert_plan(self, params, indexes, sorted_by_index=True):
+        # indexes - индекс (или несколько допустимых: страница по курсору может начинаться с другого),
+        # которым читаются задачи; 'pk' - первичный ключ. В sqlite проход по первичному ключу в порядке id
+        # выглядит как SCAN tasks_task, это не полный проход: его останавливает LIMIT
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/tasks/', dict(params, page_size=2))
+            self.assertEqual(response.status_code, 200)
+            if response.data['next']:
+                self.assertEqual(self.client.get(response.data['next']).status_code, 200)
+
+        postgresql = connection.vendor == 'postgresql'
+        indexes = (indexes,) if isinstance(indexes, str) else indexes
+        if 'pk' in indexes:
+            indexes += ('tasks_task_pkey',) if postgresql else ('INTEGER PRIMARY KEY',)
+            if sorted_by_index and not postgresql:
+                indexes += ('SCAN tasks_task',)
+        task_queries = 0
+        for query in queries:
+            if not query['sql'].startswith('SELECT'):
+                continue
+            is_task_query = 'FROM "tasks_task" ' in query['sql']
+            plan = self.get_plan(query['sql'], sorted_by_index and is_task_query)
+            message = f'{params}: {query["sql"]}\n' + '\n'.join(plan)
+            sequential_scans = self.get_sequential_scans(plan)
+            if is_task_query and 'SCAN tasks_task' in indexes:
+                sequential_scans = [line for line in sequential_scans if line != 'SCAN tasks_task']
+            self.assertEqual(sequential_scans, [], message)
+            if not is_task_query:
+                continue
+            task_queries += 1
+            access = self.get_tasks_access(plan)
+            self.assertNotEqual(access, [], message)
+            if sorted_by_index or not postgresql:
+                self.assertTrue(any(index in line for index in indexes for line in access), message)
+            if sorted_by_index:
+                self.assertEqual(self.get_sort_steps(plan), [], message)
+        self.assertGreater(task_queries, 0)
+
+    def get_sort_matrix(self):
+        response = self.client.get('/api/v1/informational_endpoint')
+        sort_fields = list(response.data['task_filters_info']['sort'])
+        return [None] + sort_fields + ['-' + field for field in sort_fields]
+
+    def test_sorts_use_indexes(self):
+        sorts = self.get_sort_matrix()
+        # сортировки по полю другой таблицы (предмет, рейтинг автора) и по вычисляемой релевантности
+        # индексом по задачам не обслуживаются. Задачи со статусом A читаются по индексу, сортировка - после join,
+        # а следующая страница может начинаться с предмета или автора по курсору
+        joined_sorts = {'subject': 'task_subject_status_idx', 'author_rating': 'task_author_status_idx'}
+        self.assertEqual({get_sort_field(sort) for sort in sorts if sort is not None},
+                         set(self.sort_indexes) - {'id'} | set(joined_sorts) | {'relevance'})
+        for sort in sorts:
+            field = get_sort_field(sort) if sort is not None else 'id'
+            params = {'sort': sort} if sort is not None else {}
+            with self.subTest(sort=sort):
+                if field in self.sort_indexes:
+                    self.assert_plan(params, self.sort_indexes[field])
+                elif field == 'relevance':
+                    # найденные задачи читаются по id и сортируются по вычисленной релевантности
+                    self.assert_plan(dict(params, search_query='абажур'), 'pk', sorted_by_index=False)
+                else:
+                    self.assert_plan(params, ('task_status_id_idx', joined_sorts[field]), sorted_by_index=False)
+
+    def get_filters_matrix(self):
+        # фильтры -> {сортировка: (индекс, упорядочен ли результат индексом)}.
+        # Сортировка допустима, только если фильтр выбирает строки другим индексом: по диапазону
+        # (курс, количество заявок, даты), по нескольким значениям (статусы, ступени), через другую
+        # таблицу (теги, рейтинг автора, поиск) - ни sqlite, ни postgres не сливают такие диапазоны в порядке id
+        by_status = {None: ('task_status_id_idx', True), '-created_at': ('task_status_created_idx', True)}
+        tags = f'{self.tags[0].id},{self.tags[1].id}'
+        by_pk = {None: ('pk', True), '-created_at': ('pk', False)}
+        by_statuses = {None: ('pk', True), '-created_at': (('task_status_id_idx', 'task_status_created_idx'), False)}
+        filters = [({}, by_status),
+                   ({'task_status': 'P'}, by_status),
+                   ({'task_status': 'C'}, by_status),
+                   ({'task_status': 'A,P'}, by_statuses),
+                   ({'tags': tags, 'tags_grouping_type': 'or'}, by_pk),
+                   ({'tags': tags, 'tags_grouping_type': 'and'}, by_pk),
+                   ({'stage': 'S,C'}, {None: ('task_status_id_idx', True),
+                                       '-created_at': ('task_status_stage_course_idx', False)}),
+                   ({'course_min': 3, 'course_max': 7}, {None: ('task_accepting_course_idx', False),
+                                                         '-created_at': ('task_accepting_course_idx', False)}),
+                   ({'subjects': self.subject.id}, {None: ('task_subject_status_idx', True),
+                                                    '-created_at': ('task_subject_status_idx', False)}),
+                   ({'author_rating_min': 5, 'author_rating_max': 9}, {None: ('task_author_status_idx', False),
+                                                                       '-created_at': ('task_author_status_idx',
+                                                                                       False)}),
+                   ({'applications_min': 0, 'applications_max': 10}, {None: ('task_accepting_apps_idx', False),
+                                                                      '-created_at': ('task_accepting_apps_idx',
+                                                                                      False)}),
+                   ({'search_query': 'абажур'}, by_pk)]
+        for date_type in Task.datetime_fileds_names:
+            index = self.sort_indexes[date_type]
+            filters.append(({'date_type': date_type, 'date_start': '2020-01-01', 'date_end': '2100-01-01'},
+                             {None: (index, False), '-created_at': (index, date_type == 'created_at')}))
+        return filters
+
+    def test_filters_use_indexes(self):
+        for filters, expected_plans in self.get_filters_matrix():
+            for sort, (index, sorted_by_index) in expected_plans.items():
+                params = dict(filters, sort=sort) if sort is not None else filters
+                with self.subTest(params=params):
+                    self.assert_plan(params, index, sorted_by_index)
+
+
+class TaskListCacheTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', email='author@test.com', password='abc123')
+        cls.applicant = User.objects.create_user(username='applicant', email='applicant@test.com',
+                                                 password='abc123')
+        cls.task = create_task(cls.author)
+
+    def setUp(self):
+        cache.clear()
+        task_list_cache.clear()
+
+    def test_repeated_anonymous_request_is_served_from_cache(self):
+        first = self.client.get('/api/v1/tasks/', {'sort': '-created_at', 'page_size': 5})
+        self.assertEqual(first['X-Cache'], 'MISS')
+        # порядок параметров в url на ключ не влияет
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/v1/tasks/?page_size=5&sort=-created_at')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.data['tasks'], first.data['tasks'])
+        self.assertEqual(task_list_cache.stats()['hit_ratio'], 0.5)
+
+    def test_application_invalidates_cache(self):
+        self.client.get('/api/v1/tasks/')
+        self.client.force_authenticate(self.applicant)
+        self.assertEqual(self.client.post(f'/api/v1/tasks/{self.task.id}/apply').status_code, 201)
+        self.client.force_authenticate(None)
+
+        response = self.client.get('/api/v1/tasks/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['tasks'][0]['applications_amount'], 1)
+
+    def test_authenticated_requests_bypass_cache(self):
+        self.client.force_authenticate(self.applicant)
+        self.client.get('/api/v1/tasks/')
+        response = self.client.get('/api/v1/tasks/')
+        self.assertFalse(response.has_header('X-Cache'))
+
+
+class InformationalEndpointTests(APITestCase):
+    url = '/api/v1/informational_endpoint'
+
+    def setUp(self):
+        # ответ, собранный в памяти процесса другим тестом, мог пережить откат его транзакции
+        informational_endpoint_cache.update(version=None, data=None, etag=None)
+
+    def get_etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_not_modified(self):
+        etag = self.get_etag()
+        self.assertTrue(etag)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    # версия хранится в бд, а не в кэше джанго: с LocMemCache в нескольких процессах изменение,
+    # сделанное в одном процессе, другие не видели бы. DummyCache - процесс, до которого изменение не дошло
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    def test_tags_and_subjects_change_etag(self):
+        etags = [self.get_etag()]
+        tag = TaskTag.objects.create(name='Новый тег')
+        etags.append(self.get_etag())
+        self.assertIn({'id': tag.id, 'name': 'Новый тег'}, self.client.get(self.url).data['tags_info'])
+        subject = TaskSubject.objects.create(name='Физика')
+        etags.append(self.get_etag())
+        tag.delete()
+        etags.append(self.get_etag())
+        subject.delete()
+        etags.append(self.get_etag())
+        # etag - хэш содержимого: после удаления обоих он снова совпадает с исходным
+        self.assertEqual(len(set(etags)), 4)
+        self.assertEqual(etags[0], etags[-1])
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etags[1])
+        self.assertEqual(response.status_code, 200)
+
+
+class TaskFacetsTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.tags = [TaskTag.objects.create(name=f'tag{i}') for i in range(3)]
+        cls.subjects = [TaskSubject.objects.create(name=f'subject{i}') for i in range(2)]
+        author = User.objects.create_user(username='author', email='author@test.com', password='abc123')
+        for i in range(12):
+            task = create_task(author, subject=cls.subjects[i % 2], stage_of_study='S' if i < 8 else 'C',
+                               status='A' if i < 9 else 'P', price=(i + 1) * 100 if i % 4 else None)
+            task.tags.set(cls.tags[:i % 3 + 1])
+
+    def setUp(self):
+        cache.clear()
+        task_facets_cache.clear()
+
+    def get_facets(self, params=None):
+        response = self.client.get('/api/v1/tasks/facets', params or {})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_query_count_does_not_depend_on_filters(self):
+        for params in ({}, {'tags': f'{self.tags[0].id},{self.tags[2].id}', 'tags_grouping_type': 'and'},
+                       {'subjects': self.subjects[0].id, 'stage': 'S', 'task_status': 'A,P', 'price_buckets': 50}):
+            task_facets_cache.clear()
+            with self.subTest(params=params), self.assertNumQueries(6):
+                self.get_facets(params)
+
+    def test_facet_counts(self):
+        facets = self.get_facets({'subjects': self.subjects[0].id})
+        accepting = Task.objects.filter(status='A')
+        # фильтр по самому фасету не применяется к его счетчикам
+        self.assertEqual({subject['id']: subject['count'] for subject in facets['subjects']},
+                         {subject.id: accepting.filter(subject=subject).count() for subject in self.subjects})
+        statuses = {status['value']: status['count'] for status in facets['statuses']}
+        self.assertEqual(statuses, {'A': 5, 'P': 1, 'C': 0})
+        self.assertEqual({tag['id']: tag['count'] for tag in facets['tags']},
+                         {tag.id: accepting.filter(subject=self.subjects[0], tags=tag).count() for tag in self.tags})
+
+        histogram = facets['price_histogram']
+        self.assertEqual(histogram['total'], 5)
+        self.assertEqual(histogram['without_price'] + sum(bucket['count'] for bucket in histogram['buckets']), 5)
+
+    def test_facets_are_cached_for_anonymous_users(self):
+        self.get_facets()
+        with self.assertNumQueries(0):
+            self.get_facets()
+        create_task(User.objects.get(username='author'))
+        with self.assertNumQueries(6):
+            self.get_facets()
+
+    def test_invalid_price_buckets(self):
+        response = self.client.get('/api/v1/tasks/facets', {'price_buckets': 'many'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error_code'], 'invalid_price_buckets')
+
+
+class TaskFilterSpecTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        task_list_cache.clear()
+
+    def test_invalid_parameters_are_rejected_without_queries(self):
+        for params in ({'date_start': '2020-13-45'}, {'date_type': 'deleted_at'}, {'tags': '1,abc'},
+                       {'task_status': 'A,X'}, {'stage': 'S,Z'}, {'course_min': 'one'},
+                       {'author_rating_max': 'nan'}, {'sort': 'password'}, {'tags_grouping_type': 'xor'},
+                       {'sort': '--title'}, {'course_min': '100000000000000000000000'},
+                       {'applications_max': str(-2 ** 31 - 1)}):
+            with self.subTest(params=params), self.assertNumQueries(0):
+                response = self.client.get('/api/v1/tasks/', params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(response.data['error_code'], ('invalid_filter_parameter', 'unknown_sorting_parameter'))
+
+    def test_equivalent_parameters_have_same_key(self):
+        first = self.client.get('/api/v1/tasks/', {'tags': '3,1,3', 'stage': 'S,C', 'sort': '-price'})
+        second = self.client.get('/api/v1/tasks/', {'sort': '-price', 'stage': 'C,S', 'tags': '1,3'})
+        self.assertEqual(first.data['filters'], second.data['filters'])
+        self.assertEqual(second['X-Cache'], 'HIT')
+
+    def test_tags_grouping(self):
+        author = User.objects.create_user(username='author', email='author@test.com', password='abc123')
+        tags = [TaskTag.objects.create(name=f'tag{i}') for i in range(3)]
+        tasks = {}
+        for name, task_tags in (('first', tags[:1]), ('second', tags[1:2]), ('both', tags[:2]), ('all', tags),
+                                ('third', tags[2:]), ('none', [])):
+            tasks[name] = create_task(author, title=name)
+            tasks[name].tags.set(task_tags)
+
+        def get_titles(params):
+            response = self.client.get('/api/v1/tasks/', {'page_size': 10, **params})
+            self.assertEqual(response.status_code, 200)
+            return sorted(task['title'] for task in response.data['tasks'])
+
+        # задачи, у которых совпало несколько тегов, возвращаются один раз
+        first_and_second = f'{tags[0].id},{tags[1].id}'
+        self.assertEqual(get_titles({'tags': first_and_second}), ['all', 'both', 'first', 'second'])
+        self.assertEqual(get_titles({'tags': first_and_second, 'tags_grouping_type': 'or'}),
+                         ['all', 'both', 'first', 'second'])
+        self.assertEqual(get_titles({'tags': first_and_second, 'tags_grouping_type': 'and'}), ['all', 'both'])
+        # повтор тега в параметре не делает его обязательным дважды
+        self.assertEqual(get_titles({'tags': f'{tags[0].id},{tags[0].id}', 'tags_grouping_type': 'and'}),
+                         ['all', 'both', 'first'])
+
+    def test_cursor_is_bound_to_filters(self):
+        author = User.objects.create_user(username='author', email='author@test.com', password='abc123')
+        for _ in range(3):
+            create_task(author, price=100)
+        next_link = self.client.get('/api/v1/tasks/', {'page_size': 1, 'sort': 'price'}).data['next']
+        cursor = parse_qs(urlparse(next_link).query)['cursor'][0]
+        response = self.client.get('/api/v1/tasks/', {'page_size': 1, 'sort': 'price', 'course_max': 5,
+                                                      'cursor': cursor})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error_code'], 'invalid_cursor')
+
+    def test_pages_of_nullable_sort_cover_all_tasks(self):
+        author = User.objects.create_user(username='author', email='author@test.com', password='abc123')
+        for price in (None, 100, None, 100, 300):
+            create_task(author, price=price)
+        # null стоит там же, где в индексе бд
+        nulls_last = connection.features.nulls_order_largest
+        for sort in ('price', '-price'):
+            tasks = sorted(Task.objects.all(), key=lambda task: (
+                (task.price is None) == nulls_last, task.price or 0, task.id), reverse=sort.startswith('-'))
+            ids, url, params = [], '/api/v1/tasks/', {'page_size': 2, 'sort': sort}
+            while url is not None:
+                response = self.client.get(url, params)
+                ids += [task['id'] for task in response.data['tasks']]
+                url, params, previous = response.data['next'], None, response.data['previous']
+            with self.subTest(sort=sort):
+                self.assertEqual(ids, [task.id for task in tasks])
+                # с последней страницы назад - предыдущая
+                self.assertEqual([task['id'] for task in self.client.get(previous).data['tasks']], ids[2:4])
+
+    def test_forged_cursor_values_are_rejected(self):
+        author = User.objects.create_user(username='author', email='author@test.com', password='abc123')
+        for _ in range(3):
+            create_task(author, price=100)
+        next_link = self.client.get('/api/v1/tasks/', {'page_size': 1, 'sort': 'created_at'}).data['next']
+        payload = json.loads(base64.urlsafe_b64decode(parse_qs(urlparse(next_link).query)['cursor'][0]))
+        # структура, сортировка и ключ фильтров верные, подделаны только значения
+        for values in (['not-a-date', 1], [{'a': 1}, 1], [[1], 1], [payload['v'][0], 'abc'],
+                       [payload['v'][0], 10 ** 30]):
+            forged = base64.urlsafe_b64encode(json.dumps({**payload, 'v': values}).encode()).decode()
+            with self.subTest(values=values):
+                response = self.client.get('/api/v1/tasks/', {'page_size': 1, 'sort': 'created_at',
+                                                              'cursor': forged})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.data['error_code'], 'invalid_cursor')
+
+        response = self.client.get(next_link)
+        self.assertEqual(response.status_code, 200)
+
+
+@skipIf(use_postgres_search(), 'поиск в памяти используется только без postgres')
+class TaskSearchFallbackTests(APITestCase):
+    def test_matches_are_bounded(self):
+        author = User.objects.create_user(username='author', email='author@test.com', password='abc123')
+        best = create_task(author, title='Абажур абажур')
+        Task.objects.bulk_create([Task(author=author, title='Абажур', description='', status='A',
+                                       stop_accepting_applications_at=best.stop_accepting_applications_at)
+                                  for _ in range(FALLBACK_MAX_MATCHES)])
+        inverted_index.build()
+        # индекс общий на процесс, задачи теста в нем не должны остаться
+        self.addCleanup(inverted_index.reset)
+
+        tasks = search_tasks(Task.objects.all(), 'абажур')
+        self.assertEqual(tasks.count(), FALLBACK_MAX_MATCHES)
+        self.assertEqual(tasks.order_by('-relevance').first(), best)
+        # клиент видит, что в выдаче не все совпадения
+        response = self.client.get('/api/v1/tasks/', {'search_query': 'абажур', 'sort': 'relevance'})
+        self.assertTrue(response.data['search_truncated'])
+        self.assertEqual(response.data['tasks'][0]['id'], best.id)
+
+    def test_bulk_created_tasks_are_indexed(self):
+        User.objects.create_user(username='author', email='author@test.com', password='abc123')
+        TaskSubject.objects.create(name='Криптография')
+        inverted_index.build()
+        self.addCleanup(inverted_index.reset)
+
+        tasks_ids = generate_tasks_bulk(3, batch_size=2)
+        self.assertEqual(set(search_tasks(Task.objects.all(), 'криптография').values_list('id', flat=True)),
+                         set(tasks_ids))
+
+
+class TaskSearchTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        task_list_cache.clear()
+        # индекс в памяти (sqlite) строится при первом поиске, задачи теста в нем не должны остаться
+        self.addCleanup(inverted_index.reset)
+
+    def test_search_query_and_relevance_sort(self):
+        author = User.objects.create_user(username='author', email='author@test.com', password='abc123')
+        in_description = create_task(author, title='Домашнее задание', description='Решить задачи по алгебре')
+        in_title = create_task(author, title='Алгебра: линейные уравнения', description='Решить три уравнения')
+        create_task(author, title='Геометрия', description='Доказать теорему')
+
+        response = self.client.get('/api/v1/tasks/', {'search_query': 'алгебра'})
+        self.assertEqual({task['id'] for task in response.data['tasks']}, {in_title.id, in_description.id})
+        self.assertFalse(response.data['search_truncated'])
+
+        # совпадение в заголовке весит больше, чем в описании
+        response = self.client.get('/api/v1/tasks/', {'search_query': 'алгебра', 'sort': 'relevance'})
+        self.assertEqual([task['id'] for task in response.data['tasks']], [in_title.id, in_description.id])
+        response = self.client.get('/api/v1/tasks/', {'search_query': 'решить уравнения', 'sort': 'relevance'})
+        self.assertEqual([task['id'] for task in response.data['tasks']], [in_title.id])
+
+
+class TaskDetailQueriesTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.tags = [TaskTag.objects.create(name=f'tag{i}') for i in range(3)]
+        cls.author = User.objects.create_user(username='author', email='author@test.com', password='abc123')
+        cls.implementer = User.objects.create_user(username='implementer', email='implementer@test.com',
+                                                   password='abc123')
+
+    def create_detailed_task(self, size):
+        task = create_task(self.author, implementer=self.implementer, status='P')
+        task.tags.set(self.tags)
+        for i in range(size):
+            applicant = User.objects.create_user(username=f'applicant{task.id}_{i}',
+                                                 email=f'applicant{task.id}_{i}@test.com', password='abc123',
+                                                 implementer_rating_normalized=i)
+            Application.objects.create(applicant=applicant, task=task)
+            TaskFile.objects.create(task=task, file=f'tasks/task_files/{task.id}_{i}.txt')
+        for reviewer, review_type in ((self.author, 'I'), (self.implementer, 'A'))[:size]:
+            Review.objects.create(reviewer=reviewer, task=task, review_type=review_type, rating=7)
+        return task
+
+    def test_query_count_does_not_depend_on_task_size(self):
+        self.client.force_authenticate(self.author)
+        # задача с автором и исполнителем + теги, файлы, заявки с заявителями, отзывы с авторами
+        for size in (1, 2, 10):
+            task = self.create_detailed_task(size)
+            with self.subTest(size=size), self.assertNumQueries(5):
+                response = self.client.get(f'/api/v1/tasks/{task.id}')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['files']), size)
+            self.assertEqual(len(response.data['reviews']), min(size, 2))
+            self.assertEqual(response.data['contacts']['implementer']['email'], 'implementer@test.com')
+            # заявители от самого высокого рейтинга
+            self.assertEqual(response.data['applicants'],
+                             [f'applicant{task.id}_{i}' for i in reversed(range(size))])
+
+
+class ApplicationsQueriesTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.tags = [TaskTag.objects.create(name=f'tag{i}') for i in range(3)]
+        cls.applicant = User.objects.create_user(username='applicant', email='applicant@test.com', password='abc123')
+        cls.author = User.objects.create_user(username='author', email='author@test.com', password='abc123')
+
+    def test_applications_list_query_count_does_not_depend_on_page_size(self):
+        for i in range(20):
+            author = User.objects.create_user(username=f'author{i}', email=f'author{i}@test.com', password='abc123')
+            task = create_task(author)
+            task.tags.set(self.tags[:i % 3 + 1])
+            Application.objects.create(applicant=self.applicant, task=task)
+        self.client.force_authenticate(self.applicant)
+
+        # заявки с задачами и авторами одним запросом + один запрос на теги
+        for page_size in (1, 20):
+            with self.subTest(page_size=page_size), self.assertNumQueries(2):
+                response = self.client.get(f'/api/v1/users/{self.applicant.id}/applications', {'page_size': page_size})
+            self.assertEqual(len(response.data['results']), page_size)
+            task = Task.objects.get(id=response.data['results'][0]['task']['id'])
+            self.assertEqual(response.data['results'][0]['task']['author'], task.author.username)
+            self.assertEqual(sorted(response.data['results'][0]['task']['tags']),
+                             sorted(tag.id for tag in task.tags.all()))
+
+    def test_set_implementer(self):
+        task = create_task(self.author)
+        task.tags.set(self.tags)
+        for i in range(10):
+            applicant = User.objects.create_user(username=f'applicant{i}', email=f'applicant{i}@test.com',
+                                                 password='abc123', implementer_rating_normalized=i)
+            Application.objects.create(applicant=applicant, task=task)
+        self.client.force_authenticate(self.author)
+
+        with self.assertNumQueries(5):
+            response = self.client.get(f'/api/v1/tasks/{task.id}/set_implementer')
+        self.assertEqual([application['applicant'] for application in response.data['applications']],
+                         [f'applicant{i}' for i in reversed(range(10))])
+        self.assertEqual(response.data['applications'][0]['task']['id'], task.id)
+
+        # уведомления вставляются в транзакции назначения, коммит для них не нужен
+        response = self.client.put(f'/api/v1/tasks/{task.id}/set_implementer', {'implementer': 'applicant3'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({application['applicant']: application['status']
+                          for application in response.data['applications']},
+                         {f'applicant{i}': 'A' if i == 3 else 'R' for i in range(10)})
+        self.assertEqual(Application.objects.filter(task=task, status='A').get().applicant.username, 'applicant3')
+        self.assertEqual(Notification.objects.filter(affected_object_id=task.id,
+                                                     type='application_rejected_notification').count(), 9)
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.implementer.username, task.pending_applications_count),
+                         ('P', 'applicant3', 0))
+
+        # исполнитель уже назначен
+        response = self.client.put(f'/api/v1/tasks/{task.id}/set_implementer', {'implementer': 'applicant4'})
+        self.assertEqual(response.status_code, 400)
+
+
+class UserStatsTests(APITestCase):
+    # после каждого действия через api UserStats должна совпадать с полным пересчетом
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.first, cls.second = [
+            User.objects.create_user(username=name, email=f'{name}@test.com', password='abc123')
+            for name in ('author', 'first', 'second')]
+        cls.tag = TaskTag.objects.create(name='tag')
+        cls.subject = TaskSubject.objects.create(name='Математика')
+
+    def setUp(self):
+        cache.clear()
+        task_list_cache.clear()
+
+    def assert_stats_are_consistent(self):
+        out = StringIO()
+        call_command('rebuild_user_stats', stdout=out)
+        self.assertIn('исправлено: 0', out.getvalue())
+
+    def get_stats(self, user):
+        return {field: value for field, value in UserStats.objects.filter(user=user).values().get().items()
+                if field != 'user_id'}
+
+    def request(self, user, method, url, data=None):
+        self.client.force_authenticate(user)
+        response = getattr(self.client, method)(url, data or {}, format='json')
+        self.assertLess(response.status_code, 300, response.data)
+        self.assert_stats_are_consistent()
+        return response
+
+    def create_task(self):
+        self.request(self.author, 'post', '/api/v1/tasks/new_task',
+                     {'title': 'Задача', 'description': 'Описание', 'tags': [self.tag.id], 'subject': self.subject.id})
+        return Task.objects.latest('id')
+
+    def test_write_paths_keep_stats_in_sync(self):
+        task = self.create_task()
+        self.request(self.first, 'post', f'/api/v1/tasks/{task.id}/apply', {'message': 'first'})
+        self.request(self.second, 'post', f'/api/v1/tasks/{task.id}/apply', {'message': 'second'})
+        self.assertEqual(self.get_stats(self.second)['applications_active'], 1)
+
+        self.request(self.author, 'put', f'/api/v1/tasks/{task.id}/set_implementer', {'implementer': 'first'})
+        self.assertEqual(self.get_stats(self.first)['implementered_active'], 1)
+        self.assertEqual(self.get_stats(self.second)['applications_active'], 0)
+
+        self.request(self.author, 'put', f'/api/v1/tasks/{task.id}/close_task',
+                     {'confirm': 'Я подтверждаю, что хочу закрыть задачу'})
+        self.assertEqual(self.get_stats(self.author), {'authored_active': 0, 'authored_total': 1,
+                                                       'implementered_active': 0, 'implementered_total': 0,
+                                                       'applications_active': 0, 'applications_total': 0})
+
+        other_task = self.create_task()
+        self.request(self.first, 'post', f'/api/v1/tasks/{other_task.id}/apply', {'message': 'first'})
+        self.request(self.second, 'post', f'/api/v1/tasks/{other_task.id}/apply', {'message': 'second'})
+        self.request(self.second, 'delete', f'/api/v1/tasks/{other_task.id}/my_application')
+        self.request(self.author, 'delete', f'/api/v1/tasks/{other_task.id}')
+        self.assertEqual(self.get_stats(self.first)['applications_total'], 1)
+
+    def test_user_statistics_are_read_from_stats(self):
+        UserStats.objects.filter(user=self.author).update(authored_total=5)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/users/author')
+        self.assertEqual(response.data['statistics']['tasks']['authored']['total'], 5)
+
+
+class TaskCountersTests(APITestCase):
+    # applications_count, pending_applications_count и reviews_count меняются F() выражениями в тех же
+    # транзакциях, что и заявки/отзывы; repair_task_counters сверяет их с реальными данными
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.first, cls.second = [
+            User.objects.create_user(username=name, email=f'{name}@test.com', password='abc123')
+            for name in ('author', 'first', 'second')]
+
+    def setUp(self):
+        cache.clear()
+        task_list_cache.clear()
+
+    def repair(self, *args):
+        out = StringIO()
+        call_command('repair_task_counters', *args, batch_size=1, stdout=out)
+        return out.getvalue()
+
+    def request(self, user, method, url, data=None):
+        self.client.force_authenticate(user)
+        response = getattr(self.client, method)(url, data or {}, format='json')
+        self.assertLess(response.status_code, 300, response.data)
+        self.assertIn('найдено расхождений: 0', self.repair('--dry-run'))
+        return response
+
+    def get_counters(self, task):
+        return Task.objects.filter(pk=task.pk).values_list(*Task.counter_fields).get()
+
+    def test_write_paths_keep_counters_in_sync(self):
+        task = create_task(self.author)
+        self.request(self.first, 'post', f'/api/v1/tasks/{task.id}/apply', {'message': 'first'})
+        self.request(self.second, 'post', f'/api/v1/tasks/{task.id}/apply', {'message': 'second'})
+        self.assertEqual(self.get_counters(task), (2, 2, 0))
+
+        self.request(self.second, 'delete', f'/api/v1/tasks/{task.id}/my_application')
+        self.assertEqual(self.get_counters(task), (1, 1, 0))
+
+        self.request(self.author, 'put', f'/api/v1/tasks/{task.id}/set_implementer', {'implementer': 'first'})
+        self.assertEqual(self.get_counters(task), (1, 0, 0))
+
+        self.request(self.author, 'put', f'/api/v1/tasks/{task.id}/close_task',
+                     {'confirm': 'Я подтверждаю, что хочу закрыть задачу'})
+        self.request(self.author, 'post', f'/api/v1/tasks/{task.id}/new_review', {'rating': 8})
+        self.request(self.first, 'post', f'/api/v1/tasks/{task.id}/new_review', {'rating': 9})
+        self.assertEqual(self.get_counters(task), (1, 0, 2))
+
+        self.request(self.author, 'delete', f'/api/v1/tasks/{task.id}/my_review')
+        self.assertEqual(self.get_counters(task), (1, 0, 1))
+
+    def test_drifted_counters_are_repaired(self):
+        task, other_task = create_task(self.author), create_task(self.author)
+        # заявки в обход api, как при loaddata: счетчики остаются нулевыми
+        Application.objects.create(applicant=self.first, task=task)
+        Application.objects.create(applicant=self.second, task=task, status='R')
+        Task.objects.filter(pk=other_task.pk).update(applications_count=3, reviews_count=1)
+
+        output = self.repair('--dry-run')
+        self.assertIn('applications_count 0 -> 2', output)
+        self.assertIn('найдено расхождений: 2', output)
+        self.assertEqual(self.get_counters(task), (0, 0, 0))
+
+        self.assertIn('исправлено расхождений: 2', self.repair())
+        self.assertEqual(self.get_counters(task), (2, 1, 0))
+        self.assertEqual(self.get_counters(other_task), (0, 0, 0))
+        self.assertIn('исправлено расхождений: 0', self.repair())
+
+
+class ReviewRatingConcurrencyTests(TransactionTestCase):
+    # несколько авторов одновременно оставляют отзывы одному исполнителю; ни один отзыв не должен потеряться
+    reviewers_amount = 8
+
+    def setUp(self):
+        self.implementer = User.objects.create_user(username='implementer', email='implementer@test.com',
+                                                    password='abc123')
+        self.authors = [User.objects.create_user(username=f'author{i}', email=f'author{i}@test.com',
+                                                 password='abc123')
+                        for i in range(self.reviewers_amount)]
+        self.tasks = [create_task(author, implementer=self.implementer, status='C') for author in self.authors]
+
+    def post_review(self, author, task, rating, barrier, responses):
+        client = APIClient()
+        client.force_authenticate(author)
+        barrier.wait()
+        try:
+            responses.append(client.post(f'/api/v1/tasks/{task.id}/new_review', {'rating': rating}, format='json'))
+        finally:
+            connections.close_all()
+
+    @skipIf(connection.vendor == 'sqlite', 'sqlite в тестах (shared cache) не допускает параллельных записей')
+    def test_parallel_reviews(self):
+        ratings = [i % 10 + 1 for i in range(self.reviewers_amount)]
+        barrier = threading.Barrier(self.reviewers_amount)
+        responses = []
+        threads = [threading.Thread(target=self.post_review, args=(author, task, rating, barrier, responses))
+                   for author, task, rating in zip(self.authors, self.tasks, ratings)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([response.status_code for response in responses], [201] * self.reviewers_amount)
+        self.implementer.refresh_from_db()
+        self.assertEqual(self.implementer.implementer_rating, sum(ratings))
+        self.assertEqual(self.implementer.implementer_review_counter, self.reviewers_amount)
+        self.assertAlmostEqual(self.implementer.implementer_rating_normalized, sum(ratings) / self.reviewers_amount)
+
+    def test_interleaved_rating_updates(self):
+        # детерминированный вариант гонки: обе "параллельные" ветки прочитали задачу с исполнителем
+        # до того, как любая из них записала рейтинг. Старая реализация теряла первое обновление
+        stale_tasks = [Task.objects.select_related('implementer').get(pk=task.pk) for task in self.tasks[:2]]
+        for task in stale_tasks:
+            update_rating(task=task, review_type='A', rating_delta=6, counter_delta=1)
+        self.implementer.refresh_from_db()
+        self.assertEqual((self.implementer.implementer_rating, self.implementer.implementer_review_counter,
+                          self.implementer.implementer_rating_normalized), (12, 2, 6.0))
+
+    def test_edit_and_delete_review(self):
+        client = APIClient()
+        client.force_authenticate(self.authors[0])
+        client.post(f'/api/v1/tasks/{self.tasks[0].id}/new_review', {'rating': 4}, format='json')
+        client.put(f'/api/v1/tasks/{self.tasks[0].id}/my_review', {'rating': 9}, format='json')
+        self.implementer.refresh_from_db()
+        self.assertEqual((self.implementer.implementer_rating, self.implementer.implementer_review_counter,
+                          self.implementer.implementer_rating_normalized), (9, 1, 9.0))
+
+        client.delete(f'/api/v1/tasks/{self.tasks[0].id}/my_review')
+        self.implementer.refresh_from_db()
+        self.assertEqual((self.implementer.implementer_rating, self.implementer.implementer_review_counter,
+                          self.implementer.implementer_rating_normalized), (0, 0, 7.5))
+
+
+class RecomputeRatingsTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', email='author@test.com', password='abc123')
+        cls.implementer = User.objects.create_user(username='implementer', email='implementer@test.com',
+                                                   password='abc123')
+        for rating in (3, 8):
+            task = create_task(cls.author, implementer=cls.implementer, status='C')
+            # отзывы в обход api: рейтинги пользователей не меняются
+            Review.objects.create(reviewer=cls.author, task=task, review_type='A', rating=rating)
+        Review.objects.create(reviewer=cls.implementer, task=task, review_type='I', rating=10)
+        User.objects.filter(pk=cls.author.pk).update(implementer_rating=40, implementer_review_counter=4)
+
+    def recompute(self, *args):
+        out = StringIO()
+        call_command('recompute_ratings', *args, batch_size=1, stdout=out)
+        return out.getvalue()
+
+    def get_ratings(self, user):
+        return User.objects.filter(pk=user.pk).values_list(
+            'author_rating', 'author_review_counter', 'author_rating_normalized',
+            'implementer_rating', 'implementer_review_counter', 'implementer_rating_normalized').get()
+
+    def test_dry_run_and_repair(self):
+        output = self.recompute('--dry-run')
+        self.assertIn('implementer_rating 0 -> 11', output)
+        self.assertIn('найдено расхождений: 2', output)
+        self.assertEqual(self.get_ratings(self.implementer), (0, 0, 7.5, 0, 0, 7.5))
+
+        self.assertIn('исправлено расхождений: 2', self.recompute())
+        self.assertEqual(self.get_ratings(self.implementer), (0, 0, 7.5, 11, 2, 5.5))
+        self.assertEqual(self.get_ratings(self.author), (10, 1, 10.0, 0, 0, 7.5))
+        self.assertIn('исправлено расхождений: 0', self.recompute())
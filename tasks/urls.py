@@ -2,10 +2,12 @@ from django.urls import path
 
 from .generator_views import generate_tasks
 from .views import TaskList, TaskDetail, CreateTask, TaskApply, ApplicationDetail, SetTaskImplementer, CloseTask, \
-    CreateReview, ReviewDetail, AddFile, DeleteFile
+    CreateReview, ReviewDetail, AddFile, DeleteFile, TaskFacets, \
+    task_list_cache_stats_view
 
 urlpatterns = [
     path('', TaskList.as_view()),  # список заданий
+    path('facets', TaskFacets.as_view()),  # счетчики для фильтров списка заданий
     path('<int:pk>', TaskDetail.as_view()),  # задание по индексу подробно
     path('<int:pk>/apply', TaskApply.as_view()),  # подача заявки на задачу
     path('<int:pk>/set_implementer', SetTaskImplementer.as_view()),  # назначение исполнителя на задачу
@@ -21,5 +23,6 @@ urlpatterns = [
 
     path('new_task', CreateTask.as_view()),  # создание новой задачи
 
-    path('generator', generate_tasks)
+    path('generator', generate_tasks),
+    path('cache_stats', task_list_cache_stats_view)  # статистика кэша списка заданий (для админов)
 ]
@@ -1,107 +1,30 @@
 from rest_framework import generics, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.exceptions import PermissionDenied
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Q, Count, Min, Max
+from django.utils.http import parse_etags
 
 from notifications.models import new_notification
-from .models import Task, Application, TaskTag, TaskSubject, TASK_STATUS_CHOICES, Review, TaskFile
+from .models import Task, Application, TaskTag, TaskSubject, TASK_STATUS_CHOICES, Review, TaskFile, \
+    update_task_counters, update_user_stats, task_user_stats, application_user_stats
 from .serializers import TaskSerializer, TaskDetailSerializer, TaskCreateSerializer, TaskApplySerializer, \
     TagInfoSerializer, SubjectInfoSerializer, ApplicationSerializer, SetTaskImplementerSerializer, \
-    ReviewSerializer, CloseTaskSerializer, AddFileSerializer
+    ReviewSerializer, CloseTaskSerializer, AddFileSerializer, applications_by_rating
+from .services import assign_implementer
+from .search import search_is_truncated
 from rest_framework.response import Response
 
 from rest_framework import status
 import datetime
 from .permissions import IsTaskOwnerOrReadOnly, IsTaskImplementerOrTaskOwner, IsTaskOwnerForFileWork
+from .filters import TaskFilterSpec, get_task_sort_fields_info
+from .caching import get_cache_version, get_data_version, make_etag, INFORMATIONAL_VERSION, TASKS_VERSION, \
+    task_list_cache, task_facets_cache
 
-from users.models import STAGE_OF_STUDY_CHOICES, User
-
-
-def filter_for_person(queryset, request):
-    if request.parser_context['kwargs']:
-        kwarg = request.parser_context['kwargs']
-        kwarg_key = list(kwarg.keys())[0]
-        if kwarg_key == 'authorid':
-            queryset = queryset.filter(author__id=kwarg[kwarg_key])
-        elif kwarg_key == 'implementerid':
-            queryset = queryset.filter(implementer__id=kwarg[kwarg_key])
-        elif kwarg_key == 'authorusername':
-            queryset = queryset.filter(author__username=kwarg[kwarg_key])
-        elif kwarg_key == 'implementerusername':
-            queryset = queryset.filter(implementer__username=kwarg[kwarg_key])
-    elif not request.user.is_anonymous:
-        queryset = queryset.filter(~Q(author=request.user))
-    else:
-        pass
-    return queryset
-
-
-def filter_tasks_by_date(queryset, date_start, date_end, date_type):
-    date_filtering_dict = {}
-    if date_start is not None:
-        date_filtering_dict[date_type + '__gte'] = date_start
-    if date_end is not None:
-        date_filtering_dict[date_type + '__lte'] = date_end
-
-    if date_filtering_dict:
-        # TODO добавить защиту от дурака, который передаст кривую дату
-        queryset = queryset.filter(**date_filtering_dict)
-
-    return queryset
-
-
-def filter_tasks_by_fields(queryset, tags, tags_grouping_type, task_status, stage_of_study,
-                           course_of_study_min, course_of_study_max, subjects,
-                           author_rating_min, author_rating_max):
-    if tags is not None:
-        if isinstance(tags, str):
-            tags = tags.split(',')
-        if isinstance(tags, int):
-            tags = [tags]
-        if tags_grouping_type == 'or':
-            # выведи задания у которых есть tag1 or tag2 etc
-
-            # distinct удаляет дубликаты заданий. В какой-то момент
-            # их изза разных запросов может добавиться несколько экземпляров
-            queryset = queryset.filter(tags__in=tags).distinct()
-        elif tags_grouping_type == 'and':
-            # выведи задания у которых есть tag1 and tag2 etc
-            for tag in tags:
-                queryset = queryset.filter(tags=tag)
-        else:
-            return Response({'detail': f"URL parameter tags_grouping_type is '{tags_grouping_type}'"
-                                       f" but allowed values are 'and' and 'or'",
-                             'error_code': 'unknown_sorting_parameter'},
-                            status=status.HTTP_400_BAD_REQUEST)
-
-    if task_status is not None:
-        if isinstance(task_status, str):
-            task_status = task_status.split(',')
-        queryset = queryset.filter(status__in=task_status)
-
-    if stage_of_study is not None:
-        queryset = queryset.filter(stage_of_study__in=stage_of_study.split(','))
-    queryset = queryset.filter(course_of_study__gte=course_of_study_min)
-    queryset = queryset.filter(course_of_study__lte=course_of_study_max)
-
-    queryset = queryset.filter(author__author_rating_normalized__gte=author_rating_min)
-    queryset = queryset.filter(author__author_rating_normalized__lte=author_rating_max)
-
-    if subjects is not None:
-        # учитывая что у задания поле subject - единственное => выводим только через "or"
-        if isinstance(subjects, str):
-            subjects = subjects.split(',')
-        if isinstance(subjects, int):
-            subjects = [subjects]
-        queryset = queryset.filter(subject__in=subjects)
-
-    return queryset
-
-
-def search_in_tasks(queryset, search_query):
-    if search_query is not None:
-        queryset = queryset.filter(Q(title__icontains=search_query) | Q(description__icontains=search_query))
-    return queryset
+from users.models import STAGE_OF_STUDY_CHOICES, User, change_user_rating
+from users.filters import USER_SORT_FIELDS_NAMES
+from assistance_platform_project.pagination import KeysetPagination
 
 
 # выбрать одну строчку из двух.
@@ -114,62 +37,83 @@ filters_location_in_request_object = 'query_params'
 # filters_location_in_request_object = 'data'
 
 
-def get_filtering_by_fields_params(request):
-    all_filters = getattr(request, filters_location_in_request_object)
-    return {'tags': all_filters.get('tags', None),
-            'tags_grouping_type': all_filters.get('tags_grouping_type', 'or'),
-            'task_status': all_filters.get('task_status',
-                                           None if list(request.parser_context['kwargs'].keys()) else 'A'),
-            'stage_of_study': all_filters.get('stage', None),
-            'course_of_study_min': all_filters.get('course_min', 0),
-            'course_of_study_max': all_filters.get('course_max', 15),
-            'subjects': all_filters.get('subjects', None),
-            'author_rating_min': all_filters.get('author_rating_min', 0),
-            'author_rating_max': all_filters.get('author_rating_max', 10)}
-
-
-def get_filtering_by_date_params(request):
-    all_filters = getattr(request, filters_location_in_request_object)
-    return {'date_start': all_filters.get('date_start', None),
-            'date_end': all_filters.get('date_end', None),
-            'date_type': all_filters.get('date_type', 'created_at')}
+def get_task_filter_spec(request):
+    # разбор и проверка параметров списка заданий (см. tasks/filters.py)
+    return TaskFilterSpec.from_request(request, getattr(request, filters_location_in_request_object))
+
+
+def get_cached_anonymous_response(request, response_cache, key_parts, get_response):
+    if not request.user.is_anonymous:
+        return get_response()
+
+    # анонимные запросы не зависят от пользователя, одинаковые параметры - одинаковый ответ.
+    # Поколение читаем до запроса в бд: если задачи поменяются, пока собирается ответ,
+    # он сохранится под старым поколением и сразу устареет
+    version = get_cache_version(TASKS_VERSION)
+    key = response_cache.make_key(request.build_absolute_uri(request.path), *key_parts)
+    data = response_cache.get(key, version)
+    if data is not None:
+        return Response(data, headers={'X-Cache': 'HIT'})
+
+    response = get_response()
+    if response.status_code == status.HTTP_200_OK:
+        response_cache.set(key, version, response.data)
+    response['X-Cache'] = 'MISS'
+    return response
+
+
+def get_price_histogram(queryset, buckets_amount):
+    # два запроса: границы цен, затем все корзины одним агрегатом с условными COUNT
+    price_range = queryset.aggregate(total=Count('id'), without_price=Count('id', filter=Q(price__isnull=True)),
+                                     min_price=Min('price'), max_price=Max('price'))
+    histogram = {'total': price_range['total'], 'without_price': price_range['without_price'], 'buckets': []}
+    if price_range['min_price'] is None:
+        return histogram
+
+    min_price, max_price = price_range['min_price'], price_range['max_price']
+    bucket_width = max(1, -(-(max_price - min_price + 1) // buckets_amount))
+    bounds = []
+    bucket_start = min_price
+    while bucket_start <= max_price:
+        bounds.append((bucket_start, bucket_start + bucket_width))
+        bucket_start += bucket_width
+
+    counts = queryset.aggregate(**{f'bucket_{i}': Count('id', filter=Q(price__gte=start, price__lt=end))
+                                   for i, (start, end) in enumerate(bounds)})
+    histogram['buckets'] = [{'from': start, 'to': end - 1, 'count': counts[f'bucket_{i}']}
+                            for i, (start, end) in enumerate(bounds)]
+    return histogram
+
+
+def get_task_facets(spec, price_buckets_amount):
+    # для каждого фасета фильтр по нему самому не применяется: счетчик показывает, сколько задач
+    # будет в списке, если выбрать это значение (вместо уже выбранных или вместе с ними).
+    # Исключение - теги в режиме "and": там выбор тега сужает выборку, и счетчик считается с учетом фильтра.
+    # Один сгруппированный запрос на фасет + два на гистограмму цен, независимо от количества значений
+    tags_spec = spec.without('tags') if spec.tags_grouping_type == 'or' else spec
+    tasks = Task.objects.order_by()
+
+    tags = (Task.tags.through.objects.filter(task_id__in=tags_spec.filter(tasks).values('pk'))
+            .values('tasktag_id').annotate(count=Count('task_id')).order_by('-count', 'tasktag_id'))
+    subjects = (spec.without('subjects').filter(tasks).filter(subject__isnull=False)
+                .values('subject').annotate(count=Count('id')).order_by('-count', 'subject'))
+    statuses = dict(spec.without('statuses').filter(tasks).values_list('status').annotate(count=Count('id')))
+    stages = dict(spec.without('stages').filter(tasks).values_list('stage_of_study').annotate(count=Count('id')))
+
+    return Response({'tags': [{'id': tag['tasktag_id'], 'count': tag['count']} for tag in tags],
+                     'subjects': [{'id': subject['subject'], 'count': subject['count']} for subject in subjects],
+                     'statuses': [{'value': value, 'name': name, 'count': statuses.get(value, 0)}
+                                  for value, name in TASK_STATUS_CHOICES],
+                     'stages': [{'value': value, 'name': name, 'count': stages.get(value, 0)}
+                                for value, name in STAGE_OF_STUDY_CHOICES],
+                     'price_histogram': get_price_histogram(spec.filter(tasks), price_buckets_amount),
+                     'filters': spec.as_query_params()})
 
 
 # информационные эндпоинты
-@api_view(['GET'])
-@permission_classes((permissions.AllowAny,))
-def informational_endpoint_view(request):
-    # TODO добавить сортировку по рейтингу автора задачи
-    sort_fields = [field.name for field in Task._meta.get_fields()] + ['author_rating']
-
-    not_for_sort_fields = ["id", "applications", "files", "stage_of_study", "author", "implementer",
-                           "status", "description", "tags", 'reviews']
-    print(sort_fields)
-    for field in not_for_sort_fields:
-        if field in sort_fields:
-            sort_fields.remove(field)
-
-    sort_fields_names = {'title': 'Название',
-                         'course_of_study': 'Класс/курс обучения',
-                         'subject': 'Предмет',
-                         'created_at': 'Дата создания',
-                         'updated_at': 'Дата последнего редактирования',
-                         'stop_accepting_applications_at': 'Дата планируемого окончания приема заявок',
-                         'expires_at': 'Дата планируемого закрытия задачи',
-                         'closed_at': 'Дата закрытия задачи',
-                         'price': 'Вознаграждение за решение',
-                         'author_rating': 'Рейтинг автора задачи'}
-
-    sort_fields_info = {}
-    for sort_field in sort_fields:
-        if sort_field in sort_fields_names:
-            sort_fields_info[sort_field] = sort_fields_names[sort_field]
-        else:
-            sort_fields_info[sort_field] = sort_field
-
-    information_dictionary = {'tags_info': [TagInfoSerializer(tag).data for tag in TaskTag.objects.all()],
-                              'subjects_info': [SubjectInfoSerializer(subject).data for subject in
-                                                TaskSubject.objects.all()],
+def build_informational_dictionary():
+    information_dictionary = {'tags_info': TagInfoSerializer(TaskTag.objects.all(), many=True).data,
+                              'subjects_info': SubjectInfoSerializer(TaskSubject.objects.all(), many=True).data,
                               'task_filters_info': {'fields_filters': {'tags_grouping_type': ['and', 'or'],
                                                                        'tags': None,
                                                                        'task_status': TASK_STATUS_CHOICES,
@@ -178,12 +122,14 @@ def informational_endpoint_view(request):
                                                                        'course_max': 15,
                                                                        'subjects': None,
                                                                        'author_rating_min': 0,
-                                                                       'author_rating_max': 10},
+                                                                       'author_rating_max': 10,
+                                                                       'applications_min': None,
+                                                                       'applications_max': None},
                                                     'search_filter': 'search_query',
                                                     'date_filters': {'date_start': None, 'date_end': None,
                                                                      'date_type': Task.datetime_fileds_names,
                                                                      'date_format': '%Y-%m-%d'},
-                                                    'sort': sort_fields_info},
+                                                    'sort': get_task_sort_fields_info()},
 
                               'reviews_filters_info': {'fields_filters': {'review_type': ['all', 'send', 'received'],
                                                                           'rating_min': 0,
@@ -192,65 +138,127 @@ def informational_endpoint_view(request):
                                                                         'date_format': '%Y-%m-%d'}
                                                        },
 
+                              'users_filters_info': {'fields_filters': {'stage': STAGE_OF_STUDY_CHOICES,
+                                                                        'course_min': 1,
+                                                                        'course_max': 15},
+                                                     'search_filter': 'username_prefix',
+                                                     'sort': USER_SORT_FIELDS_NAMES},
+
                               'profile_choices_info': {'stage_of_study_choices': STAGE_OF_STUDY_CHOICES}}
+    return information_dictionary
+
 
-    return Response(information_dictionary)
+# собранный ответ информационного эндпоинта хранится в памяти процесса вместе с версией,
+# при которой он был собран. Версия - строка DataVersion в бд, общая для всех процессов,
+# меняется при любом изменении TaskTag/TaskSubject (см. tasks/signals.py)
+informational_endpoint_cache = {'version': None, 'data': None, 'etag': None}
+
+
+@api_view(['GET'])
+@permission_classes((permissions.AllowAny,))
+def informational_endpoint_view(request):
+    version = get_data_version(INFORMATIONAL_VERSION)
+    if informational_endpoint_cache['version'] != version:
+        data = build_informational_dictionary()
+        informational_endpoint_cache.update(version=version, data=data, etag=make_etag(data))
+
+    etag = informational_endpoint_cache['etag']
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(informational_endpoint_cache['data'], headers=headers)
 
 
 # эндпоинты для работы с заданиями
 class TaskList(generics.ListAPIView):
     permission_classes = (permissions.AllowAny,)
     serializer_class = TaskSerializer
+    pagination_class = KeysetPagination
+
+    def get_filter_spec(self):
+        # параметры разбираются один раз за запрос
+        if not hasattr(self, 'filter_spec'):
+            self.filter_spec = get_task_filter_spec(self.request)
+        return self.filter_spec
+
+    def get_pagination_key(self):
+        # курсор действителен только для тех фильтров и сортировки, при которых он был выдан
+        return self.get_filter_spec().digest
 
     def get_queryset(self):
-        queryset = Task.objects.all()
-        queryset = filter_for_person(queryset, self.request)
-
-        # фильтрация по полям
-        fields_filters = get_filtering_by_fields_params(request=self.request)
-        queryset = filter_tasks_by_fields(queryset, **fields_filters)
-        if isinstance(queryset, Response):
-            response = queryset
-            return response
-
-        # фильтрация по времени
-        date_filters = get_filtering_by_date_params(request=self.request)
-        queryset = filter_tasks_by_date(queryset, **date_filters)
-        if isinstance(queryset, Response):
-            response = queryset
-            return response
-
-        # поисковой запрос по заголовкам
-        search_query = self.request.query_params.get('search_query', None)
-        queryset = search_in_tasks(queryset, search_query)
-        if isinstance(queryset, Response):
-            response = queryset
-            return response
-
-        sort = self.request.query_params.get('sort')
-        if sort is not None and sort != '-':
-            if sort.endswith('author_rating'):
-                sort = sort.replace('author_rating', 'author__author_rating_normalized')
-            queryset = queryset.order_by(sort)
-        return queryset
+        spec = self.get_filter_spec()
+        queryset = spec.order(spec.filter(Task.objects.all()))
+        return self.get_serializer_class().setup_eager_loading(queryset)
 
     def list(self, request, *args, **kwargs):
+        spec = self.get_filter_spec()
+        key_parts = (spec.key, self.paginator.get_page_size(request),
+                     request.query_params.get(self.paginator.cursor_query_param))
+        return get_cached_anonymous_response(request, task_list_cache, key_parts,
+                                             lambda: self.get_list_response(request))
+
+    def get_list_response(self, request):
         queryset = self.filter_queryset(self.get_queryset())
 
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
+            data = {'tasks': serializer.data,
+                    'filters': self.get_filter_spec().as_query_params(),
+                    'next': self.paginator.get_next_link(),
+                    'previous': self.paginator.get_previous_link()}
+        else:
+            serializer = self.get_serializer(queryset, many=True)
+            data = {'tasks': serializer.data, 'filters': self.get_filter_spec().as_query_params()}
+
+        search_query = self.get_filter_spec().search_query
+        if search_query is not None:
+            # без postgres выдаются только FALLBACK_MAX_MATCHES самых релевантных совпадений
+            data['search_truncated'] = search_is_truncated(search_query)
+        return Response(data)
+
+
+@api_view(['GET'])
+@permission_classes((permissions.IsAdminUser,))
+def task_list_cache_stats_view(request):
+    # попадания/промахи кэшей списка заданий в текущем процессе, для мониторинга
+    return Response({'task_list': task_list_cache.stats(), 'task_facets': task_facets_cache.stats()})
+
 
-        serializer = self.get_serializer(queryset, many=True)
-        return Response({'tasks': serializer.data, 'filters': getattr(request, filters_location_in_request_object)})
+class TaskFacets(generics.GenericAPIView):
+    # счетчики для фильтров списка заданий, принимает те же параметры, что и TaskList
+    permission_classes = (permissions.AllowAny,)
+    default_price_buckets = 10
+    max_price_buckets = 50
+
+    def get(self, request, *args, **kwargs):
+        try:
+            price_buckets_amount = int(request.query_params.get('price_buckets', self.default_price_buckets))
+        except ValueError:
+            return Response({'detail': 'URL parameter price_buckets must be an integer',
+                             'error_code': 'invalid_price_buckets'}, status=status.HTTP_400_BAD_REQUEST)
+        price_buckets_amount = min(max(price_buckets_amount, 1), self.max_price_buckets)
+        spec = get_task_filter_spec(request)
+        return get_cached_anonymous_response(request, task_facets_cache, (spec.key, price_buckets_amount),
+                                             lambda: get_task_facets(spec, price_buckets_amount))
 
 
 class TaskDetail(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = (IsTaskOwnerOrReadOnly,)
-    queryset = Task.objects.all()
     serializer_class = TaskDetailSerializer
 
+    def get_queryset(self):
+        return self.get_serializer_class().setup_eager_loading(Task.objects.all())
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            # заявки удаляются каскадом вместе с задачей, их вклад в статистику заявителей тоже убираем
+            applications = list(instance.applications.values_list('applicant_id', 'status'))
+            instance.delete()
+            update_user_stats(removed=[task_user_stats(instance.author_id, instance.implementer_id, instance.status),
+                                       *[application_user_stats(applicant_id, application_status)
+                                         for applicant_id, application_status in applications]])
+
 
 class CreateTask(generics.CreateAPIView):
     permission_classes = (permissions.IsAuthenticated,)
@@ -283,7 +291,9 @@ class CreateTask(generics.CreateAPIView):
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
     def perform_create(self, serializer, data={}):
-        serializer.save(**data)
+        with transaction.atomic():
+            task = serializer.save(**data)
+            update_user_stats(added=[task_user_stats(task.author_id, task.implementer_id, task.status)])
 
 
 class CloseTask(generics.UpdateAPIView):
@@ -305,6 +315,7 @@ class CloseTask(generics.UpdateAPIView):
 
         if task.implementer:
             new_notification(user=task.implementer,
+                             send_email=True,
                              type='closed_task_notification',
                              affected_object_id=task.id,
                              message=f"Автор задания закрыл его. Вы можете оставить отзыв.",
@@ -312,6 +323,14 @@ class CloseTask(generics.UpdateAPIView):
 
         return Response(serializer.data)
 
+    def perform_update(self, serializer):
+        task = serializer.instance
+        old_status = task.status
+        with transaction.atomic():
+            serializer.save()
+            update_user_stats(removed=[task_user_stats(task.author_id, task.implementer_id, old_status)],
+                              added=[task_user_stats(task.author_id, task.implementer_id, task.status)])
+
 
 class AddFile(generics.CreateAPIView):
     permission_classes = (IsTaskOwnerForFileWork,)
@@ -335,6 +354,7 @@ class DeleteFile(generics.DestroyAPIView):
 class ApplicationsList(generics.ListAPIView):
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = ApplicationSerializer
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         userid = self.request.parser_context['kwargs'].get('userid', None)
@@ -355,7 +375,7 @@ class ApplicationsList(generics.ListAPIView):
         # отсортировать заявки по "рейтингу исполнителя" среди подавших заявки
         queryset = queryset.order_by('-applicant__implementer_rating_normalized')
 
-        return queryset
+        return self.get_serializer_class().setup_eager_loading(queryset)
 
 
 class ApplicationDetail(generics.RetrieveUpdateDestroyAPIView):
@@ -365,7 +385,24 @@ class ApplicationDetail(generics.RetrieveUpdateDestroyAPIView):
     def get_queryset(self):
         queryset = Application.objects.all()
         queryset = queryset.filter(applicant=self.request.user)
-        return queryset
+        return self.get_serializer_class().setup_eager_loading(queryset)
+
+    def perform_update(self, serializer):
+        old_status = serializer.instance.status
+        with transaction.atomic():
+            application = serializer.save()
+            if old_status != application.status and 'S' in (old_status, application.status):
+                update_task_counters(application.task_id,
+                                     pending_applications_count=1 if application.status == 'S' else -1)
+            update_user_stats(removed=[application_user_stats(application.applicant_id, old_status)],
+                              added=[application_user_stats(application.applicant_id, application.status)])
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            update_task_counters(instance.task_id, applications_count=-1,
+                                 pending_applications_count=-1 if instance.status == 'S' else 0)
+            update_user_stats(removed=[application_user_stats(instance.applicant_id, instance.status)])
 
 
 class TaskApply(generics.CreateAPIView):
@@ -402,14 +439,18 @@ class TaskApply(generics.CreateAPIView):
                                        " но можете отредактировать старую", 'error_code': 'application_already_exists'},
                             status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
-        application = self.perform_create(serializer, data)
-        headers = self.get_success_headers(serializer.data)
+        with transaction.atomic():
+            application = self.perform_create(serializer, data)
+            update_task_counters(task.id, applications_count=1, pending_applications_count=1)
+            update_user_stats(added=[application_user_stats(application.applicant_id, application.status)])
 
-        new_notification(user=task.author,
-                         type='application_notification',
-                         affected_object_id=task.id,
-                         message=f"На ваше задание отправлена новая заявка",
-                         checked=0)
+            new_notification(user=task.author,
+                             send_email=True,
+                             type='application_notification',
+                             affected_object_id=task.id,
+                             message=f"На ваше задание отправлена новая заявка",
+                             checked=0)
+        headers = self.get_success_headers(serializer.data)
 
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
@@ -422,8 +463,19 @@ class SetTaskImplementer(generics.RetrieveUpdateAPIView):
     # при пост запросе необходимо в теле запроса передать implementer=userID и он установится как исполнитель
     permission_classes = (IsTaskOwnerOrReadOnly,)
     serializer_class = SetTaskImplementerSerializer
-    queryset = Task.objects.all()
-    # уведомления отправляются через сериализатор
+
+    def get_queryset(self):
+        return self.get_serializer_class().setup_eager_loading(Task.objects.all())
+
+    def perform_update(self, serializer):
+        implementer_username = self.request.data.get('implementer')
+        if implementer_username is None or self.request.method != 'PUT':
+            return
+        task = serializer.instance
+        # проверки, назначение и уведомления - в сервисе, под блокировкой строки задачи
+        assign_implementer(task, implementer_username)
+        # заявки для ответа перечитываем, их статусы поменялись в бд
+        task.applications_by_rating = list(applications_by_rating(task.applications.select_related('applicant')))
 
 
 # работа с отзывами
@@ -462,11 +514,13 @@ class CreateReview(generics.CreateAPIView):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        review = self.perform_create(serializer, data)
-        # если ошибок не выскочило, то нужно пересчитать рейтинг пользователя которому поставили отзыв
-        update_rating(task=task, review_type=data['review_type'],
-                      rating_delta=request.data['rating'],
-                      counter_delta=1)
+        with transaction.atomic():
+            review = self.perform_create(serializer, data)
+            update_task_counters(task.id, reviews_count=1)
+            # если ошибок не выскочило, то нужно пересчитать рейтинг пользователя которому поставили отзыв
+            update_rating(task=task, review_type=data['review_type'],
+                          rating_delta=review.rating,
+                          counter_delta=1)
 
         headers = self.get_success_headers(serializer.data)
 
@@ -478,6 +532,7 @@ class CreateReview(generics.CreateAPIView):
 
         # notification_to_receiver
         new_notification(user=receiver,
+                         send_email=True,
                          type='review_notification',
                          affected_object_id=review.task.id,
                          message=f"Был оставлен отзыв о вас по заданию",
@@ -503,15 +558,14 @@ class ReviewDetail(generics.RetrieveUpdateDestroyAPIView):
 
         task = Task.objects.get(pk=request.parser_context['kwargs']['pk'])
         old_rating = review.rating
-        new_rating = request.data['rating']
 
         serializer = self.get_serializer(review, data=request.data, partial=partial)
         serializer.is_valid(raise_exception=True)
-        self.perform_update(serializer)
-
-        self.update_rating(task=task, review_type=review.review_type,
-                           rating_delta=int(new_rating) - old_rating,
-                           counter_delta=0)
+        with transaction.atomic():
+            self.perform_update(serializer)
+            update_rating(task=task, review_type=review.review_type,
+                          rating_delta=review.rating - old_rating,
+                          counter_delta=0)
 
         if getattr(review, '_prefetched_objects_cache', None):
             review._prefetched_objects_cache = {}
@@ -522,10 +576,12 @@ class ReviewDetail(generics.RetrieveUpdateDestroyAPIView):
         task = Task.objects.get(pk=request.parser_context['kwargs']['pk'])
 
         review = self.get_object()
-        self.perform_destroy(review)
-        update_rating(task=task, review_type=review.review_type,
-                      rating_delta=-review.rating,
-                      counter_delta=-1)
+        with transaction.atomic():
+            self.perform_destroy(review)
+            update_task_counters(task.id, reviews_count=-1)
+            update_rating(task=task, review_type=review.review_type,
+                          rating_delta=-review.rating,
+                          counter_delta=-1)
 
         return Response(status=status.HTTP_204_NO_CONTENT)
 
@@ -533,24 +589,17 @@ class ReviewDetail(generics.RetrieveUpdateDestroyAPIView):
 def update_rating(task, review_type, rating_delta, counter_delta):
     if review_type == 'A':
         # если ревью от автора то пересчитываем исполнителя
-        implementer = task.implementer
-        implementer.implementer_rating += rating_delta
-        implementer.implementer_review_counter += counter_delta
-        implementer.save()
-        implementer.update_implementer_rating()
+        change_user_rating(task.implementer_id, 'implementer', rating_delta, counter_delta)
 
     if review_type == 'I':
         # если ревью от исполнителя то пересчитываем автора
-        author = task.author
-        author.author_rating += rating_delta
-        author.author_review_counter += counter_delta
-        author.save()
-        author.update_author_rating()
+        change_user_rating(task.author_id, 'author', rating_delta, counter_delta)
 
 
 class ReviewList(generics.ListAPIView):
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = ReviewSerializer
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         userid = self.request.parser_context['kwargs'].get('reviewerid', None)
@@ -3,7 +3,7 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.admin import UserAdmin
 
 from .forms import UserCreationForm, UserChangeForm
-from .models import User
+from .models import User, ProfileThumbnailJob
 
 
 class CustomUserAdmin(UserAdmin):
@@ -30,6 +30,22 @@ class CustomUserAdmin(UserAdmin):
                                 "implementer_rating", "implementer_review_counter", "implementer_rating_normalized",)}),
         ("Settings", {"fields": ("show_contacts", "send_email_notifications",)},)
     )
+    # рейтинги меняются только через change_user_rating и recompute_ratings, User.save() их не пишет
+    readonly_fields = ("author_rating", "author_review_counter", "author_rating_normalized",
+                       "implementer_rating", "implementer_review_counter", "implementer_rating_normalized",)
+
+
+class ProfileThumbnailJobAdmin(admin.ModelAdmin):
+    model = ProfileThumbnailJob
+    list_display = ('user',
+                    'source',
+                    'status',
+                    'attempts',
+                    'next_attempt_at',
+                    'created_at',
+                    'finished_at')
+    list_filter = ('status',)
 
 
 admin.site.register(User, CustomUserAdmin)
+admin.site.register(ProfileThumbnailJob, ProfileThumbnailJobAdmin)
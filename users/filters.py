@@ -0,0 +1,75 @@
+import dataclasses
+from typing import FrozenSet, Optional
+
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+
+from tasks.filters import (STAGES_OF_STUDY, FilterSpecKeyMixin, get_sort_field, parse_list, parse_choice,
+                           parse_int)
+
+# параметры списка пользователей (UserList), устроены как TaskFilterSpec в tasks/filters.py.
+# Под сортировки, фильтр по ступени обучения и поиск по началу username есть индексы в User.Meta.indexes
+
+# значение параметра sort -> поле модели
+USER_SORT_FIELDS = {'implementer_rating': 'implementer_rating_normalized',
+                    'author_rating': 'author_rating_normalized',
+                    'username': 'username'}
+
+USER_SORT_FIELDS_NAMES = {'implementer_rating': 'Рейтинг исполнителя',
+                          'author_rating': 'Рейтинг автора',
+                          'username': 'Имя пользователя'}
+
+
+@dataclasses.dataclass(frozen=True)
+class UserFilterSpec(FilterSpecKeyMixin):
+    stages: Optional[FrozenSet[str]] = None
+    course_min: int = 1
+    course_max: int = 15
+    username_prefix: Optional[str] = None
+    sort: Optional[str] = None
+
+    @classmethod
+    def from_request(cls, params):
+        sort = params.get('sort') or None
+        if sort == '-':
+            sort = None
+        if sort is not None and get_sort_field(sort) not in USER_SORT_FIELDS:
+            raise ValidationError({'detail': f"URL parameter sort is '{sort}' but allowed values are "
+                                             f"{', '.join(USER_SORT_FIELDS)} (with optional '-')",
+                                   'error_code': 'unknown_sorting_parameter'})
+
+        return cls(stages=parse_list(params, 'stage', parse_choice(STAGES_OF_STUDY)),
+                   course_min=parse_int(params, 'course_min', 1),
+                   course_max=parse_int(params, 'course_max', 15),
+                   username_prefix=(params.get('username_prefix') or '').strip() or None,
+                   sort=sort)
+
+    def to_q(self):
+        q = Q()
+        if self.stages is not None:
+            q &= Q(stage_of_study__in=sorted(self.stages))
+        # границы по умолчанию совпадают с допустимыми значениями поля, условие не нужно
+        if self.course_min > 1:
+            q &= Q(course_of_study__gte=self.course_min)
+        if self.course_max < 15:
+            q &= Q(course_of_study__lte=self.course_max)
+        if self.username_prefix is not None:
+            # LIKE 'prefix%' с учетом регистра: в postgres идет по индексу с varchar_pattern_ops
+            # (обычный индекс username при локали, отличной от C, для LIKE не подходит)
+            q &= Q(username__startswith=self.username_prefix)
+        return q
+
+    def filter(self, queryset):
+        return queryset.filter(self.to_q())
+
+    def order(self, queryset):
+        if self.sort is None:
+            return queryset.order_by('id')
+        field = USER_SORT_FIELDS[get_sort_field(self.sort)]
+        return queryset.order_by('-' + field if self.sort.startswith('-') else field)
+
+    def as_query_params(self):
+        params = {'stage': ','.join(sorted(self.stages)) if self.stages is not None else None,
+                  'course_min': self.course_min, 'course_max': self.course_max,
+                  'username_prefix': self.username_prefix, 'sort': self.sort}
+        return {name: value for name, value in params.items() if value is not None}
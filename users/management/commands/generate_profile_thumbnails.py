@@ -0,0 +1,109 @@
+import datetime
+import time
+
+from PIL import Image, UnidentifiedImageError
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from users.models import User, ProfileThumbnailJob, schedule_profile_thumbnails
+from users.thumbnails import make_profile_thumbnails
+
+
+class Command(BaseCommand):
+    help = ('Строит миниатюры изображений профиля по заданиям ProfileThumbnailJob пачками по --batch-size. '
+            'Неудачные задания повторяются с экспоненциальной задержкой, после --max-attempts помечаются failed, '
+            'файлы, которые не являются изображениями, - сразу. С --enqueue-missing сначала ставит задания всем '
+            'пользователям, у которых миниатюр для текущего изображения нет (например, после loaddata). '
+            'Без --once работает постоянно, опрашивая очередь раз в --poll-interval секунд')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10)
+        parser.add_argument('--max-attempts', type=int, default=5)
+        parser.add_argument('--backoff', type=int, default=60,
+                            help='задержка перед первым повтором в секундах, дальше удваивается')
+        parser.add_argument('--max-backoff', type=int, default=6 * 60 * 60)
+        parser.add_argument('--poll-interval', type=float, default=5)
+        parser.add_argument('--once', action='store_true', help='обработать все, что готово, и выйти')
+        parser.add_argument('--enqueue-missing', action='store_true')
+
+    def handle(self, *args, **options):
+        self.options = options
+        if options['enqueue_missing']:
+            self.stdout.write(f'Поставлено заданий: {self.enqueue_missing()}')
+
+        done = failed = 0
+        try:
+            while True:
+                batch_done, batch_failed, batch_size = self.process_batch()
+                done += batch_done
+                failed += batch_failed
+                if batch_size < options['batch_size']:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'Построено миниатюр: {done}, с ошибкой: {failed}'))
+
+    def enqueue_missing(self):
+        enqueued = 0
+        users = []
+        for user in (User.objects.exclude(profile_image__isnull=True).exclude(profile_image='')
+                     .only('id', 'profile_image', 'profile_image_thumbnails').order_by('id').iterator(chunk_size=1000)):
+            if user.profile_image_thumbnails.get('source') != user.profile_image.name:
+                users.append(user)
+            if len(users) == 1000:
+                schedule_profile_thumbnails(users)
+                enqueued += len(users)
+                users = []
+        schedule_profile_thumbnails(users)
+        return enqueued + len(users)
+
+    def process_batch(self):
+        with transaction.atomic():
+            # skip_locked - несколько воркеров разбирают очередь, не мешая друг другу
+            jobs = list(ProfileThumbnailJob.objects.select_for_update(skip_locked=True)
+                        .filter(status='P', next_attempt_at__lte=timezone.now())
+                        .order_by('next_attempt_at', 'id')[:self.options['batch_size']])
+            if not jobs:
+                return 0, 0, 0
+
+            # текущие изображения одним запросом: задание для уже замененного изображения просто закрывается
+            current_images = dict(User.objects.filter(pk__in=[job.user_id for job in jobs])
+                                  .values_list('id', 'profile_image'))
+            done = failed = 0
+            for job in jobs:
+                job.attempts += 1
+                if current_images.get(job.user_id) == job.source:
+                    try:
+                        thumbnails = make_profile_thumbnails(job.source)
+                    except (UnidentifiedImageError, Image.DecompressionBombError) as error:
+                        # повтор не поможет
+                        failed += 1
+                        job.status = 'F'
+                        job.last_error = f'{type(error).__name__}: {error}'
+                        continue
+                    except Exception as error:
+                        failed += 1
+                        self.schedule_retry(job, error)
+                        continue
+                    # условие на profile_image - изображение могли заменить, пока строились миниатюры
+                    User.objects.filter(pk=job.user_id, profile_image=job.source).update(
+                        profile_image_thumbnails=thumbnails)
+                    done += 1
+                job.status = 'D'
+                job.finished_at = timezone.now()
+                job.last_error = ''
+
+            ProfileThumbnailJob.objects.bulk_update(jobs, ['status', 'attempts', 'next_attempt_at', 'last_error',
+                                                           'finished_at'])
+        return done, failed, len(jobs)
+
+    def schedule_retry(self, job, error):
+        job.last_error = f'{type(error).__name__}: {error}'
+        if job.attempts >= self.options['max_attempts']:
+            job.status = 'F'
+            return
+        delay = min(self.options['backoff'] * 2 ** (job.attempts - 1), self.options['max_backoff'])
+        job.next_attempt_at = timezone.now() + datetime.timedelta(seconds=delay)
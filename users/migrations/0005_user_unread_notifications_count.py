@@ -0,0 +1,29 @@
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_unread_notifications(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    Notification = apps.get_model('notifications', 'Notification')
+    unread = (Notification.objects.filter(user=OuterRef('pk'), checked=False).order_by().values('user')
+              .annotate(amount=Count('pk')).values('amount'))
+    User.objects.update(unread_notifications_count=Coalesce(Subquery(unread), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_user_send_email_notifications_user_show_contacts'),
+        ('notifications', '0003_email_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='unread_notifications_count',
+            field=models.IntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+        migrations.RunPython(count_unread_notifications, migrations.RunPython.noop),
+    ]
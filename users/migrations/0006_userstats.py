@@ -0,0 +1,54 @@
+import django.core.validators
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+STATS_FIELDS = ('authored_active', 'authored_total', 'implementered_active', 'implementered_total',
+                'applications_active', 'applications_total')
+
+
+def fill_user_stats(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    UserStats = apps.get_model('users', 'UserStats')
+    Task = apps.get_model('tasks', 'Task')
+    Application = apps.get_model('tasks', 'Application')
+
+    stats = {user_id: UserStats(user_id=user_id) for user_id in User.objects.values_list('id', flat=True)}
+    for total_field, queryset, user_field, active_field, active_condition in (
+            ('authored_total', Task.objects.all(), 'author_id', 'authored_active', Q(status__in=['A', 'P'])),
+            ('implementered_total', Task.objects.all(), 'implementer_id', 'implementered_active', Q(status='P')),
+            ('applications_total', Application.objects.all(), 'applicant_id', 'applications_active',
+             Q(status='S'))):
+        for user_id, total, active in (queryset.exclude(**{f'{user_field}__isnull': True}).order_by()
+                                       .values(user_field)
+                                       .annotate(total=Count('id'), active=Count('id', filter=active_condition))
+                                       .values_list(user_field, 'total', 'active')):
+            setattr(stats[user_id], total_field, total)
+            setattr(stats[user_id], active_field, active)
+    UserStats.objects.bulk_create(stats.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_user_unread_notifications_count'),
+        ('tasks', '0011_task_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True,
+                                              related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('authored_active', models.IntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)])),
+                ('authored_total', models.IntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)])),
+                ('implementered_active', models.IntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)])),
+                ('implementered_total', models.IntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)])),
+                ('applications_active', models.IntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)])),
+                ('applications_total', models.IntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)])),
+            ],
+        ),
+        migrations.RunPython(fill_user_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.1.2 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_userstats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['implementer_rating_normalized', 'id'], name='user_implementer_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['author_rating_normalized', 'id'], name='user_author_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['stage_of_study', 'id'], name='user_stage_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['username'], name='user_username_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
@@ -1,10 +1,15 @@
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.validators import UnicodeUsernameValidator
 from django.core.exceptions import ValidationError
+from collections import defaultdict
+
 from django.db import models
+from django.db.models import F, Case, When, Value
+from django.db.models.functions import Cast
 from django.conf import settings
 import os
 from django.core.validators import MaxValueValidator, MinValueValidator
+from django.utils import timezone
 from django.utils.functional import lazy
 from django.utils.translation import gettext
 
@@ -49,6 +54,9 @@ class User(AbstractUser):
 
     profile_image = models.ImageField(null=True, default=None, blank=True,
                                       upload_to=f'users/user_profile_images')
+    # миниатюры profile_image: {'source': имя оригинала, 'sizes': {размер: {формат: имя файла}}}.
+    # Пишутся воркером generate_profile_thumbnails, пока source не совпадает с profile_image - миниатюр нет
+    profile_image_thumbnails = models.JSONField(default=dict, blank=True, editable=False)
 
     stage_of_study = models.CharField(max_length=2, choices=STAGE_OF_STUDY_CHOICES, default='N')
     course_of_study = models.IntegerField(default=1, validators=[
@@ -73,19 +81,134 @@ class User(AbstractUser):
     show_contacts = models.BooleanField(default=False)
     send_email_notifications = models.BooleanField(default=False)
 
+    # количество непрочитанных уведомлений, поддерживается notifications.models.change_unread_counters
+    unread_notifications_count = models.IntegerField(default=0, validators=[MinValueValidator(0)])
+    # рейтинги меняются только через change_user_rating, поэтому тоже защищены от полного save()
+    counter_fields = ('unread_notifications_count',
+                      'author_rating', 'author_review_counter', 'author_rating_normalized',
+                      'implementer_rating', 'implementer_review_counter', 'implementer_rating_normalized')
+    # поля, которые пишут фоновые воркеры, полный save() тоже их не трогает
+    background_fields = ('profile_image_thumbnails',)
+
+    class Meta(AbstractUser.Meta):
+        # индексы под фильтры и сортировки UserList (users/filters.py), id в конце - для курсорной пагинации
+        indexes = [
+            models.Index(fields=['implementer_rating_normalized', 'id'], name='user_implementer_rating_idx'),
+            models.Index(fields=['author_rating_normalized', 'id'], name='user_author_rating_idx'),
+            # фильтр по ступени обучения в порядке по умолчанию (по id) читается без сортировки,
+            # курс обучения проверяется уже на найденных строках
+            models.Index(fields=['stage_of_study', 'id'], name='user_stage_idx'),
+            # поиск по началу username (LIKE 'prefix%'), opclasses учитываются только в postgres
+            models.Index(fields=['username'], opclasses=['varchar_pattern_ops'], name='user_username_prefix_idx'),
+        ]
+
     def __str__(self):
         return self.username
 
-    def update_author_rating(self):
-        if self.author_review_counter == 0:
-            pass
-        else:
-            self.author_rating_normalized = self.author_rating / self.author_review_counter
-            self.save()
-
-    def update_implementer_rating(self):
-        if self.implementer_review_counter == 0:
-            pass
-        else:
-            self.implementer_rating_normalized = self.implementer_rating / self.implementer_review_counter
-            self.save()
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        user = super().from_db(db, field_names, values)
+        # имя изображения на момент загрузки из бд, по нему сигнал post_save видит замену изображения
+        user._loaded_profile_image = user.__dict__.get('profile_image') or None
+        return user
+
+    def save(self, *args, **kwargs):
+        # при обновлении существующего пользователя не трогаем счетчики, иначе устаревшие значения из памяти
+        # затрут параллельные инкременты
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key
+                                       and field.name not in self.counter_fields + self.background_fields]
+        super().save(*args, **kwargs)
+
+
+def change_user_rating(user_id, role, rating_delta, counter_delta):
+    # role - 'author' или 'implementer'. Сумма оценок, их количество и средняя меняются одним UPDATE:
+    # справа в SET везде старые значения строки, так что параллельные отзывы не теряют друг друга.
+    # Без отзывов средняя возвращается к значению по умолчанию
+    rating, counter, normalized = f'{role}_rating', f'{role}_review_counter', f'{role}_rating_normalized'
+    new_counter = F(counter) + counter_delta
+    User.objects.filter(pk=user_id).update(**{
+        rating: F(rating) + rating_delta,
+        counter: new_counter,
+        normalized: Case(When(**{f'{counter}__gt': -counter_delta},
+                              then=Cast(F(rating) + rating_delta, models.FloatField()) / new_counter),
+                         default=Value(User._meta.get_field(normalized).default)),
+    })
+
+
+USER_STATS_FIELDS = ('authored_active', 'authored_total', 'implementered_active', 'implementered_total',
+                     'applications_active', 'applications_total')
+
+
+class UserStats(models.Model):
+    # статистика пользователя по задачам и заявкам для профиля (UserStatisticsSerializer).
+    # Меняется F() выражениями в тех же транзакциях, что и задачи/заявки (tasks.models.update_user_stats),
+    # пересчитывается целиком командой rebuild_user_stats
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+
+    # задачи, где пользователь автор: активные - статусы A и P
+    authored_active = models.IntegerField(default=0, validators=[MinValueValidator(0)])
+    authored_total = models.IntegerField(default=0, validators=[MinValueValidator(0)])
+    # задачи, где пользователь исполнитель: активные - статус P
+    implementered_active = models.IntegerField(default=0, validators=[MinValueValidator(0)])
+    implementered_total = models.IntegerField(default=0, validators=[MinValueValidator(0)])
+    # заявки пользователя: активные - статус S
+    applications_active = models.IntegerField(default=0, validators=[MinValueValidator(0)])
+    applications_total = models.IntegerField(default=0, validators=[MinValueValidator(0)])
+
+    def __str__(self):
+        return 'stats of ' + str(self.user_id)
+
+
+def change_user_stats(deltas):
+    # deltas - {user_id: {поле UserStats: на сколько изменить}}.
+    # Пользователи с одинаковым набором изменений обновляются одним UPDATE
+    users_by_delta = defaultdict(list)
+    for user_id, user_deltas in deltas.items():
+        user_deltas = tuple(sorted((field, delta) for field, delta in user_deltas.items() if delta))
+        if user_id is not None and user_deltas:
+            users_by_delta[user_deltas].append(user_id)
+    for user_deltas, users_ids in users_by_delta.items():
+        UserStats.objects.filter(user_id__in=users_ids).update(
+            **{field: F(field) + delta for field, delta in user_deltas})
+
+
+THUMBNAIL_JOB_STATUS_CHOICES = [('P', 'pending'), ('D', 'done'), ('F', 'failed')]
+
+
+class ProfileThumbnailJob(models.Model):
+    # задание на миниатюры изображения профиля. Пишется в той же транзакции, что и новое изображение
+    # (users/signals.py), выполняется воркером generate_profile_thumbnails с повторами при ошибках
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='thumbnail_jobs')
+    source = models.CharField(max_length=255)
+
+    status = models.CharField(max_length=1, choices=THUMBNAIL_JOB_STATUS_CHOICES, default='P')
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # выборка очередной пачки воркером
+            models.Index(fields=['status', 'next_attempt_at'], name='thumbnail_job_pending_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'source'], name='thumbnail_job_user_source_uniq'),
+        ]
+
+    def __str__(self):
+        return 'thumbnails of ' + self.source
+
+
+def schedule_profile_thumbnails(users):
+    # задания на миниатюры текущих изображений users. Для изображения, которое уже обрабатывалось
+    # (пользователь вернул прежнее), задание переоткрывается
+    jobs = [ProfileThumbnailJob(user_id=user.pk, source=user.profile_image.name) for user in users
+            if user.profile_image]
+    # unique_fields - имена колонок: django 4.1 подставляет их в ON CONFLICT как есть
+    ProfileThumbnailJob.objects.bulk_create(jobs, update_conflicts=True, unique_fields=['user_id', 'source'],
+                                            update_fields=['status', 'attempts', 'next_attempt_at', 'last_error',
+                                                           'finished_at'])
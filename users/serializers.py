@@ -1,21 +1,36 @@
 from rest_framework import serializers
 
-from tasks.models import Task, Application
-from .models import User
+from .models import User, UserStats
+from .thumbnails import get_thumbnails_urls
 
 
 class UserProfileSerializer(serializers.ModelSerializer):
+    profile_image_thumbnails = serializers.SerializerMethodField(read_only=True)
+
     class Meta:
         fields = (
             'first_name',
             'last_name',
             'biography',
             'profile_image',
+            'profile_image_thumbnails',
             'stage_of_study',
             'course_of_study',
         )
         model = User
 
+    def get_profile_image_thumbnails(self, user):
+        return get_thumbnails_urls(user, self.context.get('request'))
+
+    def to_representation(self, user):
+        data = super().to_representation(user)
+        # оригинал может весить несколько мегабайт, его url отдается только с параметром original_image=true,
+        # по умолчанию клиент берет profile_image_thumbnails
+        request = self.context.get('request')
+        if request is None or request.query_params.get('original_image') not in ('true', '1'):
+            data.pop('profile_image')
+        return data
+
 
 class UserContactsSerializer(serializers.ModelSerializer):
     class Meta:
@@ -43,17 +58,20 @@ class UserStatisticsSerializer(serializers.ModelSerializer):
                 'implementer': {'sum': user.implementer_rating, 'amount': user.implementer_review_counter,
                                 'normalized': user.implementer_rating_normalized}}
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.select_related('stats')
+
     def get_tasks(self, user):
-        authored_tasks = Task.objects.filter(author=user)
-        implementered_tasks = Task.objects.filter(implementer=user)
-        applications = Application.objects.filter(applicant=user)
+        # только из UserStats, сырые таблицы задач и заявок не читаются
+        try:
+            stats = user.stats
+        except UserStats.DoesNotExist:
+            stats = UserStats(user=user)
 
-        return {'authored': {'active': authored_tasks.filter(status__in=['A', 'P']).count(),
-                             'total': authored_tasks.count()},
-                'implementered': {'active': implementered_tasks.filter(status='P').count(),
-                                  'total': implementered_tasks.count()},
-                'applications': {'active': applications.filter(status='S').count(),
-                                 'total': applications.count()}}
+        return {'authored': {'active': stats.authored_active, 'total': stats.authored_total},
+                'implementered': {'active': stats.implementered_active, 'total': stats.implementered_total},
+                'applications': {'active': stats.applications_active, 'total': stats.applications_total}}
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -68,6 +86,10 @@ class UserSerializer(serializers.ModelSerializer):
                   'statistics')
         model = User
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return UserStatisticsSerializer.setup_eager_loading(queryset)
+
     def get_statistics(self, user):
         return UserStatisticsSerializer(user).data
 
@@ -85,6 +107,10 @@ class UserDetailSerializer(serializers.ModelSerializer):
                   'statistics')
         model = User
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return UserStatisticsSerializer.setup_eager_loading(queryset)
+
     def get_statistics(self, user):
         return UserStatisticsSerializer(user).data
 
@@ -102,7 +128,7 @@ class UserDetailSerializer(serializers.ModelSerializer):
                     }
 
     def get_profile(self, user):
-        return UserProfileSerializer(user).data
+        return UserProfileSerializer(user, context=self.context).data
 
 
 class UserSettingsSerializer(serializers.ModelSerializer):
@@ -0,0 +1,23 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import User, UserStats, schedule_profile_thumbnails
+
+
+@receiver(post_save, sender=User)
+def create_user_stats(sender, instance, created, raw=False, **kwargs):
+    # loaddata (raw) строки статистики не создает, после загрузки фикстур нужен rebuild_user_stats
+    if created and not raw:
+        UserStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=User)
+def schedule_thumbnails_on_image_change(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    # новое изображение профиля - задание на миниатюры в той же транзакции. Для loaddata (raw)
+    # задания ставит generate_profile_thumbnails --enqueue-missing
+    if raw or (update_fields is not None and 'profile_image' not in update_fields):
+        return
+    image_name = instance.profile_image.name or None
+    if image_name != getattr(instance, '_loaded_profile_image', None):
+        schedule_profile_thumbnails([instance])
+        instance._loaded_profile_image = image_name
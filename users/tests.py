@@ -1,5 +1,22 @@
-from django.test import TestCase
-from .models import User
+import datetime
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+
+from PIL import Image
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.contrib import admin
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from tasks.models import Task, Application
+from .models import User, ProfileThumbnailJob
 
 
 class UserTests(TestCase):
@@ -44,3 +61,191 @@ class UserTests(TestCase):
         self.assertEqual(years_of_study, '5')
         self.assertEqual(contact_phone, '+78888888888')
         self.assertEqual(contact_email, 'testusercontact1@etest.com')
+
+
+class AdminCounterFieldsTests(TestCase):
+    def test_counter_fields_are_not_editable_in_admin(self):
+        # полный save() не пишет счетчики и поля фоновых воркеров, в форме админки их быть не должно
+        request = RequestFactory().get('/admin/')
+        request.user = User.objects.create_superuser(username='admin', email='admin@test.com', password='abc123')
+        for model, model_admin in admin.site._registry.items():
+            protected_fields = set(getattr(model, 'counter_fields', ())) | set(getattr(model, 'background_fields', ()))
+            if protected_fields:
+                with self.subTest(model=model.__name__):
+                    # для User без объекта вернется форма добавления, проверяем форму изменения
+                    form = model_admin.get_form(request, request.user if model is User else None)
+                    self.assertFalse(protected_fields & set(form.base_fields))
+
+
+class UserStatisticsQueriesTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(username=f'user{i}', email=f'user{i}@test.com', password='abc123')
+                     for i in range(10)]
+        deadline = timezone.now() + datetime.timedelta(days=7)
+        for i, user in enumerate(cls.users):
+            for status in 'APC'[:i % 3 + 1]:
+                task = Task.objects.create(author=user, implementer=cls.users[(i + 1) % 10], title='Задача',
+                                           description='Описание', status=status,
+                                           stop_accepting_applications_at=deadline)
+                Application.objects.create(applicant=cls.users[(i + 2) % 10], task=task,
+                                           status='S' if status == 'A' else 'A')
+        # данные созданы в обход api, статистику пересчитываем целиком
+        call_command('rebuild_user_stats', stdout=StringIO())
+
+    def test_user_list_queries_do_not_depend_on_users_count(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/users/')
+        self.assertEqual(len(response.data['users']), 10)
+
+        # user2: автор задач A, P, C, исполнитель задач user1 (A, P), заявки на задачи user0 (A)
+        statistics = next(user for user in response.data['users'] if user['username'] == 'user2')['statistics']
+        self.assertEqual(statistics['tasks'], {'authored': {'active': 2, 'total': 3},
+                                               'implementered': {'active': 1, 'total': 2},
+                                               'applications': {'active': 1, 'total': 1}})
+
+    def test_user_detail_queries(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/users/user2')
+        self.assertEqual(response.data['statistics']['tasks']['authored'], {'active': 2, 'total': 3})
+
+
+class UserListTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(username=f'{"ivan" if i % 2 else "petr"}{i}', email=f'user{i}@test.com',
+                                              password='abc123', stage_of_study='SB'[i % 2], course_of_study=i % 4 + 1)
+                     for i in range(12)]
+        # рейтинги меняются в обход save(), см. User.counter_fields
+        for i, user in enumerate(cls.users):
+            User.objects.filter(pk=user.pk).update(implementer_rating_normalized=i % 5, author_rating_normalized=10 - i)
+
+    def get_all_pages(self, params):
+        usernames = []
+        url = '/api/v1/users/'
+        while url is not None:
+            response = self.client.get(url, {**params, 'page_size': 5} if url == '/api/v1/users/' else None)
+            self.assertEqual(response.status_code, 200)
+            usernames += [user['username'] for user in response.data['users']]
+            url = response.data['next']
+        return usernames
+
+    def test_filters_sort_and_cursor_pagination(self):
+        expected = [user.username for user in sorted(self.users, key=lambda user: (-(self.users.index(user) % 5),
+                                                                                      -user.id))]
+        self.assertEqual(self.get_all_pages({'sort': '-implementer_rating'}), expected)
+
+        expected = [user.username for user in self.users if user.stage_of_study == 'B' and user.course_of_study >= 3]
+        self.assertEqual(self.get_all_pages({'stage': 'B', 'course_min': 3}), expected)
+
+        self.assertEqual(self.get_all_pages({'username_prefix': 'ivan1', 'sort': 'author_rating'}),
+                         ['ivan11', 'ivan1'])
+
+    def test_invalid_parameters(self):
+        for params in ({'sort': 'password'}, {'sort': '--username'}, {'stage': 'X'}, {'course_min': 'abc'}):
+            response = self.client.get('/api/v1/users/', params)
+            self.assertEqual(response.status_code, 400)
+
+        next_url = self.client.get('/api/v1/users/', {'page_size': 5}).data['next']
+        # курсор привязан к фильтрам, при которых он выдан
+        response = self.client.get(next_url + '&sort=author_rating')
+        self.assertEqual(response.data['error_code'], 'invalid_cursor')
+
+    def test_sorts_use_indexes(self):
+        # как TaskListQueryPlanTests: запрос страницы (в том числе следующей по курсору) не проходит всю таблицу
+        for params in ({'sort': 'implementer_rating'}, {'sort': '-implementer_rating'},
+                       {'sort': '-author_rating'}, {'sort': 'username'}, {'stage': 'B'}):
+            first_page = self.client.get('/api/v1/users/', {**params, 'page_size': 5})
+            for url, query_params in (('/api/v1/users/', {**params, 'page_size': 5}), (first_page.data['next'], None)):
+                with CaptureQueriesContext(connection) as queries:
+                    self.client.get(url, query_params)
+                with connection.cursor() as cursor:
+                    if connection.vendor == 'postgresql':
+                        cursor.execute('SET enable_seqscan = off')
+                        cursor.execute('EXPLAIN ' + queries[0]['sql'])
+                        plan = [row[0] for row in cursor.fetchall()]
+                        cursor.execute('RESET enable_seqscan')
+                        self.assertFalse([line for line in plan if 'Seq Scan on users_user' in line], (params, plan))
+                    else:
+                        cursor.execute('EXPLAIN QUERY PLAN ' + queries[0]['sql'])
+                        plan = [row[-1] for row in cursor.fetchall()]
+                        self.assertFalse([line for line in plan if line.startswith('SCAN users_user')
+                                          and ' USING ' not in line], (params, plan))
+                        self.assertFalse([line for line in plan if 'TEMP B-TREE' in line], (params, plan))
+
+
+class ProfileThumbnailTests(APITestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(username='owner', email='owner@test.com', password='abc123')
+        self.client.force_authenticate(self.user)
+
+    @staticmethod
+    def make_image(size, color, image_format='PNG', name='photo.png'):
+        buffer = BytesIO()
+        Image.new('RGBA', size, color).save(buffer, image_format)
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def upload(self, image):
+        response = self.client.patch(f'/api/v1/users/{self.user.id}/edit_profile', {'profile_image': image},
+                                     format='multipart')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def run_worker(self):
+        call_command('generate_profile_thumbnails', '--once', stdout=StringIO())
+
+    def test_thumbnails_are_built_in_background_and_served_instead_of_original(self):
+        response = self.upload(self.make_image((600, 400), (200, 0, 0, 128)))
+        # в запросе миниатюры не строятся, только ставится задание
+        self.assertIsNone(response.data['profile_image_thumbnails'])
+        self.assertNotIn('profile_image', response.data)
+        self.assertEqual(ProfileThumbnailJob.objects.filter(user=self.user, status='P').count(), 1)
+
+        self.run_worker()
+
+        profile = self.client.get('/api/v1/users/owner').data['profile']
+        self.assertNotIn('profile_image', profile)
+        self.user.refresh_from_db()
+        directory = os.path.dirname(self.user.profile_image.name)
+        for size_name, size in (('small', 64), ('medium', 256)):
+            for image_format, extension in (('webp', '.webp'), ('jpeg', '.jpg')):
+                name = self.user.profile_image_thumbnails['sizes'][size_name][image_format]
+                self.assertEqual(os.path.dirname(name), directory)
+                self.assertRegex(os.path.basename(name), '^[0-9a-f]{40}' + extension.replace('.', r'\.') + '$')
+                self.assertTrue(profile['profile_image_thumbnails'][size_name][image_format].endswith(name))
+                with Image.open(os.path.join(self.media_root, name)) as thumbnail:
+                    self.assertEqual((thumbnail.format, thumbnail.size), (image_format.upper(), (size, size)))
+
+        profile = self.client.get('/api/v1/users/owner', {'original_image': 'true'}).data['profile']
+        self.assertTrue(profile['profile_image'].endswith(self.user.profile_image.url))
+
+        # сохранение профиля без нового изображения заданий не ставит и миниатюры не затирает
+        self.client.patch(f'/api/v1/users/{self.user.id}/edit_profile', {'biography': 'text'})
+        self.assertEqual(ProfileThumbnailJob.objects.filter(status='P').count(), 0)
+        self.user.refresh_from_db()
+        self.assertIn('sizes', self.user.profile_image_thumbnails)
+
+    def test_replaced_and_broken_images(self):
+        self.upload(self.make_image((300, 300), (0, 200, 0, 255)))
+        # изображение заменили до того, как воркер дошел до первого задания
+        self.upload(self.make_image((300, 300), (0, 0, 200, 255)))
+        self.run_worker()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.profile_image_thumbnails['source'], self.user.profile_image.name)
+        self.assertEqual(ProfileThumbnailJob.objects.filter(status='D').count(), 2)
+
+        # файл, который не открывается как изображение, сразу помечается failed
+        User.objects.filter(pk=self.user.pk).update(profile_image='users/user_profile_images/broken.png')
+        os.makedirs(os.path.join(self.media_root, 'users/user_profile_images'), exist_ok=True)
+        with open(os.path.join(self.media_root, 'users/user_profile_images/broken.png'), 'wb') as file:
+            file.write(b'not an image')
+        call_command('generate_profile_thumbnails', '--once', '--enqueue-missing', stdout=StringIO())
+        job = ProfileThumbnailJob.objects.get(source='users/user_profile_images/broken.png')
+        self.assertEqual((job.status, job.attempts), ('F', 1))
+        self.assertIsNone(self.client.get('/api/v1/users/owner').data['profile']['profile_image_thumbnails'])
@@ -0,0 +1,74 @@
+import hashlib
+import posixpath
+from io import BytesIO
+
+from PIL import Image, ImageOps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+# миниатюры изображения профиля (PROFILE_IMAGE_THUMBNAIL_SIZES) строит воркер generate_profile_thumbnails.
+# Квадрат по центру изображения, в webp и jpeg (для клиентов без webp). Файлы лежат рядом с оригиналом,
+# имя - sha1 содержимого, так что их можно отдавать с вечным кэшированием
+
+THUMBNAIL_FORMATS = {
+    'webp': ('WEBP', '.webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', '.jpg', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+
+def open_profile_image(name, storage=default_storage):
+    largest_size = max(settings.PROFILE_IMAGE_THUMBNAIL_SIZES.values())
+    with storage.open(name) as file:
+        image = Image.open(file)
+        # jpeg декодируется сразу в уменьшенном масштабе (1/2 - 1/8), если он все еще больше самой крупной
+        # миниатюры: многомегапиксельные фото с телефона не разворачиваются в память целиком
+        image.draft('RGB', (largest_size * 2, largest_size * 2))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        # прозрачность на белом фоне, jpeg ее не поддерживает
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def save_thumbnail(image, directory, image_format, storage=default_storage):
+    pil_format, extension, options = THUMBNAIL_FORMATS[image_format]
+    buffer = BytesIO()
+    image.save(buffer, pil_format, **options)
+    content = buffer.getvalue()
+    name = posixpath.join(directory, hashlib.sha1(content).hexdigest() + extension)
+    if not storage.exists(name):
+        name = storage.save(name, ContentFile(content))
+    return name
+
+
+def make_profile_thumbnails(source, storage=default_storage):
+    # возвращает значение для User.profile_image_thumbnails
+    image = open_profile_image(source, storage)
+    directory = posixpath.dirname(source)
+    sizes = {}
+    # от большей миниатюры к меньшей, каждая следующая уменьшается из предыдущей, а не из оригинала
+    for size_name, size in sorted(settings.PROFILE_IMAGE_THUMBNAIL_SIZES.items(), key=lambda item: -item[1]):
+        image = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+        sizes[size_name] = {image_format: save_thumbnail(image, directory, image_format, storage)
+                            for image_format in THUMBNAIL_FORMATS}
+    return {'source': source, 'sizes': sizes}
+
+
+def get_thumbnails_urls(user, request=None, storage=default_storage):
+    # {размер: {формат: url}} или None, если изображения нет или миниатюры для него еще не готовы
+    thumbnails = user.profile_image_thumbnails
+    if not user.profile_image or thumbnails.get('source') != user.profile_image.name:
+        return None
+    urls = {}
+    for size_name, names in thumbnails['sizes'].items():
+        urls[size_name] = {}
+        for image_format, name in names.items():
+            url = storage.url(name)
+            urls[size_name][image_format] = request.build_absolute_uri(url) if request is not None else url
+    return urls
@@ -1,4 +1,8 @@
 from rest_framework import generics, permissions
+from rest_framework.response import Response
+
+from assistance_platform_project.pagination import KeysetPagination
+from .filters import UserFilterSpec
 from .models import User
 from .serializers import UserSerializer, UserDetailSerializer, UserRegistrationSerializer, UserSettingsSerializer, \
     UserContactsSerializer, UserProfileSerializer
@@ -8,16 +12,40 @@ from rest_framework import response, status
 
 
 class UserList(generics.ListAPIView):
+    # фильтры и сортировка - users/filters.py, курсорная пагинация как у списка заданий
     permission_classes = (permissions.AllowAny,)
-    queryset = User.objects.all()
     serializer_class = UserSerializer
+    pagination_class = KeysetPagination
+
+    def get_filter_spec(self):
+        if not hasattr(self, 'filter_spec'):
+            self.filter_spec = UserFilterSpec.from_request(self.request.query_params)
+        return self.filter_spec
+
+    def get_pagination_key(self):
+        return self.get_filter_spec().digest
+
+    def get_queryset(self):
+        spec = self.get_filter_spec()
+        queryset = spec.order(spec.filter(User.objects.all()))
+        return self.get_serializer_class().setup_eager_loading(queryset)
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        serializer = self.get_serializer(page, many=True)
+        return Response({'users': serializer.data,
+                         'filters': self.get_filter_spec().as_query_params(),
+                         'next': self.paginator.get_next_link(),
+                         'previous': self.paginator.get_previous_link()})
 
 
 class UserDetail(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = (IsAccountOwnerOrReadOnly,)
-    queryset = User.objects.all()
     serializer_class = UserDetailSerializer
 
+    def get_queryset(self):
+        return self.get_serializer_class().setup_eager_loading(User.objects.all())
+
 
 class UserRegistration(generics.CreateAPIView):
     permission_classes = (permissions.AllowAny,)